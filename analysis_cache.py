@@ -0,0 +1,94 @@
+import time
+import sqlite3
+import hashlib
+import threading
+from collections import OrderedDict
+
+def image_content_hash(image, mode="bytes"):
+    """
+    Hashes the decoded image. "bytes" is a SHA-256 of the exact pixels, so only identical images share
+    an entry. "perceptual" is a 64-bit difference hash of a 9x8 grayscale thumbnail, so re-encoded or
+    slightly resized copies of the same photo share an entry as well.
+    """
+    if mode == "perceptual":
+        pixels = list(image.convert("L").resize((9, 8)).getdata())
+        bits = 0
+        for row in range(8):
+            for col in range(8):
+                bits = (bits << 1) | (pixels[row * 9 + col] > pixels[row * 9 + col + 1])
+        return f"d{bits:016x}"
+    digest = hashlib.sha256()
+    digest.update(f"{image.mode}:{image.width}x{image.height}:".encode())
+    digest.update(image.tobytes())
+    return digest.hexdigest()
+
+class AnalysisCache:
+    """
+    Content-addressed store of room analyses: a bounded in-memory LRU, optionally backed by a SQLite
+    file that survives restarts and is shared by workers on the same host. Keys combine the image
+    hash with the model name and the analysis prompt version, so changing either invalidates entries.
+    """
+    def __init__(self, model_name, prompt_version, max_entries=1024, sqlite_path=None, hash_mode="bytes"):
+        self.namespace = f"{model_name}:{prompt_version}"
+        self.max_entries = max_entries
+        self.hash_mode = hash_mode
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+        if sqlite_path:
+            self._db = sqlite3.connect(sqlite_path, check_same_thread=False)
+            self._db.execute("CREATE TABLE IF NOT EXISTS room_analysis (key TEXT PRIMARY KEY, analysis TEXT NOT NULL, created_at REAL NOT NULL)")
+            self._db.commit()
+
+    @classmethod
+    def from_config(cls, config, model_name, prompt_version):
+        cache_config = config.get("ANALYSIS_CACHE", {})
+        return cls(
+            model_name, prompt_version, max_entries=cache_config.get("max_entries", 1024),
+            sqlite_path=cache_config.get("sqlite_path"), hash_mode=cache_config.get("hash", "bytes")
+        )
+
+    def key_for(self, image, seed=None):
+        """Seeded analyses are stored apart from unseeded ones so a seeded request is reproducible."""
+        key = f"{self.namespace}:{image_content_hash(image, self.hash_mode)}"
+        return key if seed is None else f"{key}:seed={seed}"
+
+    def get(self, key):
+        with self._lock:
+            analysis = self._entries.get(key)
+            if analysis is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return analysis
+            if self._db is not None:
+                row = self._db.execute("SELECT analysis FROM room_analysis WHERE key = ?", (key,)).fetchone()
+                if row is not None:
+                    self._remember(key, row[0])
+                    self.hits += 1
+                    self.disk_hits += 1
+                    return row[0]
+            self.misses += 1
+            return None
+
+    def put(self, key, analysis):
+        with self._lock:
+            self._remember(key, analysis)
+            if self._db is not None:
+                self._db.execute("INSERT OR REPLACE INTO room_analysis (key, analysis, created_at) VALUES (?, ?, ?)", (key, analysis, time.time()))
+                self._db.commit()
+
+    def _remember(self, key, analysis):
+        self._entries[key] = analysis
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries), "max_entries": self.max_entries, "hits": self.hits, "disk_hits": self.disk_hits,
+            "misses": self.misses, "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0
+        }
@@ -1,14 +1,27 @@
 from fastapi import FastAPI, HTTPException
+from fastapi.responses import StreamingResponse, PlainTextResponse
 from pydantic import BaseModel, HttpUrl
+from typing import Optional, List
 import torch
 import json
-from model_utils import setup_environment, load_model_adaptive, load_processor, run_inference, validate_image_url
-from prompt_engineering import create_analysis_prompt, create_placement_prompt
+import time
+import queue
+import asyncio
+import threading
+import httpx
+from model_utils import setup_environment, load_model_and_processor, make_streamer, configure_image_budget, prepare_image
+from image_utils import fetch_image_async
+from batching import QueueFullError, DeadlineExceededError
+from worker_pool import serving_replicas
+from metrics import REGISTRY, record_error
+from prompt_engineering import max_variants
+from prompt_templates import get_prompt_compiler
+from design_pipeline import DesignPipeline, PipelineError, request_params
 
 app = FastAPI(title="AI Interior Designer API")
-model = None
-processor = None
-config = None
+pipeline = None
+http_client = None
+watch_task = None
 
 class DesignRequest(BaseModel):
     room_type: str = "living room"
@@ -16,20 +29,36 @@ class DesignRequest(BaseModel):
     image_url: HttpUrl = "https://photos.zillowstatic.com/fp/3c83c384a192683219780302babe5ea9-p_f.jpg"
     max_tokens: int = 180
     important_prompt: str = ""
+    timeout_seconds: Optional[float] = None
+    bypass_cache: bool = False
+    max_pixels: Optional[int] = None
+    profile: bool = False
+    seed: Optional[int] = None
+
+class DesignVariant(BaseModel):
+    id: Optional[str] = None
+    room_type: str = "living room"
+    style: str = "industrial"
+    important_prompt: str = ""
+    max_tokens: Optional[int] = None
+
+class BatchDesignRequest(BaseModel):
+    image_url: HttpUrl = "https://photos.zillowstatic.com/fp/3c83c384a192683219780302babe5ea9-p_f.jpg"
+    variants: List[DesignVariant]
+    max_tokens: int = 180
+    timeout_seconds: Optional[float] = None
+    bypass_cache: bool = False
+    max_pixels: Optional[int] = None
+    seed: Optional[int] = None
 
 @app.on_event("startup")
 async def startup_event():
     """Load models and config on server startup to handle 'cold start'."""
-    global model, processor, config
+    global pipeline, http_client, watch_task
     
     setup_environment()
     if torch.cuda.is_available(): torch.cuda.empty_cache()
 
-    print("Loading model and processor...")
-    model, _, _ = load_model_adaptive()
-    processor = load_processor()
-    print("Model and processor loaded.")
-
     print("Loading configuration...")
     try:
         with open("config.json", 'r') as f:
@@ -38,44 +67,165 @@ async def startup_event():
     except FileNotFoundError:
         raise RuntimeError("FATAL: config.json not found. The API cannot start.")
 
-@app.post("/generate", summary="Generate Interior Design Suggestion")
-async def generate_design(request: DesignRequest):
+    # Replicas are forked from this process; keep its OpenMP pool unused so they start cleanly.
+    if serving_replicas(config) > 1: torch.set_num_threads(1)
+    print("Loading model and processor...")
+    model, processor = load_model_and_processor(config)
+    print("Model and processor loaded.")
+
+    configure_image_budget(processor, config.get("IMAGE_PREPROCESSING", {}))
+    pipeline = DesignPipeline(model, processor, config)
+    http_client = httpx.AsyncClient(limits=httpx.Limits(max_connections=64, max_keepalive_connections=16))
+    REGISTRY.gauge("vlm_queue_depth", "Jobs waiting in the batching engine.", pipeline.engine.queue_depth)
+    REGISTRY.gauge("vlm_engine_busy", "1 while the batching engine is running a batch.", lambda: pipeline.engine.busy)
+    if pipeline.config_watcher.interval_s: watch_task = asyncio.create_task(watch_config())
+
+async def watch_config():
+    """Applies edits to config.json without a restart; the recompile runs off the event loop."""
+    while True:
+        await asyncio.sleep(pipeline.config_watcher.interval_s)
+        await asyncio.to_thread(pipeline.reload)
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    if watch_task is not None: watch_task.cancel()
+    if http_client is not None: await http_client.aclose()
+    if pipeline is not None: await asyncio.to_thread(pipeline.engine.shutdown)
+
+@app.get("/health", summary="Liveness and queue status")
+async def health():
+    """Answers from the event loop without touching the model, so it stays responsive during generation."""
+    if pipeline is None:
+        return {"status": "loading"}
+    engine = pipeline.engine
+    return {
+        "status": "ok", "queue_depth": engine.queue_depth(), "max_queue_size": engine.max_queue_size, "busy": engine.busy,
+        "analysis_cache": pipeline.analysis_cache.stats(), "response_cache": pipeline.response_cache.stats() if pipeline.response_cache is not None else None,
+        "coalescer": pipeline.coalescer.stats(), "prompt_templates": get_prompt_compiler(pipeline.processor).stats()
+    }
+
+@app.get("/metrics", summary="Prometheus metrics", response_class=PlainTextResponse)
+async def metrics():
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
+async def run_pipeline(coroutine):
     """
-    Receives design parameters, runs the full AI pipeline, and returns a furniture placement suggestion.
+    Awaits a DesignPipeline coroutine on the event loop. A full queue becomes 503 with Retry-After as
+    soon as the engine rejects the job, a missed deadline 504 and a failed stage 500.
     """
-    global model, processor, config
-    
     try:
-        validate_image_url(str(request.image_url))
+        return await coroutine
+    except QueueFullError as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+    except DeadlineExceededError:
+        raise HTTPException(status_code=504, detail="Request deadline exceeded before inference completed.")
+    except PipelineError as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+async def fetch_room_image(request):
+    """Fetches, validates and resizes the request's image to its pixel budget."""
+    try:
+        image = await fetch_image_async(http_client, str(request.image_url))
     except ValueError as e:
+        record_error("image_validation", "invalid_input")
         raise HTTPException(status_code=400, detail=f"Image Validation Error: {e}")
+    return await asyncio.to_thread(prepare_image, pipeline.processor, image, request.max_pixels)
 
-    furniture_config = config.get("FURNITURE_CONFIG", {})
-    style_materials = config.get("STYLE_MATERIALS", {})
+def request_deadline(request):
+    timeout = request.timeout_seconds or pipeline.config.get("SERVING", {}).get("request_timeout_s", 120)
+    return time.monotonic() + timeout
 
-    _, analysis_messages = create_analysis_prompt(str(request.image_url))
-    analysis_output, _, success = run_inference(model, processor, {'messages': analysis_messages}, max_new_tokens=100)
-    if not success or not analysis_output:
-        raise HTTPException(status_code=500, detail="Failed to analyze the room image.")
-    room_analysis = analysis_output[0]
+@app.post("/generate", summary="Generate Interior Design Suggestion")
+async def generate_design(request: DesignRequest):
+    """
+    Receives design parameters, runs the full AI pipeline, and returns a furniture placement suggestion.
+    Identical requests in flight at the same time share one run; completed ones are served from the
+    response cache when RESPONSE_CACHE is enabled.
+    """
+    deadline = request_deadline(request)
+    params = request_params(request.model_dump())
+    image = await fetch_room_image(request)
+    key = await asyncio.to_thread(pipeline.response_key, "design", image, params)
+    design = await run_pipeline(pipeline.cached_response("/generate", params, key, lambda: pipeline.design(image, params, deadline), deadline))
+    return {"suggestion": design["suggestion"], "metrics": design["metrics"]}
 
-    _, placement_messages = create_placement_prompt(request.room_type, request.style, str(request.image_url), room_analysis, furniture_config, style_materials)
+@app.post("/generate/batch", summary="Generate Several Style Variants of One Room")
+async def generate_design_batch(request: BatchDesignRequest):
+    """
+    Fetches, encodes and analyzes the room once, then generates every variant's placement in a single
+    batched generate() call. Suggestions are keyed by the variant's id, or "room_type/style" by default.
+    """
+    if not request.variants:
+        raise HTTPException(status_code=400, detail="At least one variant is required.")
+    if len(request.variants) > max_variants(pipeline.config):
+        raise HTTPException(status_code=400, detail=f"At most {max_variants(pipeline.config)} variants are allowed per request.")
+    deadline = request_deadline(request)
+    params = request_params(request.model_dump())
+    image = await fetch_room_image(request)
+    key = await asyncio.to_thread(pipeline.response_key, "batch", image, params)
+    return await run_pipeline(pipeline.cached_response("/generate/batch", params, key, lambda: pipeline.design_batch(image, params, deadline), deadline))
 
-    if request.important_prompt:
-        for message in placement_messages:
-            if message['role'] == 'user':
-                for content_part in message['content']:
-                    if content_part['type'] == 'text':
-                        content_part['text'] += f"\n\n**Very Important Note:** {request.important_prompt}"
-                        break
-                break
+def sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
 
-    final_output, _, success = run_inference(model, processor, {'messages': placement_messages}, max_new_tokens=request.max_tokens)
-    
-    if success and final_output:
-        return {"suggestion": final_output[0]}
-    else:
-        raise HTTPException(status_code=500, detail="Failed to generate a final placement suggestion.")
+@app.post("/generate/stream", summary="Stream an Interior Design Suggestion (Server-Sent Events)")
+async def generate_design_stream(request: DesignRequest):
+    """
+    Same pipeline as /generate, streamed as Server-Sent Events: a 'stage' event once the room analysis
+    is done, 'token' events as placement text is decoded, then 'done' (or 'error'). Closing the
+    connection stops generation and frees the model. A response-cache hit is replayed as the same
+    events, with the whole suggestion in a single 'token' event.
+    """
+    deadline = request_deadline(request)
+    params = request_params(request.model_dump())
+    image = await fetch_room_image(request)
+    key = await asyncio.to_thread(pipeline.response_key, "design", image, params)
+    design = pipeline.cached_lookup("/generate/stream", params, key)
+    if design is not None:
+        async def replay():
+            yield sse_event("stage", {"stage": "analysis", "room_analysis": design["room_analysis"]})
+            yield sse_event("token", {"text": design["suggestion"]})
+            yield sse_event("done", {"suggestion": design["suggestion"], "metrics": design["metrics"]})
+        return StreamingResponse(replay(), media_type="text/event-stream")
+    vision, room_analysis, placement_messages, analysis_metrics = await run_pipeline(pipeline.prepare_placement(image, params, deadline))
+
+    inputs = pipeline.placement_inputs(params, vision, placement_messages)
+    inputs['streamer'] = streamer = make_streamer(pipeline.processor, timeout=max(1.0, deadline - time.monotonic()), stop=inputs['stop'])
+    inputs['cancel_event'] = cancel_event = threading.Event()
+    try:
+        future = pipeline.engine.submit("placement", inputs, max_new_tokens=params["max_tokens"], deadline=deadline)
+    except QueueFullError as e:
+        record_error("placement", "queue_full")
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+
+    async def events():
+        yield sse_event("stage", {"stage": "analysis", "room_analysis": room_analysis})
+        tokens = iter(streamer)
+        try:
+            while True:
+                text = await asyncio.to_thread(next, tokens, None)
+                if text is None:
+                    break
+                if text:
+                    yield sse_event("token", {"text": text})
+            final_output, stats, success = await asyncio.wrap_future(future)
+            if success and final_output:
+                design = {"room_analysis": room_analysis, "suggestion": final_output[0], "metrics": {"analysis": analysis_metrics, "placement": stats}}
+                pipeline.cache_response("/generate/stream", params, key, design)
+                yield sse_event("done", {"suggestion": design["suggestion"], "metrics": design["metrics"]})
+            else:
+                yield sse_event("error", {"detail": "Failed to generate a final placement suggestion."})
+        except QueueFullError as e:
+            record_error("placement", "queue_full")
+            yield sse_event("error", {"detail": str(e), "retry_after": e.retry_after})
+        except (queue.Empty, DeadlineExceededError):
+            record_error("placement", "deadline")
+            yield sse_event("error", {"detail": "Request deadline exceeded before inference completed."})
+        finally:
+            cancel_event.set()
+            future.cancel()
+
+    return StreamingResponse(events(), media_type="text/event-stream")
 
 if __name__ == "__main__":
     import uvicorn
@@ -0,0 +1,210 @@
+import os
+import csv
+import json
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from image_utils import decode_image
+from model_utils import validate_image_url, prepare_image, encode_images, run_inference_batch, DEFAULT_MODEL_NAME
+from analysis_cache import AnalysisCache
+from prompt_engineering import create_analysis_prompt, create_placement_prompt, apply_important_prompt, placement_checklist, placement_design_rules, design_rules_enabled, create_stop_rule
+from prompt_templates import prompt_versions
+
+def read_manifest(path):
+    """
+    Reads a JSONL or CSV manifest. Each item needs an image URL or local path ("image", "image_url" or
+    "image_path") and may set room_type, style, important_prompt, max_tokens and a stable "id".
+    """
+    with open(path, 'r', newline='') as f:
+        if path.endswith(".csv"):
+            rows = list(csv.DictReader(f))
+        else:
+            rows = [json.loads(line) for line in f if line.strip()]
+    items = []
+    for row in rows:
+        image = row.get("image") or row.get("image_url") or row.get("image_path")
+        item = {
+            "image": image,
+            "room_type": row.get("room_type") or "living room",
+            "style": row.get("style") or "industrial",
+            "important_prompt": row.get("important_prompt") or "",
+            "max_tokens": int(row["max_tokens"]) if row.get("max_tokens") else None,
+        }
+        item["id"] = row.get("id") or f"{image}|{item['room_type']}|{item['style']}"
+        items.append(item)
+    return items
+
+def completed_ids(output_path):
+    """Ids already written successfully to the output JSONL; failed items are retried on resume."""
+    if not os.path.exists(output_path):
+        return set()
+    done = set()
+    with open(output_path, 'r') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue  # A line cut short by an interrupted run.
+            if record.get("status") == "ok":
+                done.add(record["id"])
+    return done
+
+def load_image(image_ref):
+    if not image_ref:
+        raise ValueError("Manifest item has no image.")
+    if image_ref.startswith(("http://", "https://")):
+        return validate_image_url(image_ref)
+    with open(image_ref, 'rb') as f:
+        return decode_image(f.read(), min_resolution=(400, 400))
+
+class _WorkerStats:
+    """Items and busy seconds per prefetch thread, for throughput reporting."""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.items = {}
+        self.seconds = {}
+
+    def add(self, seconds):
+        name = threading.current_thread().name
+        with self._lock:
+            self.items[name] = self.items.get(name, 0) + 1
+            self.seconds[name] = self.seconds.get(name, 0.0) + seconds
+
+    def report(self):
+        with self._lock:
+            return {name: f"{self.items[name]} images, {self.items[name] / self.seconds[name]:.2f} img/s" for name in sorted(self.items) if self.seconds[name] > 0}
+
+class BatchRunner:
+    """
+    Runs the analysis and placement pipeline over a manifest with the model loaded once. A thread pool
+    downloads, decodes and downsizes images ahead of the model; each batch of images goes through the
+    vision tower in one pass and through analysis and placement as batched generate() calls.
+    Results are appended to a JSONL file as each batch finishes, so an interrupted run resumes where it
+    stopped. A failing item is recorded with its error instead of aborting the run.
+    """
+    def __init__(self, model, processor, config, batch_size=4, prefetch_workers=8, default_max_tokens=180):
+        self.model = model
+        self.processor = processor
+        self.config = config
+        self.batch_size = batch_size
+        self.prefetch_workers = prefetch_workers
+        self.default_max_tokens = default_max_tokens
+        self.analysis_cache = AnalysisCache.from_config(config, DEFAULT_MODEL_NAME, prompt_versions(processor, config)["analysis"])
+        self.prefetch_stats = _WorkerStats()
+
+    def _prefetch(self, item):
+        start = time.perf_counter()
+        try:
+            return prepare_image(self.processor, load_image(item["image"])), None
+        except Exception as e:
+            return None, f"Image Input Error: {e}"
+        finally:
+            self.prefetch_stats.add(time.perf_counter() - start)
+
+    def _run_stage(self, rows, max_new_tokens, stage):
+        """
+        Runs rows as one batch; if the batch fails (e.g. out of memory), retries each row alone so one
+        bad item cannot fail its neighbours. Returns a (text, stats, error) triple per row.
+        """
+        outputs, stats, success = run_inference_batch(self.model, self.processor, rows, max_new_tokens, stage=stage)
+        if success:
+            return [(output, stats, None) for output in outputs]
+        if len(rows) == 1:
+            return [(None, stats, stats.get("error_detail") or stats.get("error"))]
+        return [result for row, limit in zip(rows, max_new_tokens) for result in self._run_stage([row], [limit], stage)]
+
+    def _analyze(self, images, visions):
+        """Room analysis per image, from the cache where possible; returns (analysis, error) pairs."""
+        keys = [self.analysis_cache.key_for(image) for image in images]
+        analyses = [(self.analysis_cache.get(key), None) for key in keys]
+        missing = [i for i, (analysis, _) in enumerate(analyses) if analysis is None]
+        if missing:
+            stop = create_stop_rule(self.config.get("STOPPING", {}), "analysis")
+            rows = [{'messages': create_analysis_prompt(images[i])[1], 'vision': visions[i], 'stop': stop} for i in missing]
+            for i, (text, _, error) in zip(missing, self._run_stage(rows, [100] * len(rows), "analysis")):
+                if text:
+                    self.analysis_cache.put(keys[i], text)
+                analyses[i] = (text, error or (None if text else "Failed to analyze the room image."))
+        return analyses
+
+    def _process_batch(self, batch):
+        """batch is a list of (item, image, error); returns one output record per item."""
+        records = [{"id": item["id"], "image": item["image"], "room_type": item["room_type"], "style": item["style"], "status": "error", "error": error} for item, _, error in batch]
+        ready = [(record, item, image) for record, (item, image, error) in zip(records, batch) if error is None]
+        if not ready:
+            return records
+        try:
+            visions = encode_images(self.model, self.processor, [image for _, _, image in ready])
+        except Exception as e:
+            for record, _, _ in ready:
+                record["error"] = f"Failed to encode the room image: {e}"
+            return records
+
+        analyses = self._analyze([image for _, _, image in ready], visions)
+        furniture_config = self.config.get("FURNITURE_CONFIG", {})
+        rows, limits, placed = [], [], []
+        for (record, item, image), vision, (room_analysis, error) in zip(ready, visions, analyses):
+            record["room_analysis"] = room_analysis
+            if error:
+                record["error"] = error
+                continue
+            design_rules = placement_design_rules(item["room_type"]) if design_rules_enabled(self.config) else ()
+            _, messages = create_placement_prompt(item["room_type"], item["style"], image, room_analysis, furniture_config, self.config.get("STYLE_MATERIALS", {}), design_rules)
+            apply_important_prompt(messages, item["important_prompt"])
+            stop = create_stop_rule(self.config.get("STOPPING", {}), "placement", placement_checklist(item["room_type"], furniture_config))
+            rows.append({'messages': messages, 'vision': vision, 'stop': stop})
+            limits.append(item["max_tokens"] or self.default_max_tokens)
+            placed.append(record)
+        if rows:
+            for record, (text, stats, error) in zip(placed, self._run_stage(rows, limits, "placement")):
+                if text:
+                    record.update(status="ok", error=None, suggestion=text, placement_s=round(stats.get("total_s", 0.0), 3))
+                else:
+                    record["error"] = error or "Failed to generate a final placement suggestion."
+        return records
+
+    def run(self, items, output_path, report_every=50):
+        """Processes the items not yet completed in output_path; returns a summary dict."""
+        done = completed_ids(output_path)
+        pending = [item for item in items if item["id"] not in done]
+        print(f"Manifest: {len(items)} items, {len(items) - len(pending)} already completed, {len(pending)} to run.")
+        started = time.perf_counter()
+        model_seconds, succeeded, failed = 0.0, 0, 0
+        lookahead = self.batch_size * 2
+
+        with ThreadPoolExecutor(max_workers=self.prefetch_workers, thread_name_prefix="prefetch") as pool, open(output_path, 'a') as out:
+            futures = [pool.submit(self._prefetch, item) for item in pending[:lookahead]]
+            next_index = len(futures)
+            for batch_start in range(0, len(pending), self.batch_size):
+                batch_items = pending[batch_start:batch_start + self.batch_size]
+                batch = [(item, *futures[batch_start + offset].result()) for offset, item in enumerate(batch_items)]
+                # Keep the pool one batch ahead while the model works on this one.
+                while next_index < min(len(pending), batch_start + self.batch_size + lookahead):
+                    futures.append(pool.submit(self._prefetch, pending[next_index]))
+                    next_index += 1
+                for offset in range(len(batch_items)):
+                    futures[batch_start + offset] = None
+
+                batch_started = time.perf_counter()
+                records = self._process_batch(batch)
+                model_seconds += time.perf_counter() - batch_started
+                for record in records:
+                    out.write(json.dumps(record) + "\n")
+                    succeeded += record["status"] == "ok"
+                    failed += record["status"] != "ok"
+                out.flush()
+
+                processed = succeeded + failed
+                if processed % report_every < len(batch_items) or processed == len(pending):
+                    elapsed = time.perf_counter() - started
+                    print(f"[{processed}/{len(pending)}] {processed / elapsed:.2f} items/s overall, "
+                          f"model worker {processed / model_seconds if model_seconds else 0:.2f} items/s, {failed} failed")
+                    print(f"  prefetch workers: {self.prefetch_stats.report()}")
+
+        elapsed = time.perf_counter() - started
+        return {
+            "processed": succeeded + failed, "succeeded": succeeded, "failed": failed, "skipped": len(items) - len(pending),
+            "elapsed_s": round(elapsed, 2), "items_per_s": round((succeeded + failed) / elapsed, 3) if elapsed else 0.0,
+            "model_items_per_s": round((succeeded + failed) / model_seconds, 3) if model_seconds else 0.0,
+            "prefetch_workers": self.prefetch_stats.report(), "analysis_cache": self.analysis_cache.stats(),
+        }
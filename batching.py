@@ -0,0 +1,198 @@
+import time
+import threading
+from collections import deque
+from concurrent.futures import Future
+from model_utils import run_inference_batch, encode_images
+
+ENCODE_STAGE = "encode"
+
+class QueueFullError(RuntimeError):
+    """Raised by submit when the engine already holds max_queue_size pending jobs."""
+    def __init__(self, retry_after):
+        super().__init__(f"Inference queue is full; retry in about {retry_after}s.")
+        self.retry_after = retry_after
+
+    def __reduce__(self):
+        # Rebuilt from retry_after so the error survives the trip back from a replica process.
+        return (QueueFullError, (self.retry_after,))
+
+class DeadlineExceededError(TimeoutError):
+    """Set on a job's future when its deadline passed before the worker reached it."""
+    def __reduce__(self):
+        return (DeadlineExceededError, self.args)
+
+class _Job:
+    def __init__(self, stage, payload, max_new_tokens, deadline=None, group=False):
+        self.stage = stage
+        self.payload = payload
+        self.max_new_tokens = max_new_tokens
+        self.deadline = deadline
+        self.group = group
+        self.future = Future()
+        self.enqueued_at = time.monotonic()
+
+    @property
+    def streamer(self):
+        return self.payload.get('streamer') if isinstance(self.payload, dict) else None
+
+    @property
+    def solo(self):
+        """Streaming, speculative-decoding, profiled and seeded jobs, and pre-formed groups, run as a batch of their own."""
+        if self.group or self.streamer is not None:
+            return True
+        return isinstance(self.payload, dict) and (bool(self.payload.get('speculative')) or bool(self.payload.get('profile')) or self.payload.get('seed') is not None)
+
+class BatchingEngine:
+    """
+    Owns the model on a single worker thread and serves it through dynamic micro-batching.
+    Jobs are queued per stage ("encode", "analysis", "placement", ...); the worker takes the stage
+    whose oldest job has waited longest, keeps collecting jobs of that stage until the batch window
+    elapses or max_batch_size is reached, and then runs them as one padded batch. Jobs carrying a
+    'streamer' always run alone, since a streamer follows a single sequence, and so do jobs using
+    speculative decoding (batch size 1 only), profiled jobs (so the trace covers only their own
+    request) and groups from submit_group, which are already a batch.
+
+    At most max_queue_size jobs may be pending; beyond that submit raises QueueFullError with a
+    Retry-After estimate. Jobs whose future was cancelled or whose deadline (time.monotonic())
+    has passed are dropped before they reach the model.
+    """
+    def __init__(self, model, processor, max_batch_size=4, batch_window_ms=20, max_queue_size=32):
+        self.model = model
+        self.processor = processor
+        self.max_batch_size = max_batch_size
+        self.batch_window = batch_window_ms / 1000.0
+        self.max_queue_size = max_queue_size
+        self.batches_run = 0
+        self.jobs_run = 0
+        self.jobs_dropped = 0
+        self.busy = False
+        self._batch_seconds = 1.0
+        self._queues = {}
+        self._condition = threading.Condition()
+        self._running = True
+        self._worker = threading.Thread(target=self._run, name="batching-engine", daemon=True)
+        self._worker.start()
+
+    @classmethod
+    def from_config(cls, model, processor, config):
+        batching_config = config.get("BATCHING", {})
+        return cls(
+            model, processor, max_batch_size=batching_config.get("max_batch_size", 4),
+            batch_window_ms=batching_config.get("batch_window_ms", 20), max_queue_size=batching_config.get("max_queue_size", 32)
+        )
+
+    def queue_depth(self):
+        with self._condition:
+            return sum(len(queue) for queue in self._queues.values())
+
+    def estimated_wait(self):
+        """Rough seconds until a newly queued job would start, from the recent average batch duration."""
+        batches_ahead = self.queue_depth() // self.max_batch_size + (1 if self.busy else 0)
+        return max(1, int(round(batches_ahead * self._batch_seconds)))
+
+    def _submit(self, job):
+        with self._condition:
+            if not self._running:
+                raise RuntimeError("Batching engine has been shut down.")
+            if sum(len(queue) for queue in self._queues.values()) >= self.max_queue_size:
+                raise QueueFullError(self.estimated_wait())
+            self._queues.setdefault(job.stage, deque()).append(job)
+            self._condition.notify()
+        return job.future
+
+    def submit_encode(self, image, deadline=None):
+        """Queues an image for the vision tower; the future resolves to a VisionHandle."""
+        return self._submit(_Job(ENCODE_STAGE, image, None, deadline))
+
+    def submit(self, stage, inputs, max_new_tokens=120, deadline=None):
+        """Queues one prompt; the future resolves to the same (outputs, stats, success) tuple as run_inference."""
+        return self._submit(_Job(stage, inputs, max_new_tokens, deadline))
+
+    def submit_group(self, stage, batch_inputs, max_new_tokens, deadline=None):
+        """
+        Queues several prompts that must run together in one generate() call, e.g. style variants of
+        one room. The future resolves to run_inference_batch's (outputs, stats, success) for the group.
+        """
+        return self._submit(_Job(stage, batch_inputs, max_new_tokens, deadline, group=True))
+
+    def encode(self, image):
+        return self.submit_encode(image).result()
+
+    def infer(self, stage, inputs, max_new_tokens=120):
+        return self.submit(stage, inputs, max_new_tokens).result()
+
+    def shutdown(self):
+        with self._condition:
+            self._running = False
+            self._condition.notify_all()
+        self._worker.join()
+
+    def _drop_stale(self):
+        now = time.monotonic()
+        for queue in self._queues.values():
+            for job in [job for job in queue if job.future.cancelled() or (job.deadline is not None and job.deadline <= now)]:
+                queue.remove(job)
+                self.jobs_dropped += 1
+                if job.streamer is not None:
+                    job.streamer.end()
+                if not job.future.cancelled():
+                    job.future.set_exception(DeadlineExceededError("Request deadline passed while queued."))
+
+    def _oldest_stage(self):
+        self._drop_stale()
+        pending = [(queue[0].enqueued_at, stage) for stage, queue in self._queues.items() if queue]
+        return min(pending)[1] if pending else None
+
+    def _next_batch(self):
+        with self._condition:
+            while self._running and self._oldest_stage() is None:
+                self._condition.wait()
+            if not self._running:
+                return None, []
+            stage = self._oldest_stage()
+            queue = self._queues[stage]
+            deadline = queue[0].enqueued_at + self.batch_window
+            while len(queue) < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._condition.wait(remaining)
+            self._drop_stale()
+            batch = []
+            while queue and len(batch) < self.max_batch_size:
+                if queue[0].solo and batch:
+                    break
+                batch.append(queue.popleft())
+                if batch[-1].solo:
+                    break
+            batch = [job for job in batch if job.future.set_running_or_notify_cancel()]
+            self.busy = bool(batch)
+            return stage, batch
+
+    def _run(self):
+        while True:
+            stage, batch = self._next_batch()
+            if stage is None:
+                break
+            if not batch:
+                continue
+            started = time.perf_counter()
+            started_at = time.monotonic()
+            try:
+                if stage == ENCODE_STAGE:
+                    results = encode_images(self.model, self.processor, [job.payload for job in batch])
+                elif batch[0].group:
+                    outputs, stats, success = run_inference_batch(self.model, self.processor, batch[0].payload, batch[0].max_new_tokens, stage=stage)
+                    results = [(outputs, dict(stats, queue_wait_s=started_at - batch[0].enqueued_at), success)]
+                else:
+                    outputs, stats, success = run_inference_batch(self.model, self.processor, [job.payload for job in batch], [job.max_new_tokens for job in batch], stage=stage)
+                    results = [([outputs[i]] if success else None, dict(stats, queue_wait_s=started_at - job.enqueued_at), success) for i, job in enumerate(batch)]
+                for job, result in zip(batch, results):
+                    job.future.set_result(result)
+            except Exception as e:
+                for job in batch:
+                    job.future.set_exception(e)
+            self._batch_seconds = 0.8 * self._batch_seconds + 0.2 * (time.perf_counter() - started)
+            self.busy = False
+            self.batches_run += 1
+            self.jobs_run += len(batch)
@@ -0,0 +1,59 @@
+import os
+import math
+import json
+import time
+import subprocess
+from PIL import Image, ImageDraw
+
+def synthetic_room_image(width=1024, height=768):
+    """A deterministic stand-in for an empty-room photo: floor, back wall, a window and a door."""
+    image = Image.new("RGB", (width, height), (228, 224, 216))
+    draw = ImageDraw.Draw(image)
+    draw.rectangle([0, int(height * 0.7), width, height], fill=(150, 111, 76))
+    draw.rectangle([int(width * 0.55), int(height * 0.2), int(width * 0.85), int(height * 0.5)], fill=(180, 210, 235), outline=(255, 255, 255), width=8)
+    draw.rectangle([int(width * 0.1), int(height * 0.25), int(width * 0.25), int(height * 0.7)], fill=(120, 90, 60))
+    return image
+
+def resident_memory_mb():
+    import psutil
+    return psutil.Process(os.getpid()).memory_info().rss / 2**20
+
+def percentile(values, q):
+    """Nearest-rank percentile of a non-empty list, q in [0, 100]."""
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, math.ceil(q / 100 * len(ordered)) - 1))]
+
+def latency_summary(seconds):
+    """Count, mean and p50/p95/p99/max of a list of durations, in milliseconds."""
+    if not seconds:
+        return {"count": 0}
+    return {
+        "count": len(seconds), "mean_ms": round(1000 * sum(seconds) / len(seconds), 3),
+        "p50_ms": round(1000 * percentile(seconds, 50), 3), "p95_ms": round(1000 * percentile(seconds, 95), 3),
+        "p99_ms": round(1000 * percentile(seconds, 99), 3), "max_ms": round(1000 * max(seconds), 3),
+    }
+
+def time_call(function, repeat, warmup=1):
+    """Runs function() warmup + repeat times and returns latency_summary of the timed calls."""
+    for _ in range(warmup):
+        function()
+    seconds = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        seconds.append(time.perf_counter() - start)
+    return latency_summary(seconds)
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def write_report(report, output=None):
+    """Prints the report and, if output is set, writes it as JSON tagged with the commit and time it was measured at."""
+    report = {"git_commit": git_commit(), "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"), **report}
+    print(json.dumps(report, indent=2))
+    if output:
+        with open(output, 'w') as f: json.dump(report, f, indent=2)
+    return report
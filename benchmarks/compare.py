@@ -0,0 +1,49 @@
+import sys
+import json
+import argparse
+
+# Metric-name suffixes and whether a larger value is better.
+HIGHER_IS_BETTER = ("_rps", "requests_per_s", "tokens_per_s", "items_per_s", "speedup")
+LOWER_IS_BETTER = ("_ms", "_s")
+
+def numeric_leaves(report, path=""):
+    if isinstance(report, dict):
+        for key, value in report.items():
+            yield from numeric_leaves(value, f"{path}.{key}" if path else key)
+    elif isinstance(report, (int, float)) and not isinstance(report, bool):
+        yield path, report
+
+def direction(path):
+    name = path.rsplit(".", 1)[-1]
+    if name.endswith(HIGHER_IS_BETTER):
+        return 1
+    if name.endswith(LOWER_IS_BETTER):
+        return -1
+    return 0
+
+def compare(baseline, candidate, threshold):
+    """Metrics present in both reports whose change in the bad direction exceeds threshold (a fraction)."""
+    base = dict(numeric_leaves(baseline))
+    regressions = []
+    for path, value in numeric_leaves(candidate):
+        sign = direction(path)
+        if not sign or path not in base or base[path] == 0:
+            continue
+        change = (value - base[path]) / abs(base[path])
+        if -sign * change > threshold:
+            regressions.append({"metric": path, "baseline": base[path], "candidate": value, "change": round(change, 4)})
+    return regressions
+
+def main(args):
+    with open(args.baseline, 'r') as f: baseline = json.load(f)
+    with open(args.candidate, 'r') as f: candidate = json.load(f)
+    regressions = compare(baseline, candidate, args.threshold)
+    print(json.dumps({"baseline_commit": baseline.get("git_commit"), "candidate_commit": candidate.get("git_commit"), "threshold": args.threshold, "regressions": regressions}, indent=2))
+    sys.exit(1 if regressions else 0)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Flag latency/throughput regressions between two benchmark JSON reports.", formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument("baseline", type=str)
+    parser.add_argument("candidate", type=str)
+    parser.add_argument("--threshold", type=float, default=0.1, help="Relative change in the bad direction that counts as a regression.")
+    main(parser.parse_args())
@@ -0,0 +1,70 @@
+import json
+import argparse
+import torch
+from model_utils import setup_environment, run_inference, encode_image, prepare_image, validate_and_process_image_input
+from prompt_engineering import create_analysis_prompt, create_placement_prompt, placement_checklist, create_stop_rule
+from benchmarks.common import synthetic_room_image, write_report
+from benchmarks.tiny_model import load_benchmark_model, prepare_benchmark_model
+
+DEFAULT_IMAGE_URLS = ["https://photos.zillowstatic.com/fp/3c83c384a192683219780302babe5ea9-p_f.jpg"]
+
+def load_images(args):
+    images = [("synthetic", synthetic_room_image())]
+    for url in args.image_urls:
+        images.append((url, validate_and_process_image_input(image_url=url)))
+    return images
+
+def run_pipeline(model, processor, config, image, stopping_config, args, seed):
+    """Analysis then placement for one image; returns each stage's stats and text."""
+    furniture_config = config.get("FURNITURE_CONFIG", {})
+    vision = encode_image(model, processor, image)
+    torch.manual_seed(seed)
+    _, analysis_messages = create_analysis_prompt(image)
+    analysis_output, analysis_stats, success = run_inference(model, processor, {'messages': analysis_messages, 'vision': vision, 'stop': create_stop_rule(stopping_config, "analysis")}, max_new_tokens=100, stage="analysis")
+    if not success: raise RuntimeError(f"Analysis failed: {analysis_stats.get('error_detail')}")
+
+    torch.manual_seed(seed)
+    _, placement_messages = create_placement_prompt(args.room_type, args.style, image, analysis_output[0], furniture_config, config.get("STYLE_MATERIALS", {}))
+    placement_stop = create_stop_rule(stopping_config, "placement", placement_checklist(args.room_type, furniture_config))
+    final_output, placement_stats, success = run_inference(model, processor, {'messages': placement_messages, 'vision': vision, 'stop': placement_stop}, max_new_tokens=args.max_tokens, stage="placement")
+    if not success: raise RuntimeError(f"Placement failed: {placement_stats.get('error_detail')}")
+    return {"analysis": (analysis_stats, analysis_output[0]), "placement": (placement_stats, final_output[0])}
+
+def summarize(runs, stage):
+    stats = [run[stage][0] for run in runs]
+    return {
+        "mean_generated_tokens": round(sum(sum(item["generated_tokens"]) for item in stats) / len(stats), 2),
+        "mean_latency_s": round(sum(item["total_s"] for item in stats) / len(stats), 4),
+        "mean_decode_s": round(sum(item["decode_s"] for item in stats) / len(stats), 4),
+        "sample_output": runs[0][stage][1],
+    }
+
+def main(args):
+    setup_environment()
+    with open("config.json", 'r') as f: config = json.load(f)
+    model, processor = prepare_benchmark_model(*load_benchmark_model(args.model, args.load_profile), config)
+    images = [(name, prepare_image(processor, image)) for name, image in load_images(args)]
+
+    modes = {"baseline": {}, "early_stopping": config.get("STOPPING", {})}
+    report = {"benchmark": "early_stopping", "model": args.model, "images": [name for name, _ in images], "runs_per_image": args.runs, "max_tokens": args.max_tokens}
+    for mode, stopping_config in modes.items():
+        runs = [run_pipeline(model, processor, config, image, stopping_config, args, args.seed + run) for _, image in images for run in range(args.runs)]
+        report[mode] = {stage: summarize(runs, stage) for stage in ("analysis", "placement")}
+    for stage in ("analysis", "placement"):
+        before, after = report["baseline"][stage], report["early_stopping"][stage]
+        report[f"{stage}_latency_speedup"] = round(before["mean_latency_s"] / after["mean_latency_s"], 3) if after["mean_latency_s"] else None
+
+    write_report(report, args.output)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generated tokens and latency with and without early-stopping criteria.", formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument("--model", choices=["tiny", "real"], default="real", help="tiny checks the harness quickly; real measures actual stopping behaviour.")
+    parser.add_argument("--load_profile", type=str, default=None)
+    parser.add_argument("--room_type", type=str, default="living room")
+    parser.add_argument("--style", type=str, default="industrial")
+    parser.add_argument("--image_urls", type=str, nargs="*", default=DEFAULT_IMAGE_URLS, help="Images added to the built-in synthetic room.")
+    parser.add_argument("--max_tokens", type=int, default=512, help="Placement max_new_tokens; 512 is the UI slider's maximum.")
+    parser.add_argument("--runs", type=int, default=3, help="Seeded runs per image; both modes use the same seeds.")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", type=str, default=None, help="Optional path for the JSON report.")
+    main(parser.parse_args())
@@ -0,0 +1,95 @@
+import io
+import os
+import random
+import argparse
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from PIL import Image, ImageDraw
+
+FIXTURE_RESOLUTIONS = [(640, 480), (1024, 768), (1920, 1440), (4032, 3024)]
+FIXTURE_ROOMS = 4
+
+def fixture_room_image(index, width, height):
+    """Deterministic empty-room stand-in; each index varies wall/floor colours and window/door placement."""
+    rng = random.Random(index)
+    image = Image.new("RGB", (width, height), tuple(rng.randint(190, 240) for _ in range(3)))
+    draw = ImageDraw.Draw(image)
+    floor_top = int(height * rng.uniform(0.62, 0.75))
+    draw.rectangle([0, floor_top, width, height], fill=tuple(rng.randint(80, 170) for _ in range(3)))
+    window_left = rng.uniform(0.35, 0.6)
+    draw.rectangle([int(width * window_left), int(height * 0.18), int(width * (window_left + 0.3)), int(height * 0.5)], fill=(180, 210, 235), outline=(255, 255, 255), width=max(2, width // 128))
+    door_left = rng.choice([0.05, 0.75])
+    draw.rectangle([int(width * door_left), int(height * 0.25), int(width * (door_left + 0.15)), floor_top], fill=(120, 90, 60))
+    return image
+
+def _encode(image, image_format):
+    buffer = io.BytesIO()
+    image.save(buffer, format=image_format, quality=90)
+    return buffer.getvalue()
+
+def build_fixtures(fixture_dir=None, resolutions=FIXTURE_RESOLUTIONS):
+    """
+    Maps URL paths to JPEG bytes: every fixture room at every resolution. Photos from fixture_dir
+    (if given) are resized to the same resolutions, so real listings can stand in for the synthetic rooms.
+    """
+    sources = [(f"room{index}", fixture_room_image(index, *resolutions[-1])) for index in range(FIXTURE_ROOMS)]
+    if fixture_dir:
+        for name in sorted(os.listdir(fixture_dir)):
+            if name.lower().endswith((".jpg", ".jpeg", ".png", ".webp")):
+                with Image.open(os.path.join(fixture_dir, name)) as photo:
+                    sources.append((os.path.splitext(name)[0], photo.convert("RGB")))
+    fixtures = {}
+    for name, source in sources:
+        for width, height in resolutions:
+            fixtures[f"/rooms/{name}_{width}x{height}.jpg"] = _encode(source.resize((width, height)), "JPEG")
+    return fixtures
+
+class _FixtureHandler(BaseHTTPRequestHandler):
+    fixtures = {}
+
+    def do_GET(self):
+        body = self.fixtures.get(self.path)
+        if body is None:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "image/jpeg")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+class ImageServer:
+    """
+    Serves the fixture set from memory on a local port, in a background thread, so benchmarks fetch
+    images over real HTTP without depending on remote listing sites. Use as a context manager.
+    """
+    def __init__(self, fixture_dir=None, host="127.0.0.1", port=0):
+        handler = type("FixtureHandler", (_FixtureHandler,), {"fixtures": build_fixtures(fixture_dir)})
+        self._server = ThreadingHTTPServer((host, port), handler)
+        self._thread = threading.Thread(target=self._server.serve_forever, name="image-server", daemon=True)
+        self.base_url = f"http://{host}:{self._server.server_address[1]}"
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def urls(self, resolution=None):
+        """Every fixture URL, or only those at one (width, height)."""
+        suffix = f"_{resolution[0]}x{resolution[1]}.jpg" if resolution else ""
+        return [self.base_url + path for path in sorted(self._server.RequestHandlerClass.fixtures) if path.endswith(suffix)]
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve the benchmark fixture images over local HTTP.", formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument("--fixture_dir", type=str, default=None, help="Optional directory of real room photos to serve alongside the synthetic rooms.")
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args()
+    with ImageServer(args.fixture_dir, port=args.port) as server:
+        print("\n".join(server.urls()))
+        threading.Event().wait()
@@ -0,0 +1,66 @@
+import os
+import sys
+import time
+import json
+import argparse
+import subprocess
+import torch
+from model_utils import LOAD_PROFILES, setup_environment, run_inference, encode_image, prepare_image
+from prompt_engineering import create_analysis_prompt
+from benchmarks.common import synthetic_room_image, resident_memory_mb, write_report
+from benchmarks.tiny_model import load_benchmark_model, prepare_benchmark_model
+
+def measure_profile(profile, max_new_tokens, runs):
+    """Loads one profile in this process and reports resident memory, load time and decode throughput."""
+    setup_environment()
+    with open("config.json", 'r') as f: config = json.load(f)
+    baseline_mb = resident_memory_mb()
+    start = time.perf_counter()
+    model, processor = load_benchmark_model("real", profile)
+    load_s = time.perf_counter() - start
+    loaded_mb = resident_memory_mb()
+    prepare_benchmark_model(model, processor, config)
+
+    image = prepare_image(processor, synthetic_room_image())
+    vision = encode_image(model, processor, image)
+    _, messages = create_analysis_prompt(image)
+    tokens, seconds = 0, 0.0
+    for run in range(runs):
+        torch.manual_seed(run)
+        start = time.perf_counter()
+        output, _, success = run_inference(model, processor, {'messages': messages, 'vision': vision}, max_new_tokens=max_new_tokens)
+        seconds += time.perf_counter() - start
+        if not success: raise RuntimeError(f"Generation failed under profile {profile}.")
+        tokens += len(processor.tokenizer(output[0])["input_ids"])
+    return {
+        "profile": profile, "device": model.device.type, "load_s": round(load_s, 2),
+        "model_rss_mb": round(loaded_mb - baseline_mb, 1), "peak_rss_mb": round(resident_memory_mb(), 1),
+        "tokens_per_s": round(tokens / seconds, 2) if seconds else 0.0, "vision_encode_s": round(vision.encode_seconds, 3),
+    }
+
+def main(args):
+    if args.single:
+        print(json.dumps(measure_profile(args.single, args.max_new_tokens, args.runs)))
+        return
+    # Each profile runs in a fresh interpreter so resident memory is not polluted by earlier loads,
+    # and without a snapshot, which would be loaded whatever profile is asked for.
+    env = {key: value for key, value in os.environ.items() if key != "VLM_SNAPSHOT_DIR"}
+    report = []
+    for profile in args.profiles:
+        command = [sys.executable, "-m", "benchmarks.load_profiles", "--single", profile, "--max_new_tokens", str(args.max_new_tokens), "--runs", str(args.runs)]
+        completed = subprocess.run(command, capture_output=True, text=True, env=env)
+        if completed.returncode != 0:
+            report.append({"profile": profile, "error": completed.stderr.strip().splitlines()[-1] if completed.stderr.strip() else "failed"})
+        else:
+            report.append(json.loads(completed.stdout.strip().splitlines()[-1]))
+        print(json.dumps(report[-1]))
+    write_report({"benchmark": "load_profiles", "profiles": report}, args.output)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Resident memory, load time and tokens/s for each model load profile.", formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument("--profiles", nargs="+", default=[profile for profile in LOAD_PROFILES if profile != "auto"], choices=LOAD_PROFILES)
+    parser.add_argument("--max_new_tokens", type=int, default=64)
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--output", type=str, default=None, help="Optional path for the JSON report.")
+    parser.add_argument("--single", type=str, default=None, choices=LOAD_PROFILES, help=argparse.SUPPRESS)
+    main(parser.parse_args())
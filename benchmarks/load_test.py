@@ -0,0 +1,155 @@
+import time
+import random
+import asyncio
+import argparse
+import itertools
+from collections import Counter
+from benchmarks.common import latency_summary, write_report
+from benchmarks.image_server import ImageServer
+from benchmarks.tiny_model import load_benchmark_model
+
+ROOM_STYLES = [("living room", "industrial"), ("living room", "scandinavian"), ("bedroom", "industrial"), ("bedroom", "bohemian"), ("kitchen", "modern")]
+
+def request_bodies(image_urls, args):
+    """An endless, deterministic cycle of request bodies over the fixture images and room/style pairs."""
+    for index in itertools.count():
+        room_type, style = ROOM_STYLES[index % len(ROOM_STYLES)]
+        yield {
+            "image_url": image_urls[index % len(image_urls)], "room_type": room_type, "style": style,
+            "max_tokens": args.max_tokens, "bypass_cache": not args.use_cache,
+        }
+
+class ApiTarget:
+    """Drives api.app in-process through httpx's ASGI transport, or a running server when --url is given."""
+    def __init__(self, args):
+        self.args = args
+        self.endpoint = args.endpoint
+
+    async def start(self):
+        import httpx
+        if self.args.url:
+            self.client = httpx.AsyncClient(base_url=self.args.url, timeout=None)
+            return
+        import api
+        model, processor = load_benchmark_model(self.args.model, self.args.load_profile)
+        api.load_model_and_processor = lambda *_, **__: (model, processor)
+        await api.startup_event()
+        self.client = httpx.AsyncClient(transport=httpx.ASGITransport(app=api.app), base_url="http://benchmark", timeout=None)
+
+    async def send(self, body):
+        if self.endpoint == "/generate/batch":
+            body = {"image_url": body["image_url"], "max_tokens": body["max_tokens"], "bypass_cache": body["bypass_cache"], "variants": [{"room_type": room, "style": style} for room, style in ROOM_STYLES[:3]]}
+        if self.endpoint == "/generate/stream":
+            async with self.client.stream("POST", self.endpoint, json=body) as response:
+                events = [line async for line in response.aiter_lines() if line.startswith("event:")]
+                return str(response.status_code) if response.status_code != 200 or "event: done" in events else "stream_error"
+        response = await self.client.post(self.endpoint, json=body)
+        return str(response.status_code)
+
+    async def stop(self):
+        await self.client.aclose()
+        if not self.args.url:
+            import api
+            await api.shutdown_event()
+
+class RunpodTarget:
+    """Calls runpod_handler.handler on worker threads, the way the serverless runtime does."""
+    def __init__(self, args):
+        self.args = args
+
+    async def start(self):
+        import runpod_handler
+        model, processor = load_benchmark_model(self.args.model, self.args.load_profile)
+        runpod_handler.load_model_and_processor = lambda *_, **__: (model, processor)
+        await asyncio.to_thread(runpod_handler.load_essentials)
+        self.handler = runpod_handler.handler
+
+    async def send(self, body):
+        result = await asyncio.to_thread(self.handler, {"input": body})
+        return "ok" if "error" not in result else "error"
+
+    async def stop(self):
+        import runpod_handler
+        if runpod_handler.pipeline is not None:
+            await asyncio.to_thread(runpod_handler.pipeline.engine.shutdown)
+
+async def timed_send(target, body, started_at, results):
+    """started_at is when the request was due, so open-loop latency includes time spent waiting to be sent."""
+    try:
+        outcome = await target.send(body)
+    except Exception as e:
+        outcome = f"exception:{type(e).__name__}"
+    results.append((outcome, time.perf_counter() - started_at))
+
+async def closed_loop(target, bodies, args, results):
+    """args.concurrency users, each sending its next request as soon as the previous one completes."""
+    deadline = time.perf_counter() + args.duration
+    remaining = itertools.count()
+
+    async def user():
+        while time.perf_counter() < deadline and next(remaining) < args.requests:
+            await timed_send(target, next(bodies), time.perf_counter(), results)
+    await asyncio.gather(*(user() for _ in range(args.concurrency)))
+
+async def open_loop(target, bodies, args, results):
+    """Poisson arrivals at args.rate requests/s regardless of how many are still in flight."""
+    rng = random.Random(args.seed)
+    start = time.perf_counter()
+    due, tasks = start, []
+    while due - start < args.duration and len(tasks) < args.requests:
+        await asyncio.sleep(max(0.0, due - time.perf_counter()))
+        tasks.append(asyncio.create_task(timed_send(target, next(bodies), due, results)))
+        due += rng.expovariate(args.rate)
+    await asyncio.gather(*tasks)
+
+async def run(args):
+    target = ApiTarget(args) if args.target == "api" else RunpodTarget(args)
+    with ImageServer(args.fixture_dir) as server:
+        image_urls = server.urls((args.width, args.height))
+        await target.start()
+        try:
+            bodies = request_bodies(image_urls, args)
+            for _ in range(args.warmup):
+                await target.send(next(bodies))
+            results = []
+            start = time.perf_counter()
+            await (closed_loop if args.mode == "closed" else open_loop)(target, bodies, args, results)
+            elapsed = time.perf_counter() - start
+        finally:
+            await target.stop()
+
+    succeeded = [seconds for outcome, seconds in results if outcome in ("200", "ok")]
+    return {
+        "benchmark": "load_test", "target": args.target, "endpoint": args.endpoint if args.target == "api" else None,
+        "model": args.model if not args.url else "external", "mode": args.mode,
+        "concurrency": args.concurrency if args.mode == "closed" else None, "offered_rate": args.rate if args.mode == "open" else None,
+        "image_resolution": f"{args.width}x{args.height}", "max_tokens": args.max_tokens,
+        "requests": len(results), "succeeded": len(succeeded), "outcomes": dict(Counter(outcome for outcome, _ in results)),
+        "elapsed_s": round(elapsed, 3), "throughput_rps": round(len(succeeded) / elapsed, 3) if elapsed else 0.0,
+        "latency": latency_summary(succeeded),
+    }
+
+def main(args):
+    write_report(asyncio.run(run(args)), args.output)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Closed- and open-loop load generator for api.app and runpod_handler.handler, against local image fixtures.", formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument("--target", choices=["api", "runpod"], default="api")
+    parser.add_argument("--endpoint", choices=["/generate", "/generate/batch", "/generate/stream"], default="/generate", help="API endpoint to drive (api target only).")
+    parser.add_argument("--url", type=str, default=None, help="Drive a running API server instead of api.app in-process (api target only).")
+    parser.add_argument("--model", choices=["tiny", "real"], default="tiny", help="Model loaded into the in-process target.")
+    parser.add_argument("--load_profile", type=str, default=None)
+    parser.add_argument("--mode", choices=["closed", "open"], default="closed")
+    parser.add_argument("--concurrency", type=int, default=4, help="Closed loop: concurrent users.")
+    parser.add_argument("--rate", type=float, default=2.0, help="Open loop: mean arrivals per second.")
+    parser.add_argument("--duration", type=float, default=60.0, help="Stop issuing requests after this many seconds.")
+    parser.add_argument("--requests", type=int, default=200, help="Stop issuing requests after this many.")
+    parser.add_argument("--warmup", type=int, default=2, help="Untimed requests sent before measuring.")
+    parser.add_argument("--width", type=int, default=1024)
+    parser.add_argument("--height", type=int, default=768)
+    parser.add_argument("--max_tokens", type=int, default=32)
+    parser.add_argument("--use_cache", action="store_true", help="Allow room-analysis cache hits (off by default so every request runs the model).")
+    parser.add_argument("--fixture_dir", type=str, default=None)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", type=str, default=None, help="Optional path for the JSON report.")
+    main(parser.parse_args())
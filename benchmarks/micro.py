@@ -0,0 +1,81 @@
+import json
+import argparse
+import torch
+from model_utils import setup_environment, validate_and_process_image_input, run_inference, run_inference_batch, encode_image, prepare_image
+from image_utils import get_http_session, decode_image
+from prompt_engineering import create_analysis_prompt, create_placement_prompt, create_variant_placement_prompts
+from prompt_templates import get_prompt_compiler
+from benchmarks.common import time_call, write_report
+from benchmarks.image_server import ImageServer, FIXTURE_RESOLUTIONS
+from benchmarks.tiny_model import load_benchmark_model, prepare_benchmark_model, real_model_cached
+
+SAMPLE_ANALYSIS = "The room has white drywall and light oak flooring, with a large window centred on the back wall and a door on the left wall."
+VARIANTS = [{"room_type": "living room", "style": "industrial"}, {"room_type": "living room", "style": "scandinavian"}, {"room_type": "bedroom", "style": "industrial"}, {"room_type": "bedroom", "style": "bohemian"}]
+
+def bench_image_input(server, repeat):
+    """Fetch + validate + decode over local HTTP, and decode alone from bytes, per fixture resolution."""
+    results = {}
+    for width, height in FIXTURE_RESOLUTIONS:
+        url = server.urls((width, height))[0]
+        image_bytes = get_http_session().get(url).content
+        results[f"{width}x{height}"] = {
+            "validate_and_process_image_input": time_call(lambda: validate_and_process_image_input(image_url=url), repeat),
+            "decode_image": time_call(lambda: decode_image(image_bytes), repeat),
+        }
+    return results
+
+def bench_prompts(config, image, repeat):
+    furniture_config, style_materials = config.get("FURNITURE_CONFIG", {}), config.get("STYLE_MATERIALS", {})
+    return {
+        "create_analysis_prompt": time_call(lambda: create_analysis_prompt(image), repeat),
+        "create_placement_prompt": time_call(lambda: create_placement_prompt("living room", "industrial", image, SAMPLE_ANALYSIS, furniture_config, style_materials), repeat),
+        "create_variant_placement_prompts_x4": time_call(lambda: create_variant_placement_prompts(VARIANTS, image, SAMPLE_ANALYSIS, furniture_config, style_materials), repeat),
+    }
+
+def bench_model(kind, config, image, args):
+    model, processor = prepare_benchmark_model(*load_benchmark_model(kind, args.load_profile), config)
+    image = prepare_image(processor, image)
+    vision = encode_image(model, processor, image)
+    _, analysis_messages = create_analysis_prompt(image)
+    _, placement_messages = create_placement_prompt("living room", "industrial", image, SAMPLE_ANALYSIS, config.get("FURNITURE_CONFIG", {}), config.get("STYLE_MATERIALS", {}))
+    repeat = args.repeat if kind == "tiny" else max(1, args.repeat // 10)
+
+    def generate(batch_inputs):
+        torch.manual_seed(args.seed)
+        _, stats, success = run_inference_batch(model, processor, batch_inputs, max_new_tokens=args.max_new_tokens)
+        if not success: raise RuntimeError(f"{kind} model generation failed: {stats.get('error_detail')}")
+        return stats
+
+    last_stats = generate([{'messages': placement_messages, 'vision': vision}])
+    return {
+        "chat_template_and_tokenize": time_call(lambda: processor.tokenizer(processor.apply_chat_template(placement_messages, tokenize=False, add_generation_prompt=True)), args.repeat),
+        "compiled_prompt_encode": time_call(lambda: get_prompt_compiler(processor).encode(placement_messages), args.repeat),
+        "encode_image": time_call(lambda: encode_image(model, processor, image), repeat),
+        "run_inference_analysis": time_call(lambda: run_inference(model, processor, {'messages': analysis_messages, 'vision': vision}, max_new_tokens=args.max_new_tokens), repeat),
+        "run_inference_placement": time_call(lambda: generate([{'messages': placement_messages, 'vision': vision}]), repeat),
+        "run_inference_batch_x4": time_call(lambda: generate([{'messages': placement_messages, 'vision': vision}] * 4), repeat),
+        "placement_phases": {key: round(last_stats[key], 4) for key in ("preprocess_s", "prefill_s", "decode_s", "total_s")},
+    }
+
+def main(args):
+    setup_environment()
+    with open("config.json", 'r') as f: config = json.load(f)
+    report = {"benchmark": "micro", "repeat": args.repeat, "max_new_tokens": args.max_new_tokens}
+    with ImageServer(args.fixture_dir) as server:
+        report["image_input"] = bench_image_input(server, args.repeat)
+        image = validate_and_process_image_input(image_url=server.urls((1024, 768))[0])
+    report["prompts"] = bench_prompts(config, image, args.repeat * 10)
+    kinds = args.models or (["tiny", "real"] if real_model_cached() else ["tiny"])
+    report["run_inference"] = {kind: bench_model(kind, config, image, args) for kind in kinds}
+    write_report(report, args.output)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Micro-benchmarks for image input, prompt builders and run_inference, against local fixtures.", formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument("--models", nargs="*", choices=["tiny", "real"], default=None, help="Models to benchmark (default: tiny, plus real when its weights are cached).")
+    parser.add_argument("--load_profile", type=str, default=None)
+    parser.add_argument("--fixture_dir", type=str, default=None, help="Optional directory of real room photos to add to the fixtures.")
+    parser.add_argument("--repeat", type=int, default=20, help="Timed calls per micro-benchmark (prompt builders use 10x, the real model 1/10).")
+    parser.add_argument("--max_new_tokens", type=int, default=32)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", type=str, default=None, help="Optional path for the JSON report.")
+    main(parser.parse_args())
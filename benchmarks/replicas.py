@@ -0,0 +1,79 @@
+import os
+import sys
+import time
+import json
+import argparse
+import subprocess
+import torch
+from model_utils import setup_environment, load_model_and_processor, configure_image_budget, prepare_image
+from prompt_engineering import create_analysis_prompt
+from worker_pool import ReplicaPool
+from benchmarks.common import synthetic_room_image
+
+def powers_of_two(limit):
+    values, value = [], 1
+    while value <= limit:
+        values.append(value)
+        value *= 2
+    return values
+
+def measure_config(replicas, threads, requests, max_new_tokens):
+    """Starts a pool of `replicas` x `threads` in this process and reports steady-state requests/s."""
+    setup_environment()
+    torch.set_num_threads(1)
+    with open("config.json", 'r') as f: config = json.load(f)
+    model, processor = load_model_and_processor(config)
+    configure_image_budget(processor, config.get("IMAGE_PREPROCESSING", {}))
+    image = prepare_image(processor, synthetic_room_image())
+    _, messages = create_analysis_prompt(image)
+
+    pool = ReplicaPool(model, processor, config, replicas=replicas, threads_per_replica=threads)
+    try:
+        # Jobs run where their image was encoded; submitting the encodes together puts one on each replica.
+        visions = [future.result() for future in [pool.submit_encode(image) for _ in range(replicas)]]
+        # One request per replica first, so process start-up and prefix warm-up are not timed.
+        for future in [pool.submit("analysis", {'messages': messages, 'vision': vision}, max_new_tokens) for vision in visions]:
+            future.result()
+        start = time.perf_counter()
+        futures = [pool.submit("analysis", {'messages': messages, 'vision': visions[index % replicas]}, max_new_tokens) for index in range(requests)]
+        failed = sum(not future.result()[2] for future in futures)
+        elapsed = time.perf_counter() - start
+    finally:
+        pool.shutdown()
+    return {
+        "replicas": replicas, "threads_per_replica": threads, "requests": requests, "failed": failed,
+        "elapsed_s": round(elapsed, 2), "requests_per_s": round(requests / elapsed, 3),
+    }
+
+def main(args):
+    if args.single:
+        replicas, threads = args.single
+        print(json.dumps(measure_config(replicas, threads, args.requests, args.max_new_tokens)))
+        return
+    cores = len(os.sched_getaffinity(0))
+    configs = [(replicas, threads) for replicas in args.replicas or powers_of_two(cores) for threads in args.threads or powers_of_two(cores) if replicas * threads <= cores]
+    # Each configuration runs in a fresh interpreter: replicas are forked from a parent that must not have used OpenMP yet.
+    report = []
+    for replicas, threads in configs:
+        command = [sys.executable, "-m", "benchmarks.replicas", "--single", str(replicas), str(threads), "--requests", str(args.requests), "--max_new_tokens", str(args.max_new_tokens)]
+        completed = subprocess.run(command, capture_output=True, text=True)
+        if completed.returncode != 0:
+            report.append({"replicas": replicas, "threads_per_replica": threads, "error": completed.stderr.strip().splitlines()[-1] if completed.stderr.strip() else "failed"})
+        else:
+            report.append(json.loads(completed.stdout.strip().splitlines()[-1]))
+        print(json.dumps(report[-1]))
+    best = max((item for item in report if "requests_per_s" in item), key=lambda item: item["requests_per_s"], default=None)
+    if best:
+        print(f"Best: {best['replicas']} replicas x {best['threads_per_replica']} threads at {best['requests_per_s']} requests/s on {cores} cores.")
+    if args.output:
+        with open(args.output, 'w') as f: json.dump(report, f, indent=2)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Requests/s for each replica count x threads-per-replica that fits the available cores.", formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument("--replicas", type=int, nargs="*", default=None, help="Replica counts to try (default: powers of two up to the core count).")
+    parser.add_argument("--threads", type=int, nargs="*", default=None, help="Threads per replica to try (default: powers of two up to the core count).")
+    parser.add_argument("--requests", type=int, default=32, help="Timed analysis requests per configuration, all submitted at once.")
+    parser.add_argument("--max_new_tokens", type=int, default=32)
+    parser.add_argument("--output", type=str, default=None, help="Optional path for the JSON report.")
+    parser.add_argument("--single", type=int, nargs=2, default=None, metavar=("REPLICAS", "THREADS"), help=argparse.SUPPRESS)
+    main(parser.parse_args())
@@ -0,0 +1,67 @@
+import json
+import argparse
+import torch
+from model_utils import setup_environment, run_inference, encode_image, prepare_image, validate_and_process_image_input
+from prompt_engineering import create_analysis_prompt, create_placement_prompt
+from benchmarks.common import write_report
+from benchmarks.tiny_model import load_benchmark_model, prepare_benchmark_model
+
+def run_mode(model, processor, placement_messages, vision, speculative, args):
+    runs = []
+    for run in range(args.runs):
+        torch.manual_seed(args.seed + run)
+        output, stats, success = run_inference(model, processor, {'messages': placement_messages, 'vision': vision, 'speculative': speculative}, max_new_tokens=args.max_tokens, stage="placement")
+        if not success: raise RuntimeError(f"Placement failed: {stats.get('error_detail')}")
+        runs.append((output[0], stats))
+    summary = {
+        "mode": speculative["mode"] if speculative else "off",
+        "mean_total_s": round(sum(stats["total_s"] for _, stats in runs) / len(runs), 4),
+        "mean_decode_s": round(sum(stats["decode_s"] for _, stats in runs) / len(runs), 4),
+        "mean_tokens_per_s": round(sum(stats["tokens_per_s"] for _, stats in runs) / len(runs), 2),
+        "mean_generated_tokens": round(sum(sum(stats["generated_tokens"]) for _, stats in runs) / len(runs), 2),
+        "sample_suggestion": runs[0][0],
+    }
+    if speculative:
+        draft = sum(stats["speculative"]["draft_tokens"] for _, stats in runs)
+        accepted = sum(stats["speculative"]["accepted_tokens"] for _, stats in runs)
+        summary["acceptance_rate"] = round(accepted / draft, 4) if draft else 0.0
+        summary["mean_tokens_per_step"] = round(sum(stats["speculative"]["tokens_per_step"] for _, stats in runs) / len(runs), 3)
+    return summary
+
+def main(args):
+    setup_environment()
+    with open("config.json", 'r') as f: config = json.load(f)
+    model, processor = prepare_benchmark_model(*load_benchmark_model(args.model, args.load_profile), config)
+    image = prepare_image(processor, validate_and_process_image_input(image_url=args.image_url))
+    vision = encode_image(model, processor, image)
+
+    torch.manual_seed(args.seed)
+    _, analysis_messages = create_analysis_prompt(image)
+    analysis_output, stats, success = run_inference(model, processor, {'messages': analysis_messages, 'vision': vision}, max_new_tokens=100)
+    if not success: raise RuntimeError(f"Analysis failed: {stats.get('error_detail')}")
+    _, placement_messages = create_placement_prompt(args.room_type, args.style, image, analysis_output[0], config.get("FURNITURE_CONFIG", {}), config.get("STYLE_MATERIALS", {}))
+
+    modes = [None, {"mode": "prompt_lookup", "num_tokens": args.num_tokens, "max_ngram_size": args.max_ngram_size}]
+    if args.draft_model:
+        modes.append({"mode": "draft", "draft_model": args.draft_model, "num_tokens": 5})
+    report = {"benchmark": "speculative", "model": args.model, "room_analysis": analysis_output[0], "runs": args.runs, "max_tokens": args.max_tokens, "modes": [run_mode(model, processor, placement_messages, vision, mode, args) for mode in modes]}
+    baseline = report["modes"][0]["mean_total_s"]
+    for item in report["modes"][1:]:
+        item["speedup_vs_off"] = round(baseline / item["mean_total_s"], 3) if item["mean_total_s"] else None
+    write_report(report, args.output)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Placement latency, throughput and acceptance rate with and without speculative decoding.", formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument("--model", choices=["tiny", "real"], default="real")
+    parser.add_argument("--load_profile", type=str, default=None)
+    parser.add_argument("--room_type", type=str, default="living room")
+    parser.add_argument("--style", type=str, default="industrial")
+    parser.add_argument("--image_url", type=str, default="https://photos.zillowstatic.com/fp/3c83c384a192683219780302babe5ea9-p_f.jpg")
+    parser.add_argument("--max_tokens", type=int, default=180)
+    parser.add_argument("--num_tokens", type=int, default=10, help="Prompt-lookup draft length.")
+    parser.add_argument("--max_ngram_size", type=int, default=2)
+    parser.add_argument("--draft_model", type=str, default=None, help="Optional draft model sharing the Qwen2 tokenizer, e.g. Qwen/Qwen2-0.5B-Instruct.")
+    parser.add_argument("--runs", type=int, default=3, help="Seeded runs per mode; every mode uses the same seeds.")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", type=str, default=None, help="Optional path for the JSON report.")
+    main(parser.parse_args())
@@ -0,0 +1,66 @@
+import os
+import sys
+import time
+import json
+import argparse
+import importlib
+import subprocess
+
+def measure_cold_start(profile):
+    """Runs in a fresh interpreter: import, weight load and first-token time for one start."""
+    timings = {}
+    start = time.perf_counter()
+    import model_utils
+    timings["import_model_utils_s"] = time.perf_counter() - start
+    start = time.perf_counter()
+    importlib.import_module("transformers")
+    timings["import_transformers_s"] = time.perf_counter() - start
+
+    from prompt_engineering import create_analysis_prompt
+    from benchmarks.common import synthetic_room_image, resident_memory_mb
+    model_utils.setup_environment()
+    start = time.perf_counter()
+    model, processor = model_utils.load_model_and_processor(profile=profile)
+    timings["weight_load_s"] = time.perf_counter() - start
+    timings["rss_after_load_mb"] = resident_memory_mb()
+
+    image = model_utils.prepare_image(processor, synthetic_room_image())
+    _, messages = create_analysis_prompt(image)
+    start = time.perf_counter()
+    _, _, success = model_utils.run_inference(model, processor, {'messages': messages}, max_new_tokens=1)
+    timings["first_token_s"] = time.perf_counter() - start
+    if not success: raise RuntimeError("First-token generation failed.")
+    timings["snapshot"] = model_utils.resolve_snapshot_dir() or None
+    return {key: round(value, 3) if isinstance(value, float) else value for key, value in timings.items()}
+
+def main(args):
+    if args.single:
+        print(json.dumps(measure_cold_start(args.load_profile)))
+        return
+    modes = [("hub", None)] + ([("snapshot", args.snapshot_dir)] if args.snapshot_dir else [])
+    report = []
+    for mode, snapshot_dir in modes:
+        env = dict(os.environ)
+        env.pop("VLM_SNAPSHOT_DIR", None)
+        if snapshot_dir: env["VLM_SNAPSHOT_DIR"] = snapshot_dir
+        command = [sys.executable, "-m", "benchmarks.startup", "--single"] + (["--load_profile", args.load_profile] if args.load_profile else [])
+        for run in range(args.runs):
+            start = time.perf_counter()
+            completed = subprocess.run(command, capture_output=True, text=True, env=env)
+            if completed.returncode != 0:
+                raise RuntimeError(f"{mode} start failed: {completed.stderr.strip()}")
+            result = json.loads(completed.stdout.strip().splitlines()[-1])
+            result.update({"mode": mode, "run": run, "process_wall_s": round(time.perf_counter() - start, 3)})
+            report.append(result)
+            print(json.dumps(result))
+    if args.output:
+        with open(args.output, 'w') as f: json.dump(report, f, indent=2)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Cold-start breakdown (import, weight load, first token) from the hub checkpoint vs a snapshot.", formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument("--snapshot_dir", type=str, default=None, help="Snapshot written by snapshot.py; omitted means hub loading only.")
+    parser.add_argument("--load_profile", type=str, default=None)
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--output", type=str, default=None, help="Optional path for the JSON report.")
+    parser.add_argument("--single", action="store_true", help=argparse.SUPPRESS)
+    main(parser.parse_args())
@@ -0,0 +1,58 @@
+import torch
+from model_utils import load_processor, warm_prefix_cache, configure_image_budget, DEFAULT_MODEL_NAME
+from prompt_engineering import create_warmup_prompts
+from prompt_templates import compile_prompt_templates
+
+def build_tiny_model(processor, seed=0):
+    """
+    A randomly initialised Qwen2-VL with a few million parameters that uses the real processor's
+    vocabulary and special-token ids. It exercises the full run_inference path (vision splice, mrope,
+    prefix cache, generate) in well under a second per call, so benchmarks can measure the
+    framework's own overhead without the real weights.
+    """
+    from transformers import Qwen2VLConfig, Qwen2VLForConditionalGeneration
+    tokenizer = processor.tokenizer
+    config = Qwen2VLConfig(
+        vocab_size=len(tokenizer), hidden_size=64, intermediate_size=128, num_hidden_layers=2,
+        num_attention_heads=4, num_key_value_heads=2, max_position_embeddings=32768, tie_word_embeddings=True,
+        rope_scaling={"type": "mrope", "mrope_section": [4, 2, 2]},
+        vision_config={
+            "depth": 2, "embed_dim": 32, "hidden_size": 64, "num_heads": 4, "mlp_ratio": 2,
+            "patch_size": processor.image_processor.patch_size, "spatial_merge_size": processor.image_processor.merge_size,
+            "temporal_patch_size": processor.image_processor.temporal_patch_size, "in_chans": 3, "in_channels": 3,
+        },
+        image_token_id=tokenizer.convert_tokens_to_ids("<|image_pad|>"),
+        video_token_id=tokenizer.convert_tokens_to_ids("<|video_pad|>"),
+        vision_start_token_id=tokenizer.convert_tokens_to_ids("<|vision_start|>"),
+        vision_end_token_id=tokenizer.convert_tokens_to_ids("<|vision_end|>"),
+        bos_token_id=tokenizer.convert_tokens_to_ids("<|endoftext|>"), eos_token_id=tokenizer.eos_token_id,
+    )
+    torch.manual_seed(seed)
+    return Qwen2VLForConditionalGeneration(config).eval()
+
+def real_model_cached(model_name=DEFAULT_MODEL_NAME):
+    """True when the real weights are already in the local Hugging Face cache (nothing would be downloaded)."""
+    try:
+        from huggingface_hub import snapshot_download
+        snapshot_download(model_name, local_files_only=True, allow_patterns=["*.safetensors", "config.json"])
+        return True
+    except Exception:
+        return False
+
+def load_benchmark_model(kind, load_profile=None):
+    """Returns (model, processor) for kind "tiny" or "real"; both use the real processor, which is small."""
+    if kind == "tiny":
+        processor = load_processor()
+        return build_tiny_model(processor), processor
+    from model_utils import load_model_and_processor
+    return load_model_and_processor(profile=load_profile)
+
+def prepare_benchmark_model(model, processor, config, image_preprocessing=None):
+    """
+    The setup the servers do at startup: warms the prefix cache, applies the image budget
+    (image_preprocessing, or IMAGE_PREPROCESSING from config) and compiles the prompt templates.
+    """
+    warm_prefix_cache(model, processor, create_warmup_prompts())
+    configure_image_budget(processor, config.get("IMAGE_PREPROCESSING", {}) if image_preprocessing is None else image_preprocessing)
+    compile_prompt_templates(processor, config)
+    return model, processor
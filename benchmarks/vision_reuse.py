@@ -0,0 +1,55 @@
+import time
+import json
+import argparse
+import torch
+from model_utils import setup_environment, run_inference, encode_image, prepare_image, validate_and_process_image_input
+from prompt_engineering import create_analysis_prompt, create_placement_prompt
+from benchmarks.common import write_report
+from benchmarks.tiny_model import load_benchmark_model, prepare_benchmark_model
+
+def run_pipeline(model, processor, config, image, room_type, style, seed, reuse_vision):
+    timings = {}
+    vision = None
+    if reuse_vision:
+        vision = encode_image(model, processor, image)
+        timings["vision_preprocess_s"] = vision.preprocess_seconds
+        timings["vision_encode_s"] = vision.encode_seconds
+
+    torch.manual_seed(seed)
+    start = time.perf_counter()
+    _, analysis_messages = create_analysis_prompt(image)
+    analysis_output, _, success = run_inference(model, processor, {'messages': analysis_messages, 'vision': vision}, max_new_tokens=100)
+    timings["analysis_s"] = time.perf_counter() - start
+    if not success: raise RuntimeError("Analysis failed.")
+
+    start = time.perf_counter()
+    _, placement_messages = create_placement_prompt(room_type, style, image, analysis_output[0], config.get("FURNITURE_CONFIG", {}), config.get("STYLE_MATERIALS", {}))
+    final_output, _, success = run_inference(model, processor, {'messages': placement_messages, 'vision': vision}, max_new_tokens=180)
+    timings["placement_s"] = time.perf_counter() - start
+    if not success: raise RuntimeError("Placement failed.")
+    timings["total_s"] = sum(timings.values())
+    return final_output[0], timings
+
+def main(args):
+    setup_environment()
+    with open("config.json", 'r') as f: config = json.load(f)
+    model, processor = prepare_benchmark_model(*load_benchmark_model(args.model, args.load_profile), config)
+    image = prepare_image(processor, validate_and_process_image_input(image_url=args.image_url))
+
+    baseline_text, baseline = run_pipeline(model, processor, config, image, args.room_type, args.style, args.seed, reuse_vision=False)
+    reused_text, reused = run_pipeline(model, processor, config, image, args.room_type, args.style, args.seed, reuse_vision=True)
+
+    write_report({"benchmark": "vision_reuse", "model": args.model, "baseline": baseline, "reused_vision": reused}, args.output)
+    print(f"Vision encoder runs: baseline 2, reused 1 (saved ~{reused['vision_encode_s']:.2f}s per request)")
+    print(f"Outputs identical for seed {args.seed}: {baseline_text == reused_text}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare per-prompt vision encoding with a shared VisionHandle.", formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument("--model", choices=["tiny", "real"], default="real")
+    parser.add_argument("--load_profile", type=str, default=None)
+    parser.add_argument("--room_type", type=str, default="living room")
+    parser.add_argument("--style", type=str, default="industrial")
+    parser.add_argument("--image_url", type=str, default="https://photos.zillowstatic.com/fp/3c83c384a192683219780302babe5ea9-p_f.jpg")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", type=str, default=None, help="Optional path for the JSON report.")
+    main(parser.parse_args())
@@ -0,0 +1,83 @@
+import time
+import json
+import difflib
+import argparse
+import torch
+from model_utils import setup_environment, run_inference, encode_image, prepare_image, validate_and_process_image_input
+from prompt_engineering import create_analysis_prompt, create_placement_prompt
+from benchmarks.common import write_report
+from benchmarks.tiny_model import load_benchmark_model, prepare_benchmark_model
+
+DEFAULT_BUDGETS = [256 * 28 * 28, 512 * 28 * 28, 768 * 28 * 28, 1280 * 28 * 28, 2048 * 28 * 28]
+
+def text_similarity(a, b):
+    """Word-sequence similarity (difflib ratio) and word-set Jaccard between two outputs."""
+    words_a, words_b = a.lower().split(), b.lower().split()
+    union = set(words_a) | set(words_b)
+    return {
+        "sequence_ratio": round(difflib.SequenceMatcher(None, words_a, words_b).ratio(), 4),
+        "jaccard": round(len(set(words_a) & set(words_b)) / len(union), 4) if union else 1.0,
+    }
+
+def run_budget(model, processor, config, original, budget, args, seed):
+    image = prepare_image(processor, original, budget)
+    torch.manual_seed(seed)
+    start = time.perf_counter()
+    vision = encode_image(model, processor, image)
+    _, analysis_messages = create_analysis_prompt(image)
+    analysis_output, _, success = run_inference(model, processor, {'messages': analysis_messages, 'vision': vision}, max_new_tokens=100)
+    if not success: raise RuntimeError(f"Analysis failed at budget {budget}.")
+    analysis_s = time.perf_counter() - start
+
+    start = time.perf_counter()
+    _, placement_messages = create_placement_prompt(args.room_type, args.style, image, analysis_output[0], config.get("FURNITURE_CONFIG", {}), config.get("STYLE_MATERIALS", {}))
+    final_output, _, success = run_inference(model, processor, {'messages': placement_messages, 'vision': vision}, max_new_tokens=180)
+    if not success: raise RuntimeError(f"Placement failed at budget {budget}.")
+    return {
+        "resolution": f"{image.width}x{image.height}",
+        "visual_tokens": int(vision.image_embeds.shape[0]),
+        "vision_encode_s": vision.encode_seconds,
+        "analysis_s": analysis_s,
+        "placement_s": time.perf_counter() - start,
+        "analysis": analysis_output[0],
+        "suggestion": final_output[0],
+    }
+
+def main(args):
+    setup_environment()
+    with open("config.json", 'r') as f: config = json.load(f)
+    original = validate_and_process_image_input(image_url=args.image_url)
+    budgets = sorted(args.budgets)
+    model, processor = prepare_benchmark_model(*load_benchmark_model(args.model, args.load_profile), config, {"max_pixels": budgets[-1]})
+
+    results = {budget: [run_budget(model, processor, config, original, budget, args, args.seed + run) for run in range(args.runs)] for budget in budgets}
+    reference = results[budgets[-1]]
+
+    report = []
+    for budget in budgets:
+        runs = results[budget]
+        similarity = [text_similarity(run["suggestion"], ref["suggestion"]) for run, ref in zip(runs, reference)]
+        report.append({
+            "max_pixels": budget,
+            "resolution": runs[0]["resolution"],
+            "visual_tokens": runs[0]["visual_tokens"],
+            "mean_vision_encode_s": round(sum(run["vision_encode_s"] for run in runs) / len(runs), 4),
+            "mean_total_s": round(sum(run["analysis_s"] + run["placement_s"] for run in runs) / len(runs), 4),
+            "mean_sequence_ratio_vs_largest": round(sum(item["sequence_ratio"] for item in similarity) / len(similarity), 4),
+            "mean_jaccard_vs_largest": round(sum(item["jaccard"] for item in similarity) / len(similarity), 4),
+            "sample_suggestion": runs[0]["suggestion"],
+        })
+    write_report({"benchmark": "visual_budget", "model": args.model, "budgets": report}, args.output)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Visual-token count, latency and output similarity across image pixel budgets.", formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument("--model", choices=["tiny", "real"], default="real")
+    parser.add_argument("--load_profile", type=str, default=None)
+    parser.add_argument("--room_type", type=str, default="living room")
+    parser.add_argument("--style", type=str, default="industrial")
+    parser.add_argument("--image_url", type=str, default="https://photos.zillowstatic.com/fp/3c83c384a192683219780302babe5ea9-p_f.jpg")
+    parser.add_argument("--budgets", type=int, nargs="+", default=DEFAULT_BUDGETS, help="max_pixels values to compare; the largest is the similarity reference.")
+    parser.add_argument("--runs", type=int, default=3, help="Seeded runs per budget; run i uses the same seed at every budget.")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", type=str, default=None, help="Optional path for the JSON report.")
+    main(parser.parse_args())
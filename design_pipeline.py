@@ -0,0 +1,209 @@
+import time
+import asyncio
+from model_utils import speculative_mode, DEFAULT_MODEL_NAME
+from analysis_cache import AnalysisCache, image_content_hash
+from response_cache import ResponseCache, RequestCoalescer, normalize_params, response_version, response_key
+from batching import QueueFullError, DeadlineExceededError
+from worker_pool import create_engine, ReplicaPool
+from metrics import record_error, record_response
+from prompt_engineering import create_analysis_prompt, create_placement_prompt, apply_important_prompt, create_variant_placement_prompts, placement_checklist, placement_design_rules, design_rules_enabled, create_stop_rule
+from prompt_templates import compile_prompt_templates, prompt_versions, ConfigWatcher
+
+DEFAULT_PARAMS = {"room_type": "living room", "style": "industrial", "important_prompt": "", "max_tokens": 180}
+DESIGN_KEY_PARAMS = ("room_type", "style", "important_prompt", "max_tokens", "seed")
+
+def request_params(request):
+    """The request's fields as the pipeline reads them: DEFAULT_PARAMS filled in, None values dropped."""
+    return {**DEFAULT_PARAMS, **{key: value for key, value in request.items() if value is not None}}
+
+def _remaining(deadline):
+    return None if deadline is None else max(0.0, deadline - time.monotonic())
+
+class PipelineError(RuntimeError):
+    """A stage failed or produced no output; metrics holds what the stages that ran reported."""
+    def __init__(self, message, metrics=None):
+        super().__init__(message)
+        self.metrics = metrics
+
+class DesignPipeline:
+    """
+    The analysis and placement pipeline behind both the API server and the RunPod handler: the
+    serving engine, the analysis and response caches, request coalescing and config reloads.
+    Requests are dicts from request_params. The stages are coroutines that wait on the engine without
+    blocking their event loop; blocking cache work runs in worker threads.
+
+    A full queue raises QueueFullError, a missed deadline DeadlineExceededError (the job is cancelled)
+    and a stage without output PipelineError.
+    """
+    def __init__(self, model, processor, config):
+        self.model = model
+        self.processor = processor
+        self.config = config
+        # Compiled before create_engine so forked replicas inherit the compiled templates.
+        print(f"Prompt templates compiled: {compile_prompt_templates(processor, config)}")
+        self.engine = create_engine(model, processor, config)
+        self.prompt_versions = prompt_versions(processor, config)
+        self.analysis_cache = AnalysisCache.from_config(config, DEFAULT_MODEL_NAME, self.prompt_versions["analysis"])
+        self.response_cache = ResponseCache.from_config(config)
+        self.coalescer = RequestCoalescer()
+        self.responses_version = response_version(config, DEFAULT_MODEL_NAME, self.prompt_versions)
+        self.config_watcher = ConfigWatcher.from_config(config)
+
+    def reload(self):
+        """
+        Applies edits to config.json: prompt templates are recompiled here and in any forked replicas,
+        then the config and the response version are swapped. Sections read only at startup (SERVING,
+        BATCHING, MODEL, IMAGE_PREPROCESSING) still need a restart. Returns the compile stats, or None
+        if nothing was reloaded.
+        """
+        new_config = self.config_watcher.poll()
+        if new_config is None:
+            return None
+        try:
+            stats = compile_prompt_templates(self.processor, new_config)
+            versions = prompt_versions(self.processor, new_config)
+        except Exception as e:
+            print(f"Config reload failed, keeping the previous config: {e}")
+            return None
+        if isinstance(self.engine, ReplicaPool):
+            self.engine.reload_config(new_config)
+        self.config, self.prompt_versions = new_config, versions
+        self.responses_version = response_version(new_config, DEFAULT_MODEL_NAME, versions)
+        print(f"Reloaded config.json; prompt templates compiled: {stats}")
+        return stats
+
+    def stop_rule(self, stage, room_type=None):
+        return create_stop_rule(self.config.get("STOPPING", {}), stage, placement_checklist(room_type, self.config.get("FURNITURE_CONFIG", {})))
+
+    def response_key(self, kind, image, request):
+        """Keys a "design" or "batch" response on the image content, the normalized parameters and responses_version."""
+        if kind == "batch":
+            params = {"variants": request["variants"], "max_tokens": request["max_tokens"], "seed": request.get("seed")}
+        else:
+            params = {key: request.get(key) for key in DESIGN_KEY_PARAMS}
+        return response_key(kind, image_content_hash(image), normalize_params(**params), self.responses_version)
+
+    async def _run(self, stage, submit, deadline):
+        """
+        Calls submit(deadline) and waits for its future until the deadline. A full queue raises at once;
+        a missed deadline cancels the queued job.
+        """
+        try:
+            future = submit(deadline)
+        except QueueFullError:
+            record_error(stage, "queue_full")
+            raise
+        try:
+            return await asyncio.wait_for(asyncio.wrap_future(future), timeout=_remaining(deadline))
+        except QueueFullError:
+            # A replica's own engine may still turn the job away after the pool accepted it.
+            record_error(stage, "queue_full")
+            raise
+        except (asyncio.TimeoutError, DeadlineExceededError):
+            future.cancel()
+            record_error(stage, "deadline")
+            raise DeadlineExceededError("Request deadline exceeded before inference completed.")
+
+    async def analyze_room(self, image, request, deadline=None):
+        """
+        Encodes the image once and runs (or reuses from cache) the analysis stage.
+        Returns its VisionHandle, the analysis text and the analysis stage's metrics.
+        """
+        try:
+            vision = await self._run("encode", lambda d: self.engine.submit_encode(image, deadline=d), deadline)
+        except (QueueFullError, DeadlineExceededError):
+            raise
+        except Exception as e:
+            raise PipelineError(f"Failed to encode the room image: {e}")
+
+        cache_key = await asyncio.to_thread(self.analysis_cache.key_for, image, request.get("seed"))
+        room_analysis = None if request.get("bypass_cache") else await asyncio.to_thread(self.analysis_cache.get, cache_key)
+        analysis_metrics = {"vision_encode_s": vision.preprocess_seconds + vision.encode_seconds, "cached": room_analysis is not None}
+        if room_analysis is None:
+            _, analysis_messages = create_analysis_prompt(image)
+            inputs = {'messages': analysis_messages, 'vision': vision, 'stop': self.stop_rule("analysis"), 'speculative': speculative_mode(self.config, "analysis"), 'profile': request.get("profile", False), 'seed': request.get("seed")}
+            analysis_output, stats, success = await self._run("analysis", lambda d: self.engine.submit("analysis", inputs, max_new_tokens=100, deadline=d), deadline)
+            if not success or not analysis_output:
+                raise PipelineError("Failed to analyze the room image.", {"analysis": stats})
+            room_analysis = analysis_output[0]
+            await asyncio.to_thread(self.analysis_cache.put, cache_key, room_analysis)
+            analysis_metrics.update(stats)
+        return vision, room_analysis, analysis_metrics
+
+    async def prepare_placement(self, image, request, deadline=None):
+        """Runs everything up to the placement stage; returns what the placement stage needs."""
+        vision, room_analysis, analysis_metrics = await self.analyze_room(image, request, deadline)
+        design_rules = placement_design_rules(request["room_type"]) if design_rules_enabled(self.config) else ()
+        _, placement_messages = create_placement_prompt(request["room_type"], request["style"], image, room_analysis, self.config.get("FURNITURE_CONFIG", {}), self.config.get("STYLE_MATERIALS", {}), design_rules)
+        apply_important_prompt(placement_messages, request["important_prompt"])
+        return vision, room_analysis, placement_messages, analysis_metrics
+
+    def placement_inputs(self, request, vision, placement_messages):
+        """The placement job's inputs; streaming callers add their 'streamer' and 'cancel_event'."""
+        return {'messages': placement_messages, 'vision': vision, 'stop': self.stop_rule("placement", request["room_type"]), 'speculative': speculative_mode(self.config, "placement"), 'profile': request.get("profile", False), 'seed': request.get("seed")}
+
+    async def design(self, image, request, deadline=None):
+        """Runs the analysis and placement stages; streaming callers cache the same record under the same key."""
+        vision, room_analysis, placement_messages, analysis_metrics = await self.prepare_placement(image, request, deadline)
+        inputs = self.placement_inputs(request, vision, placement_messages)
+        final_output, stats, success = await self._run("placement", lambda d: self.engine.submit("placement", inputs, max_new_tokens=request["max_tokens"], deadline=d), deadline)
+        if not success or not final_output:
+            raise PipelineError("Failed to generate a final placement suggestion.", {"analysis": analysis_metrics, "placement": stats})
+        return {"room_analysis": room_analysis, "suggestion": final_output[0], "metrics": {"analysis": analysis_metrics, "placement": stats}}
+
+    async def design_batch(self, image, request, deadline=None):
+        """
+        Analyzes the room once, then generates every variant's placement in a single batched generate()
+        call. Suggestions are keyed by the variant's id, or "room_type/style" by default.
+        """
+        vision, room_analysis, analysis_metrics = await self.analyze_room(image, request, deadline)
+        variants = request["variants"]
+        prompts = create_variant_placement_prompts(variants, image, room_analysis, self.config.get("FURNITURE_CONFIG", {}), self.config.get("STYLE_MATERIALS", {}), design_rules_enabled(self.config))
+        batch_inputs = [{'messages': messages, 'vision': vision, 'stop': self.stop_rule("placement", variant.get("room_type", DEFAULT_PARAMS["room_type"])), 'seed': request.get("seed")} for (_, messages), variant in zip(prompts, variants)]
+        max_new_tokens = [variant.get("max_tokens") or request["max_tokens"] for variant in variants]
+        outputs, stats, success = await self._run("placement", lambda d: self.engine.submit_group("placement", batch_inputs, max_new_tokens, deadline=d), deadline)
+        if not success or not outputs:
+            raise PipelineError("Failed to generate the placement suggestions.", {"analysis": analysis_metrics, "placement": stats})
+        return {
+            "room_analysis": room_analysis, "suggestions": {key: output for (key, _), output in zip(prompts, outputs)},
+            "metrics": {"analysis": analysis_metrics, "placement": stats}
+        }
+
+    def uses_response_cache(self, request):
+        """bypass_cache and profiled requests always run the model."""
+        return self.response_cache is not None and not request.get("bypass_cache") and not request.get("profile")
+
+    def cached_lookup(self, endpoint, request, key):
+        """The cached response for key, or None; only hits are recorded."""
+        response = self.response_cache.get(key) if self.uses_response_cache(request) else None
+        if response is not None:
+            record_response(endpoint, "hit")
+        return response
+
+    def cache_response(self, endpoint, request, key, response):
+        """Records a computed response and caches it, minus any profiler traces."""
+        record_response(endpoint, "computed")
+        if self.uses_response_cache(request):
+            metrics = {stage: {name: value for name, value in stats.items() if name != "profile_trace"} for stage, stats in response.get("metrics", {}).items()}
+            self.response_cache.put(key, {**response, "metrics": metrics})
+
+    async def cached_response(self, endpoint, request, key, compute, deadline=None):
+        """
+        Serves a response from the response cache, or waits for a concurrent identical request's
+        computation, or awaits compute() and caches its result. Failures raise and are never cached.
+        """
+        if request.get("bypass_cache") or request.get("profile"):
+            return await compute()
+        response = self.cached_lookup(endpoint, request, key)
+        if response is not None:
+            return response
+        try:
+            response, coalesced = await asyncio.wait_for(self.coalescer.run(key, compute), timeout=_remaining(deadline))
+        except asyncio.TimeoutError:
+            record_error(endpoint, "deadline")
+            raise DeadlineExceededError("Request deadline exceeded before inference completed.")
+        if coalesced:
+            record_response(endpoint, "coalesced")
+        else:
+            self.cache_response(endpoint, request, key, response)
+        return response
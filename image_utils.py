@@ -0,0 +1,133 @@
+import io
+import math
+import asyncio
+import base64
+import requests
+from requests.adapters import HTTPAdapter
+from PIL import Image
+
+DEFAULT_MIN_RESOLUTION = (400, 400)
+MAX_DOWNLOAD_BYTES = 20 * 1024 * 1024
+MAX_IMAGE_PIXELS = 40_000_000
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+
+_session = None
+
+def get_http_session():
+    """Returns a process-wide requests session so repeated fetches reuse pooled connections."""
+    global _session
+    if _session is None:
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=8, pool_maxsize=32, max_retries=2)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        _session = session
+    return _session
+
+def download_image_bytes(image_url, max_bytes=MAX_DOWNLOAD_BYTES, timeout=10):
+    try:
+        with get_http_session().get(image_url, stream=True, timeout=timeout) as response:
+            response.raise_for_status()
+            content_type = response.headers.get('content-type', '').lower()
+            if not content_type.startswith('image/'):
+                raise ValueError(f"URL does not point to a valid image (Content-Type: {content_type}).")
+            content_length = response.headers.get('content-length')
+            if content_length and content_length.isdigit() and int(content_length) > max_bytes:
+                raise ValueError(f"Image is larger than the {max_bytes // (1024 * 1024)} MiB download limit.")
+            buffer = bytearray()
+            for chunk in response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                buffer.extend(chunk)
+                if len(buffer) > max_bytes:
+                    raise ValueError(f"Image is larger than the {max_bytes // (1024 * 1024)} MiB download limit.")
+            return bytes(buffer)
+    except requests.exceptions.RequestException as e:
+        raise ValueError(f"Network error or invalid URL. Could not fetch image: {e}")
+
+def check_image_header(image, min_resolution=DEFAULT_MIN_RESOLUTION, max_pixels=MAX_IMAGE_PIXELS):
+    """Checks the resolution PIL read from the header, before any pixel data is decoded."""
+    if image.width < min_resolution[0] or image.height < min_resolution[1]:
+        raise ValueError(f"Image resolution ({image.width}x{image.height}) is below the required minimum of {min_resolution[0]}x{min_resolution[1]}.")
+    if image.width * image.height > max_pixels:
+        raise ValueError(f"Image resolution ({image.width}x{image.height}) exceeds the maximum of {max_pixels} pixels.")
+
+def decode_image(image_data, min_resolution=DEFAULT_MIN_RESOLUTION, max_pixels=MAX_IMAGE_PIXELS):
+    try:
+        image = Image.open(io.BytesIO(image_data))
+        check_image_header(image, min_resolution, max_pixels)
+        image.load()
+        return image.convert("RGB") if image.mode != "RGB" else image
+    except ValueError:
+        raise
+    except Image.DecompressionBombError:
+        raise ValueError("Image is too large and could be a decompression bomb.")
+    except Exception as e:
+        raise ValueError(f"Image is corrupt or unreadable: {e}")
+
+def decode_base64_image(image_base64, min_resolution=DEFAULT_MIN_RESOLUTION, max_pixels=MAX_IMAGE_PIXELS):
+    if ',' in image_base64:
+        image_base64 = image_base64.split(',')[1]
+    try:
+        image_data = base64.b64decode(image_base64)
+    except Exception as e:
+        raise ValueError(f"Invalid base64 image data: {e}")
+    return decode_image(image_data, min_resolution, max_pixels)
+
+def fetch_image(image_url, min_resolution=DEFAULT_MIN_RESOLUTION, max_bytes=MAX_DOWNLOAD_BYTES, max_pixels=MAX_IMAGE_PIXELS):
+    """Downloads, validates and decodes an image exactly once, returning an RGB PIL image."""
+    image_data = download_image_bytes(image_url, max_bytes=max_bytes)
+    return decode_image(image_data, min_resolution, max_pixels)
+
+async def download_image_bytes_async(client, image_url, max_bytes=MAX_DOWNLOAD_BYTES, timeout=10):
+    """httpx.AsyncClient counterpart of download_image_bytes, for callers running on an event loop."""
+    import httpx
+    try:
+        async with client.stream("GET", image_url, timeout=timeout, follow_redirects=True) as response:
+            response.raise_for_status()
+            content_type = response.headers.get('content-type', '').lower()
+            if not content_type.startswith('image/'):
+                raise ValueError(f"URL does not point to a valid image (Content-Type: {content_type}).")
+            content_length = response.headers.get('content-length')
+            if content_length and content_length.isdigit() and int(content_length) > max_bytes:
+                raise ValueError(f"Image is larger than the {max_bytes // (1024 * 1024)} MiB download limit.")
+            buffer = bytearray()
+            async for chunk in response.aiter_bytes(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                buffer.extend(chunk)
+                if len(buffer) > max_bytes:
+                    raise ValueError(f"Image is larger than the {max_bytes // (1024 * 1024)} MiB download limit.")
+            return bytes(buffer)
+    except httpx.HTTPError as e:
+        raise ValueError(f"Network error or invalid URL. Could not fetch image: {e}")
+
+async def fetch_image_async(client, image_url, min_resolution=DEFAULT_MIN_RESOLUTION, max_bytes=MAX_DOWNLOAD_BYTES, max_pixels=MAX_IMAGE_PIXELS):
+    """Downloads without blocking the event loop and decodes on a worker thread."""
+    image_data = await download_image_bytes_async(client, image_url, max_bytes=max_bytes)
+    return await asyncio.to_thread(decode_image, image_data, min_resolution, max_pixels)
+
+def fit_pixel_budget(image, max_pixels, min_pixels=4 * 28 * 28, factor=28):
+    """
+    Downscales the image so width * height <= max_pixels, keeping the aspect ratio and snapping both
+    sides to multiples of factor (the vision patch size times the merge size), so every pixel maps to
+    whole visual tokens. Images already inside the budget are only snapped, never upscaled past it.
+    """
+    width, height = image.size
+    if width * height > max_pixels:
+        scale = math.sqrt(max_pixels / (width * height))
+        new_width = max(factor, math.floor(width * scale / factor) * factor)
+        new_height = max(factor, math.floor(height * scale / factor) * factor)
+    else:
+        new_width = max(factor, round(width / factor) * factor)
+        new_height = max(factor, round(height / factor) * factor)
+        if new_width * new_height > max_pixels:
+            new_width = max(factor, math.floor(width / factor) * factor)
+            new_height = max(factor, math.floor(height / factor) * factor)
+    if new_width * new_height < min_pixels:
+        scale = math.sqrt(min_pixels / (new_width * new_height))
+        new_width = math.ceil(new_width * scale / factor) * factor
+        new_height = math.ceil(new_height * scale / factor) * factor
+    if (new_width, new_height) == (width, height):
+        return image
+    return image.resize((new_width, new_height), Image.BICUBIC)
+
+def visual_token_count(image, patch_size=14, merge_size=2):
+    """Visual tokens Qwen2-VL spends on an image already snapped to the patch grid."""
+    return (image.width // patch_size) * (image.height // patch_size) // (merge_size ** 2)
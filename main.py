@@ -3,8 +3,9 @@ import gc
 import json
 import argparse
 import torch
-from model_utils import setup_environment, load_model_adaptive, load_processor, run_inference, validate_and_process_image_input
-from prompt_engineering import create_analysis_prompt, create_placement_prompt
+from model_utils import setup_environment, load_model_and_processor, LOAD_PROFILES, run_inference, run_inference_batch, encode_image, speculative_mode, SPECULATIVE_MODES, configure_image_budget, prepare_image, warm_prefix_cache, validate_and_process_image_input
+from prompt_engineering import create_analysis_prompt, create_placement_prompt, create_warmup_prompts, create_variant_placement_prompts, max_variants, placement_checklist, placement_design_rules, design_rules_enabled, create_stop_rule
+from prompt_templates import compile_prompt_templates
 
 def load_config(filepath="config.json"):
     try:
@@ -12,10 +13,59 @@ def load_config(filepath="config.json"):
     except FileNotFoundError:
         print(f"Error: Configuration file not found at '{filepath}'. Exiting."); exit()
 
+def parse_variants(raw_variants):
+    variants = []
+    for values in raw_variants:
+        if len(values) < 2:
+            print(f"Error: --variant expects ROOM_TYPE STYLE [IMPORTANT_PROMPT], got {values}. Exiting."); exit()
+        variants.append({"room_type": values[0], "style": values[1], "important_prompt": " ".join(values[2:])})
+    return variants
+
+def format_stats(stats):
+    generated = stats.get("generated_tokens") or []
+    return (f"preprocess {stats.get('preprocess_s', 0):.2f}s, prefill {stats.get('prefill_s', 0):.2f}s, decode {stats.get('decode_s', 0):.2f}s, "
+            f"total {stats.get('total_s', 0):.2f}s | {stats.get('input_tokens', 0)} input tokens ({stats.get('visual_tokens', 0)} visual), "
+            f"{sum(generated)} generated at {stats.get('tokens_per_s', 0):.1f} tok/s | "
+            + (f"peak memory {stats['peak_memory_mb']:.0f} MB" if "peak_memory_mb" in stats else f"RSS +{stats.get('rss_delta_mb', 0):.0f} MB (process peak {stats.get('process_peak_rss_mb', 0):.0f} MB)")
+            + (f" | {stats['speculative']['mode']} acceptance {stats['speculative']['acceptance_rate']:.0%}, {stats['speculative']['tokens_per_step']:.2f} tokens/step" if stats.get("speculative") else ""))
+
+def run_variants(model, processor, raw_variants, image_input, vision, room_analysis, furniture_config, style_materials, stopping_config, seed=None, with_design_rules=False):
+    """Generates every variant's placement from the shared analysis in one batched call."""
+    variants = parse_variants(raw_variants)
+    prompts = create_variant_placement_prompts(variants, image_input, room_analysis, furniture_config, style_materials, with_design_rules)
+    print(f"\nGenerating {len(prompts)} furniture placement variants in one batch...")
+    outputs, stats, success = run_inference_batch(model, processor, [{'messages': messages, 'vision': vision, 'stop': create_stop_rule(stopping_config, "placement", placement_checklist(variant["room_type"], furniture_config)), 'seed': seed} for (_, messages), variant in zip(prompts, variants)], max_new_tokens=180, stage="placement")
+    if not success or not outputs:
+        print(f"\nFailed to generate the placement variants ({stats.get('error')})."); return
+    print(f"Placement metrics: {format_stats(stats)}")
+    for (key, _), output in zip(prompts, outputs):
+        print("\n======================================"); print(f"AI Interior Designer Suggestion ({key}):"); print("======================================")
+        print(output)
+    print("======================================\n")
+
+def run_manifest(args):
+    """Batch mode: loads the model once and runs every manifest item, writing results to --output."""
+    from batch_runner import BatchRunner, read_manifest
+    setup_environment()
+    config = load_config()
+    items = read_manifest(args.manifest)
+    model, processor = load_model_and_processor(config, args.load_profile)
+    warm_prefix_cache(model, processor, create_warmup_prompts())
+    configure_image_budget(processor, config.get("IMAGE_PREPROCESSING", {}))
+    print(f"Prompt templates compiled: {compile_prompt_templates(processor, config)}")
+    runner = BatchRunner(model, processor, config, batch_size=args.batch_size, prefetch_workers=args.prefetch_workers)
+    summary = runner.run(items, args.output)
+    print(f"Batch run finished: {json.dumps(summary)}")
+
 def main(args):
     """Main function to run the interior design AI."""
+    if args.manifest:
+        run_manifest(args); return
     print("\n=== Intelligent Furniture Placement AI ===")
-    print(f"Goal: Designing a {args.style.title()} {args.room_type.title()}.")
+    if args.variant:
+        print(f"Goal: Designing {len(args.variant)} variants of one room.")
+    else:
+        print(f"Goal: Designing a {args.style.title()} {args.room_type.title()}.")
     print("-----------------------------------------")
     
     try:
@@ -28,33 +78,51 @@ def main(args):
     gc.collect()
 
     config = load_config()
-    furniture_config = config.get("FURNITURE_CONFIG", {}); style_materials = config.get("STYLE_MATERIALS", {})
+    if args.speculative: config.setdefault("SPECULATIVE", {}).setdefault("placement", {})["mode"] = args.speculative
+    if args.variant and len(args.variant) > max_variants(config):
+        print(f"Error: at most {max_variants(config)} --variant values are allowed (BATCHING.max_variants). Exiting."); exit()
+    furniture_config = config.get("FURNITURE_CONFIG", {}); style_materials = config.get("STYLE_MATERIALS", {}); stopping_config = config.get("STOPPING", {})
 
     try:
-        model, _, _ = load_model_adaptive()
-        processor = load_processor()
+        model, processor = load_model_and_processor(config, args.load_profile)
+        warm_prefix_cache(model, processor, create_warmup_prompts())
+        configure_image_budget(processor, config.get("IMAGE_PREPROCESSING", {}))
+        image_input = prepare_image(processor, image_input, args.max_pixels)
+        print(f"Image prepared at {image_input.width}x{image_input.height}.")
+
+        print("\nEncoding room image...")
+        vision = encode_image(model, processor, image_input)
+        print(f"Vision preprocessing: {vision.preprocess_seconds:.2f}s, vision encoding: {vision.encode_seconds:.2f}s (reused by both prompts)")
 
         print("\nAnalyzing room image...")
         # Pass the validated image_input to the prompt function
         _, analysis_messages = create_analysis_prompt(image_input)
-        analysis_output, _, success = run_inference(model, processor, {'messages': analysis_messages}, max_new_tokens=100)
+        analysis_output, stats, success = run_inference(model, processor, {'messages': analysis_messages, 'vision': vision, 'stop': create_stop_rule(stopping_config, "analysis"), 'speculative': speculative_mode(config, "analysis"), 'seed': args.seed}, max_new_tokens=100, stage="analysis")
         
-        if not success or not analysis_output: raise RuntimeError("Failed to analyze the room image.")
+        if not success or not analysis_output: raise RuntimeError(f"Failed to analyze the room image ({stats.get('error')}).")
         
         room_analysis = analysis_output[0]
         print(f"Analysis complete: {room_analysis}")
+        print(f"Analysis metrics: {format_stats(stats)}")
+
+        if args.variant:
+            run_variants(model, processor, args.variant, image_input, vision, room_analysis, furniture_config, style_materials, stopping_config, args.seed, design_rules_enabled(config))
+            return
 
         print("\nGenerating furniture placement...")
-        _, placement_messages = create_placement_prompt(args.room_type, args.style, image_input, room_analysis, furniture_config, style_materials)
+        design_rules = placement_design_rules(args.room_type) if design_rules_enabled(config) else ()
+        _, placement_messages = create_placement_prompt(args.room_type, args.style, image_input, room_analysis, furniture_config, style_materials, design_rules)
         
-        final_output, _, success = run_inference(model, processor, {'messages': placement_messages}, max_new_tokens=180)
+        final_output, stats, success = run_inference(model, processor, {'messages': placement_messages, 'vision': vision, 'stop': create_stop_rule(stopping_config, "placement", placement_checklist(args.room_type, furniture_config)), 'speculative': speculative_mode(config, "placement"), 'seed': args.seed}, max_new_tokens=180, stage="placement")
         
         if success and final_output:
             print("\n======================================"); print("AI Interior Designer Suggestion:"); print("======================================")
             print(final_output[0])
             print("======================================\n")
+            print(f"Placement metrics: {format_stats(stats)}")
+            print(f"Vision encoding time saved by reuse: {vision.encode_seconds * (vision.uses - 1):.2f}s")
         else:
-            print("\nFailed to generate a final placement suggestion.")
+            print(f"\nFailed to generate a final placement suggestion ({stats.get('error')}).")
 
     except Exception as e:
         print(f"\nAn unexpected runtime error occurred: {e}")
@@ -68,5 +136,14 @@ if __name__ == "__main__":
     parser.add_argument("--room_type", type=str, default="living room", help="Type of the room to design.") 
     parser.add_argument("--style", type=str, default="industrial", help="Desired interior design style.") 
     parser.add_argument("--image_url", type=str, default="https://photos.zillowstatic.com/fp/3c83c384a192683219780302babe5ea9-p_f.jpg", help="URL of the empty room image.")
+    parser.add_argument("--max_pixels", type=int, default=None, help="Pixel budget for the image before the vision encoder (defaults to IMAGE_PREPROCESSING.max_pixels).")
+    parser.add_argument("--load_profile", type=str, default=None, choices=LOAD_PROFILES, help="Model load profile (overrides VLM_LOAD_PROFILE and MODEL.load_profile in config.json).")
+    parser.add_argument("--variant", nargs="+", action="append", metavar="VALUE", help="Repeatable: ROOM_TYPE STYLE [IMPORTANT_PROMPT]. Analyzes the room once and generates all variants in one batch.")
+    parser.add_argument("--speculative", type=str, default=None, choices=SPECULATIVE_MODES, help="Speculative decoding for the placement stage (overrides SPECULATIVE.placement.mode in config.json).")
+    parser.add_argument("--seed", type=int, default=None, help="Sample from a fixed seed so repeated runs give the same output.")
+    parser.add_argument("--manifest", type=str, default=None, help="JSONL or CSV of images (URL or path) with room_type and style. Runs batch mode instead of a single image.")
+    parser.add_argument("--output", type=str, default="results.jsonl", help="Batch mode: JSONL results file; items already completed in it are skipped.")
+    parser.add_argument("--batch_size", type=int, default=4, help="Batch mode: images per vision/generate batch.")
+    parser.add_argument("--prefetch_workers", type=int, default=8, help="Batch mode: threads downloading and decoding images ahead of the model.")
     args = parser.parse_args()
     main(args)
\ No newline at end of file
@@ -0,0 +1,133 @@
+import threading
+
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 40.0, 80.0, 160.0)
+THROUGHPUT_BUCKETS = (1.0, 2.0, 5.0, 10.0, 20.0, 50.0, 100.0, 200.0, 500.0)
+INFERENCE_PHASES = ("preprocess_s", "vision_encode_s", "prefill_s", "decode_s", "total_s")
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{str(value)}"' for key, value in labels) + "}"
+
+class _Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.total = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[index] += 1
+        self.total += 1
+        self.sum += value
+
+class MetricsRegistry:
+    """
+    Minimal thread-safe Prometheus registry: labelled counters, histograms and callback gauges,
+    rendered in the text exposition format by render().
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._help = {}
+        self._counters = {}
+        self._histograms = {}
+        self._histogram_buckets = {}
+        self._gauges = {}
+
+    def _declare(self, name, kind, help_text):
+        self._help.setdefault(name, (kind, help_text))
+
+    def inc(self, name, help_text, amount=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._declare(name, "counter", help_text)
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def observe(self, name, help_text, value, buckets=LATENCY_BUCKETS, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._declare(name, "histogram", help_text)
+            self._histogram_buckets.setdefault(name, buckets)
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = _Histogram(self._histogram_buckets[name])
+            histogram.observe(value)
+
+    def gauge(self, name, help_text, callback):
+        """Registers a gauge whose value is read from callback() at render time."""
+        with self._lock:
+            self._declare(name, "gauge", help_text)
+            self._gauges[name] = callback
+
+    def render(self):
+        with self._lock:
+            lines = []
+            for name, (kind, help_text) in sorted(self._help.items()):
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} {kind}")
+                if kind == "counter":
+                    for (metric, labels), value in sorted(self._counters.items()):
+                        if metric == name:
+                            lines.append(f"{name}{_format_labels(labels)} {value}")
+                elif kind == "histogram":
+                    for (metric, labels), histogram in sorted(self._histograms.items(), key=lambda item: item[0]):
+                        if metric != name:
+                            continue
+                        for bound, count in zip(histogram.buckets, histogram.counts):
+                            lines.append(f"{name}_bucket{_format_labels(labels + (('le', bound),))} {count}")
+                        lines.append(f"{name}_bucket{_format_labels(labels + (('le', '+Inf'),))} {histogram.total}")
+                        lines.append(f"{name}_sum{_format_labels(labels)} {histogram.sum}")
+                        lines.append(f"{name}_count{_format_labels(labels)} {histogram.total}")
+                else:
+                    try:
+                        lines.append(f"{name} {float(self._gauges[name]())}")
+                    except Exception:
+                        pass
+            return "\n".join(lines) + "\n"
+
+REGISTRY = MetricsRegistry()
+
+def classify_error(error):
+    """Maps an exception to a short, low-cardinality cause label."""
+    message = str(error).lower()
+    if "out of memory" in message or type(error).__name__ == "OutOfMemoryError":
+        return "out_of_memory"
+    if isinstance(error, TimeoutError):
+        return "deadline"
+    if isinstance(error, ValueError):
+        return "invalid_input"
+    return type(error).__name__.lower()
+
+def record_error(stage, cause):
+    REGISTRY.inc("vlm_errors_total", "Failed requests or inference calls by stage and cause.", stage=stage, cause=cause)
+
+def record_inference(stats):
+    """Records one run_inference_batch call's stats under its stage."""
+    stage = stats.get("stage", "inference")
+    REGISTRY.inc("vlm_inference_calls_total", "Batched inference calls by stage.", stage=stage)
+    REGISTRY.inc("vlm_inference_rows_total", "Prompts served by inference calls, by stage.", amount=stats.get("batch_size", 0), stage=stage)
+    if stats.get("error"):
+        record_error(stage, stats["error"])
+        return
+    for phase in INFERENCE_PHASES:
+        if stats.get(phase) is not None:
+            REGISTRY.observe("vlm_inference_seconds", "Inference latency by stage and phase.", stats[phase], stage=stage, phase=phase[:-2])
+    REGISTRY.inc("vlm_input_tokens_total", "Prompt tokens (including visual tokens) by stage.", amount=stats.get("input_tokens", 0), stage=stage)
+    REGISTRY.inc("vlm_visual_tokens_total", "Visual tokens by stage.", amount=stats.get("visual_tokens", 0), stage=stage)
+    REGISTRY.inc("vlm_generated_tokens_total", "Generated tokens by stage.", amount=sum(stats.get("generated_tokens", [])), stage=stage)
+    if stats.get("speculative"):
+        REGISTRY.inc("vlm_speculative_draft_tokens_total", "Draft tokens proposed to the target model, by stage.", amount=stats["speculative"]["draft_tokens"], stage=stage)
+        REGISTRY.inc("vlm_speculative_accepted_tokens_total", "Draft tokens the target model accepted, by stage.", amount=stats["speculative"]["accepted_tokens"], stage=stage)
+    if stats.get("tokens_per_s"):
+        REGISTRY.observe("vlm_decode_tokens_per_second", "Decode throughput per inference call.", stats["tokens_per_s"], buckets=THROUGHPUT_BUCKETS, stage=stage)
+
+def record_encode(num_images, preprocess_seconds, encode_seconds):
+    REGISTRY.inc("vlm_encoded_images_total", "Images run through the vision tower.", amount=num_images)
+    REGISTRY.observe("vlm_inference_seconds", "Inference latency by stage and phase.", preprocess_seconds, stage="encode", phase="preprocess")
+    REGISTRY.observe("vlm_inference_seconds", "Inference latency by stage and phase.", encode_seconds, stage="encode", phase="vision_encode")
+
+def record_response(endpoint, outcome):
+    """outcome is "hit" (served from the response cache), "coalesced" (shared an in-flight request) or "computed"."""
+    REGISTRY.inc("vlm_responses_total", "Responses by endpoint and how they were produced.", endpoint=endpoint, outcome=outcome)
@@ -1,63 +1,41 @@
 import os
+import json
+import time
+import tempfile
+import contextlib
 import torch
-import requests
-from transformers import Qwen2VLForConditionalGeneration, AutoProcessor
-from accelerate import init_empty_weights, infer_auto_device_map
-import io
-import base64
-from PIL import Image
+from image_utils import fetch_image, decode_base64_image, fit_pixel_budget
+from prefix_cache import get_prefix_cache, prefill_prefix, expand_prefix
+from prompt_templates import get_prompt_compiler
+from metrics import record_inference, record_encode, classify_error
+
+DEFAULT_MODEL_NAME = "Qwen/Qwen2-VL-2B-Instruct"
 
 def validate_image_url(image_url, min_resolution=(400, 400)):
-    try:
-        response = requests.get(image_url, stream=True, timeout=10)
-        response.raise_for_status()
-        content_type = response.headers.get('content-type', '').lower()
-        if not content_type.startswith('image/'):
-            raise ValueError(f"URL does not point to a valid image (Content-Type: {content_type}).")
-        image_data = response.content
-        image = Image.open(io.BytesIO(image_data))
-        image.verify()
-        image = Image.open(io.BytesIO(image_data))
-        if image.width < min_resolution[0] or image.height < min_resolution[1]:
-            raise ValueError(f"Image resolution ({image.width}x{image.height}) is below the required minimum of {min_resolution[0]}x{min_resolution[1]}.")
-        return True
-    except requests.exceptions.RequestException as e:
-        raise ValueError(f"Network error or invalid URL. Could not fetch image: {e}")
-    except Image.DecompressionBombError:
-        raise ValueError("Image is too large and could be a decompression bomb.")
-    except Exception as e:
-        raise ValueError(f"Image is corrupt or unreadable: {e}")
+    """Fetches and validates the image once; the returned PIL image is reused by every prompt."""
+    return fetch_image(image_url, min_resolution=min_resolution)
 
 def validate_and_process_image_input(image_url=None, image_base64=None, min_resolution=(400, 400)):
     if image_base64:
-        try:
-            if ',' in image_base64:
-                image_base64 = image_base64.split(',')[1]
-            image_data = base64.b64decode(image_base64)
-            image = Image.open(io.BytesIO(image_data))
-            image.verify()
-            image = Image.open(io.BytesIO(image_data))
-            if image.width < min_resolution[0] or image.height < min_resolution[1]:
-                raise ValueError(f"Image resolution ({image.width}x{image.height}) is below the minimum of {min_resolution[0]}x{min_resolution[1]}.")
-            return image
-        except Exception as e:
-            raise ValueError(f"Invalid base64 or corrupt image data: {e}")
+        return decode_base64_image(image_base64, min_resolution=min_resolution)
     elif image_url:
-        validate_image_url(image_url, min_resolution)
-        return image_url
+        return validate_image_url(image_url, min_resolution)
     else:
         raise ValueError("No image input provided. Please supply either 'image_url' or 'image_base64'.")
 
-try:
-    from qwen_vl_utils import process_vision_info
-except ImportError:
-    def process_vision_info(messages):
+# transformers, accelerate and qwen_vl_utils are imported inside the functions that use them, so that
+# importing this module (and the API/handler modules on top of it) stays cheap on a cold start.
+def process_vision_info(messages):
+    try:
+        from qwen_vl_utils import process_vision_info as qwen_process_vision_info
+    except ImportError:
         images = [
             entry['image']
             for message in messages if message['role'] == 'user'
             for entry in message['content'] if entry['type'] == 'image'
         ]
         return images, None
+    return qwen_process_vision_info(messages)
 
 def setup_environment():
     os.environ["PYTORCH_CUDA_ALLOC_CONF"] = "expandable_segments:True"
@@ -68,34 +46,523 @@ def get_available_device():
     else:
         return "cpu"
 
-def load_model_adaptive(model_name="Qwen/Qwen2-VL-2B-Instruct"):
+LOAD_PROFILES = ("auto", "fp32", "bf16", "int8-dynamic", "quanto-int8", "quanto-int4")
+
+def resolve_load_profile(profile=None, config=None):
+    """Picks the load profile: explicit argument (CLI) first, then VLM_LOAD_PROFILE, then MODEL.load_profile in config.json."""
+    profile = profile or os.environ.get("VLM_LOAD_PROFILE") or (config or {}).get("MODEL", {}).get("load_profile", "auto")
+    if profile not in LOAD_PROFILES:
+        raise ValueError(f"Unknown load profile '{profile}'. Choose one of: {', '.join(LOAD_PROFILES)}.")
+    return profile
+
+def detect_memory_budget(device, headroom=0.9):
+    """Builds an accelerate max_memory map from what is actually free on this host instead of fixed sizes."""
+    import psutil
+    max_memory = {"cpu": f"{int(psutil.virtual_memory().available * headroom) // 2**20}MiB"}
+    if device == "cuda":
+        for index in range(torch.cuda.device_count()):
+            free, _ = torch.cuda.mem_get_info(index)
+            max_memory[index] = f"{int(free * headroom) // 2**20}MiB"
+    return max_memory
+
+def _import_quanto():
+    try:
+        from optimum import quanto
+    except ImportError:
+        import quanto
+    return quanto
+
+def _quantize_language_model(model, profile):
+    """
+    Quantizes the Linear layers of the language model only. The vision tower runs once per image and
+    is left in full precision, and lm_head stays untouched because it is tied to the input embeddings.
+    """
+    language_model = _get_language_model(model)
+    if profile == "int8-dynamic":
+        torch.ao.quantization.quantize_dynamic(language_model, {torch.nn.Linear}, dtype=torch.qint8, inplace=True)
+    else:
+        quanto = _import_quanto()
+        quanto.quantize(language_model, weights=quanto.qint8 if profile == "quanto-int8" else quanto.qint4)
+        quanto.freeze(language_model)
+    return model
+
+def load_model_adaptive(model_name=DEFAULT_MODEL_NAME, profile="auto"):
+    """
+    Loads the model under a load profile:
+      auto          bf16 on CUDA, fp32 on CPU (the original behaviour)
+      fp32 / bf16   plain reduced or full precision on whichever device is available
+      int8-dynamic  fp32 weights with dynamically quantized int8 Linear layers (CPU only)
+      quanto-int8 / quanto-int4  weight-only quantization through quanto
+    """
     device = get_available_device()
+    if profile == "int8-dynamic" and device != "cpu":
+        raise ValueError("The int8-dynamic profile is only supported on CPU.")
+    if profile == "auto":
+        torch_dtype = torch.bfloat16 if device == "cuda" else torch.float32
+    elif profile in ("fp32", "int8-dynamic"):
+        torch_dtype = torch.float32
+    else:
+        torch_dtype = torch.bfloat16
+
+    from transformers import Qwen2VLForConditionalGeneration
     if device == "cuda":
-        with init_empty_weights():
-            model = Qwen2VLForConditionalGeneration.from_pretrained(model_name, torch_dtype="auto")
-        device_map = infer_auto_device_map(model, max_memory={0: "7GiB", "cpu": "15GiB"})
-        model = Qwen2VLForConditionalGeneration.from_pretrained(model_name, device_map=device_map, torch_dtype=torch.bfloat16)
+        # A single from_pretrained resolves the device map itself; no throwaway empty-weights instance.
+        model = Qwen2VLForConditionalGeneration.from_pretrained(model_name, device_map="auto", max_memory=detect_memory_budget(device), torch_dtype=torch_dtype)
     else:
-        model = Qwen2VLForConditionalGeneration.from_pretrained(model_name, torch_dtype=torch.float32, device_map="cpu")
+        model = Qwen2VLForConditionalGeneration.from_pretrained(model_name, torch_dtype=torch_dtype, device_map="cpu")
+
+    if profile in ("int8-dynamic", "quanto-int8", "quanto-int4"):
+        _quantize_language_model(model, profile)
     return model, device, 0
 
-def load_processor(model_name="Qwen/Qwen2-VL-2B-Instruct"):
+def load_processor(model_name=DEFAULT_MODEL_NAME):
+    from transformers import AutoProcessor
     processor = AutoProcessor.from_pretrained(model_name)
     return processor
 
-def run_inference(model, processor, inputs, max_new_tokens=120):
-    messages = inputs['messages']
-    try:
-        text = processor.apply_chat_template(messages, tokenize=False, add_generation_prompt=True)
-        image_inputs, _ = process_vision_info(messages)
-        processed_inputs = processor(text=[text], images=image_inputs, padding=True, return_tensors="pt").to(model.device)
-        generated_ids = model.generate(
-            **processed_inputs, max_new_tokens=max_new_tokens, temperature=0.6, do_sample=True,
-            top_p=0.9, repetition_penalty=1.15, pad_token_id=processor.tokenizer.eos_token_id
+def resolve_snapshot_dir(config=None):
+    return os.environ.get("VLM_SNAPSHOT_DIR") or (config or {}).get("MODEL", {}).get("snapshot_dir")
+
+def load_model_and_processor(config=None, profile=None):
+    """
+    Loads from the pre-serialized snapshot (VLM_SNAPSHOT_DIR or MODEL.snapshot_dir) when one exists,
+    otherwise from the Hugging Face checkpoint under the resolved load profile.
+    """
+    from snapshot import has_snapshot, load_snapshot
+    snapshot_dir = resolve_snapshot_dir(config)
+    if has_snapshot(snapshot_dir):
+        model, processor, _, manifest = load_snapshot(snapshot_dir)
+        requested = profile or os.environ.get("VLM_LOAD_PROFILE")
+        if requested and requested != manifest["profile"]:
+            print(f"Warning: load profile '{requested}' was requested but the snapshot in '{snapshot_dir}' was written with '{manifest['profile']}'; using the snapshot. Remove or rebuild it to change profiles.")
+        return model, processor
+    model, _, _ = load_model_adaptive(profile=resolve_load_profile(profile, config))
+    return model, load_processor()
+
+def configure_image_budget(processor, preprocessing_config):
+    """Applies the IMAGE_PREPROCESSING pixel bounds from config.json to the processor's image resizing."""
+    image_processor = processor.image_processor
+    min_pixels = preprocessing_config.get("min_pixels", image_processor.min_pixels)
+    max_pixels = preprocessing_config.get("max_pixels", image_processor.max_pixels)
+    image_processor.min_pixels, image_processor.max_pixels = min_pixels, max_pixels
+    size = getattr(image_processor, "size", None)
+    if isinstance(size, dict):
+        if "min_pixels" in size: size["min_pixels"], size["max_pixels"] = min_pixels, max_pixels
+        if "shortest_edge" in size: size["shortest_edge"], size["longest_edge"] = min_pixels, max_pixels
+    return min_pixels, max_pixels
+
+def prepare_image(processor, image, max_pixels=None):
+    """
+    Downscales the image to the pixel budget before the processor sees it. max_pixels overrides the
+    configured budget for one request but can never exceed the processor's own ceiling.
+    """
+    image_processor = processor.image_processor
+    budget = min(max_pixels, image_processor.max_pixels) if max_pixels else image_processor.max_pixels
+    factor = image_processor.patch_size * image_processor.merge_size
+    return fit_pixel_budget(image, budget, min_pixels=image_processor.min_pixels, factor=factor)
+
+class VisionHandle:
+    """Per-request result of running the vision tower once, shared by every prompt that attaches the image."""
+    def __init__(self, image, image_grid_thw, image_embeds, preprocess_seconds, encode_seconds):
+        self.image = image
+        self.image_grid_thw = image_grid_thw
+        self.image_embeds = image_embeds
+        self.preprocess_seconds = preprocess_seconds
+        self.encode_seconds = encode_seconds
+        self.uses = 0
+
+def _get_visual(model):
+    return model.visual if hasattr(model, "visual") else model.model.visual
+
+def encode_images(model, processor, images):
+    """
+    Preprocesses the images and runs the vision encoder plus patch merger once for all of them,
+    returning one VisionHandle per image. Timings are split evenly across the images.
+    """
+    start = time.perf_counter()
+    image_inputs, _ = process_vision_info([{"role": "user", "content": [{"type": "image", "image": image} for image in images]}])
+    vision_inputs = processor.image_processor(images=image_inputs, return_tensors="pt")
+    preprocess_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    visual = _get_visual(model)
+    pixel_values = vision_inputs["pixel_values"].to(model.device, visual.dtype)
+    image_grid_thw = vision_inputs["image_grid_thw"].to(model.device)
+    with torch.inference_mode():
+        image_embeds = visual(pixel_values, grid_thw=image_grid_thw)
+    encode_seconds = time.perf_counter() - start
+
+    record_encode(len(images), preprocess_seconds, encode_seconds)
+    merge_length = processor.image_processor.merge_size ** 2
+    split_sizes = [int(grid.prod()) // merge_length for grid in image_grid_thw]
+    return [
+        VisionHandle(image, image_grid_thw[i:i + 1], embeds, preprocess_seconds / len(images), encode_seconds / len(images))
+        for i, (image, embeds) in enumerate(zip(images, image_embeds.split(split_sizes)))
+    ]
+
+def encode_image(model, processor, image):
+    """Preprocesses the image and runs the vision encoder plus patch merger exactly once."""
+    return encode_images(model, processor, [image])[0]
+
+def _get_language_model(model):
+    return getattr(model.model, "language_model", model.model)
+
+def _get_rope_index(model, input_ids, image_grid_thw, attention_mask):
+    owner = model if hasattr(model, "get_rope_index") else model.model
+    return owner.get_rope_index(input_ids, image_grid_thw, None, attention_mask)
+
+def _set_rope_deltas(model, rope_deltas):
+    """generate() derives decode-step positions from the cached rope deltas once the prompt is in the KV cache."""
+    model.rope_deltas = rope_deltas
+    if hasattr(model.model, "rope_deltas"):
+        model.model.rope_deltas = rope_deltas
+
+def _get_message_image(messages):
+    for message in messages:
+        if message['role'] == 'user' and isinstance(message['content'], list):
+            for entry in message['content']:
+                if entry['type'] == 'image':
+                    return entry['image']
+    return None
+
+def _expand_image_tokens(processor, texts, handles):
+    """Mirrors the processor's <|image_pad|> expansion so the text can be tokenized without re-processing pixels."""
+    image_token = getattr(processor, "image_token", "<|image_pad|>")
+    merge_length = processor.image_processor.merge_size ** 2
+    expanded = []
+    for text, handle in zip(texts, handles):
+        if handle is None:
+            expanded.append(text)
+            continue
+        num_tokens = int(handle.image_grid_thw.prod()) // merge_length
+        expanded.append(text.replace(image_token, "<|placeholder|>" * num_tokens, 1).replace("<|placeholder|>", image_token))
+    return expanded
+
+def _expand_image_ids(processor, token_ids, handle):
+    """The token-id counterpart of _expand_image_tokens, for prompts encoded by the prompt compiler."""
+    if handle is None:
+        return token_ids
+    image_token_id = processor.tokenizer.convert_tokens_to_ids(getattr(processor, "image_token", "<|image_pad|>"))
+    num_tokens = int(handle.image_grid_thw.prod()) // processor.image_processor.merge_size ** 2
+    index = token_ids.index(image_token_id)
+    return token_ids[:index] + [image_token_id] * num_tokens + token_ids[index + 1:]
+
+def _tokenize_prompts(processor, batch_inputs, handles):
+    """
+    Prompt token ids per row. When the processor's prompt templates are compiled, known prompt text
+    comes from the compiled segments; otherwise (encode returns None) the chat template is rendered
+    and tokenized in full.
+    """
+    compiler = get_prompt_compiler(processor)
+    token_lists = [compiler.encode(inputs['messages']) for inputs in batch_inputs]
+    if None not in token_lists:
+        return [_expand_image_ids(processor, token_ids, handle) for token_ids, handle in zip(token_lists, handles)]
+    texts = [processor.apply_chat_template(inputs['messages'], tokenize=False, add_generation_prompt=True) for inputs in batch_inputs]
+    return processor.tokenizer(_expand_image_tokens(processor, texts, handles))["input_ids"]
+
+def _static_prefix_length(model, token_ids):
+    """The chat-template prefix up to <|vision_start|> (system turn and user header) is identical for every request of a stage."""
+    vision_start_id = model.config.vision_start_token_id
+    return token_ids.index(vision_start_id) + 1 if vision_start_id in token_ids else 0
+
+def _build_batch(model, processor, token_lists):
+    """
+    Lays rows out as [shared prefix][padding][row suffix] so every row can reuse one cached prefix.
+    Without a shared prefix this degenerates to ordinary left padding.
+    """
+    prefix_len = _static_prefix_length(model, token_lists[0])
+    prefix_ids = token_lists[0][:prefix_len]
+    if any(ids[:prefix_len] != prefix_ids for ids in token_lists[1:]):
+        prefix_ids = []
+    pad_id = processor.tokenizer.pad_token_id if processor.tokenizer.pad_token_id is not None else processor.tokenizer.eos_token_id
+    max_len = max(len(ids) for ids in token_lists)
+    rows, masks = [], []
+    for ids in token_lists:
+        num_pad = max_len - len(ids)
+        rows.append(prefix_ids + [pad_id] * num_pad + ids[len(prefix_ids):])
+        masks.append([1] * len(prefix_ids) + [0] * num_pad + [1] * (len(ids) - len(prefix_ids)))
+    input_ids = torch.tensor(rows, device=model.device)
+    attention_mask = torch.tensor(masks, device=model.device)
+    return input_ids, attention_mask, prefix_ids
+
+def _embed_with_vision(model, input_ids, handles):
+    inputs_embeds = model.get_input_embeddings()(input_ids)
+    handles = [handle for handle in handles if handle is not None]
+    if not handles:
+        return inputs_embeds
+    image_embeds = torch.cat([handle.image_embeds for handle in handles], dim=0).to(inputs_embeds.device, inputs_embeds.dtype)
+    image_mask = (input_ids == model.config.image_token_id).unsqueeze(-1).expand_as(inputs_embeds)
+    return inputs_embeds.masked_scatter(image_mask, image_embeds)
+
+def _prefill(model, input_ids, attention_mask, inputs_embeds, image_grid_thw, prefix_ids):
+    """
+    Fills the KV cache with every prompt token except the last, starting from the cached static prefix
+    when there is one, so generate() only has to run the final prompt token and the decode steps.
+    """
+    from transformers import DynamicCache
+    batch_size, seq_len = input_ids.shape
+    prefix_len = len(prefix_ids)
+    if prefix_len:
+        prefix_cache = get_prefix_cache(model)
+        stored = prefix_cache.get(prefix_ids)
+        if stored is None:
+            stored = prefill_prefix(_get_language_model(model), prefix_ids, model.device)
+            prefix_cache.put(prefix_ids, stored)
+        past_key_values = expand_prefix(stored, batch_size)
+    else:
+        past_key_values = DynamicCache()
+
+    position_ids, rope_deltas = _get_rope_index(model, input_ids, image_grid_thw, attention_mask)
+    if seq_len - 1 > prefix_len:
+        _get_language_model(model)(
+            inputs_embeds=inputs_embeds[:, prefix_len:seq_len - 1], attention_mask=attention_mask[:, :seq_len - 1],
+            position_ids=position_ids[:, :, prefix_len:seq_len - 1], past_key_values=past_key_values,
+            cache_position=torch.arange(prefix_len, seq_len - 1, device=input_ids.device), use_cache=True
         )
-        input_token_len = processed_inputs.input_ids.shape[1]
-        generated_ids_trimmed = generated_ids[:, input_token_len:]
+    _set_rope_deltas(model, rope_deltas)
+    return past_key_values
+
+def warm_prefix_cache(model, processor, messages_list):
+    """Prefills the static prefix of each given prompt once, typically right after the model is loaded."""
+    for messages in messages_list:
+        text = processor.apply_chat_template(messages, tokenize=False, add_generation_prompt=True)
+        token_ids = processor.tokenizer([text])["input_ids"][0]
+        prefix_ids = token_ids[:_static_prefix_length(model, token_ids)]
+        prefix_cache = get_prefix_cache(model)
+        if prefix_ids and prefix_cache.get(prefix_ids) is None:
+            prefix_cache.put(prefix_ids, prefill_prefix(_get_language_model(model), prefix_ids, model.device))
+    return get_prefix_cache(model).stats()
+
+def make_streamer(processor, timeout=None, stop=None):
+    """
+    Returns a TextIteratorStreamer to put in inputs['streamer']; iterate it to receive decoded text as
+    it is generated. Pass the row's 'stop' rule so no text past its cut point is streamed.
+    """
+    from transformers import TextIteratorStreamer
+    from stopping import StopRule, StopRuleStreamer
+    if stop:
+        return StopRuleStreamer(processor.tokenizer, StopRule.from_dict(stop), skip_prompt=True, skip_special_tokens=True, timeout=timeout)
+    return TextIteratorStreamer(processor.tokenizer, skip_prompt=True, skip_special_tokens=True, timeout=timeout)
+
+SPECULATIVE_MODES = ("off", "prompt_lookup", "draft")
+_draft_models = {}
+
+def speculative_mode(config, stage):
+    """
+    The stage's speculative decoding settings from the SPECULATIVE section of config.json, as the
+    dict run_inference accepts under 'speculative', or None when the stage decodes normally.
+    """
+    speculative_config = (config or {}).get("SPECULATIVE", {})
+    stage_config = speculative_config.get(stage) or {}
+    mode = stage_config.get("mode", "off")
+    if mode not in SPECULATIVE_MODES:
+        raise ValueError(f"Unknown speculative mode '{mode}' for stage '{stage}'; expected one of {', '.join(SPECULATIVE_MODES)}.")
+    if mode == "off":
+        return None
+    return dict(stage_config, draft_model=stage_config.get("draft_model") or speculative_config.get("draft_model"))
+
+def load_draft_model(model, draft_model_name):
+    """Loads (once per process) a small causal LM sharing the Qwen2 tokenizer, e.g. Qwen/Qwen2-0.5B-Instruct."""
+    key = (draft_model_name, str(model.device), model.dtype)
+    if key not in _draft_models:
+        from transformers import AutoModelForCausalLM
+        print(f"Loading draft model '{draft_model_name}'...")
+        _draft_models[key] = AutoModelForCausalLM.from_pretrained(draft_model_name, torch_dtype=model.dtype).to(model.device).eval()
+    return _draft_models[key]
+
+def _speculative_kwargs(model, speculative):
+    """
+    generate() arguments for assisted decoding. Draft tokens come from n-gram matches against the
+    prompt or from a draft model, and the target model verifies them in a single forward pass. With
+    sampling, transformers samples each position from the target distribution and keeps draft tokens
+    only while they agree (prompt lookup), or uses speculative rejection sampling (draft model). So
+    outputs follow the same distribution as ordinary decoding.
+    """
+    if speculative["mode"] == "prompt_lookup":
+        return {"prompt_lookup_num_tokens": speculative.get("num_tokens", 10), "max_matching_ngram_size": speculative.get("max_ngram_size", 2)}
+    if not speculative.get("draft_model"):
+        raise ValueError("Speculative mode 'draft' needs SPECULATIVE.draft_model in config.json.")
+    draft = load_draft_model(model, speculative["draft_model"])
+    draft.generation_config.num_assistant_tokens = speculative.get("num_tokens", 5)
+    draft.generation_config.num_assistant_tokens_schedule = "heuristic"
+    return {"assistant_model": draft}
+
+class _VerificationCounter:
+    """Forward pre-hook on the target model: counts verification passes and the draft tokens each one checks."""
+    def __init__(self):
+        self.steps = 0
+        self.draft_tokens = 0
+
+    def __call__(self, module, args, kwargs):
+        input_ids = kwargs.get("input_ids", args[0] if args else None)
+        if input_ids is not None:
+            self.steps += 1
+            self.draft_tokens += input_ids.shape[1] - 1
+
+@contextlib.contextmanager
+def _seeded_rng(seed):
+    """Seeds torch's CPU and CUDA RNGs for the block and restores their previous state afterwards."""
+    if seed is None:
+        yield
+        return
+    with torch.random.fork_rng(devices=list(range(torch.cuda.device_count()))):
+        torch.manual_seed(seed)
+        yield
+
+def _rss_mb():
+    import psutil
+    return psutil.Process().memory_info().rss / 2**20
+
+def _memory_stats(device, rss_before_mb):
+    """
+    On CUDA the allocator's peak is reset at the start of each call, so it is the call's own peak.
+    CPU has no per-call peak counter: the call reports how much resident memory it grew by, and the
+    process-lifetime high-water mark is kept under a name that says so.
+    """
+    if device.type == "cuda":
+        return {"peak_memory_mb": torch.cuda.max_memory_allocated(device) / 2**20}
+    import resource
+    return {"rss_delta_mb": _rss_mb() - rss_before_mb, "process_peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024}
+
+def _chrome_trace(profiler):
+    """The profiler's Chrome trace as a JSON object; the temporary export file is removed."""
+    fd, trace_path = tempfile.mkstemp(prefix="vlm_trace_", suffix=".json")
+    os.close(fd)
+    try:
+        profiler.export_chrome_trace(trace_path)
+        with open(trace_path, 'r') as f:
+            return json.load(f)
+    finally:
+        os.remove(trace_path)
+
+def _count_generated(row_ids, eos_token_id):
+    """Tokens a row actually produced: everything up to and including its first EOS."""
+    row_ids = row_ids.tolist()
+    return row_ids.index(eos_token_id) + 1 if eos_token_id in row_ids else len(row_ids)
+
+def run_inference_batch(model, processor, batch_inputs, max_new_tokens=120, stage="inference"):
+    """
+    Runs one padded generate() call over several prompts. max_new_tokens may be a single value or
+    one value per row. Besides 'messages', a row may carry 'vision', 'stop', 'cancel_event', 'seed'
+    and 'profile'; a single-row batch may also carry 'streamer' and 'speculative'.
+
+    Returns (outputs, stats, success). stats holds per-phase timings, token counts, throughput and
+    memory use, and is recorded in the metrics registry under the given stage. On failure
+    stats["error"] carries a short cause label instead of the exception being raised.
+    """
+    if isinstance(max_new_tokens, int):
+        max_new_tokens = [max_new_tokens] * len(batch_inputs)
+    from transformers import StoppingCriteriaList
+    from stopping import PerRowMaxNewTokens, CancelledRows, FirstTokenTimer, StopRule, StopOnRules
+    streamer = batch_inputs[0].get('streamer') if len(batch_inputs) == 1 else None
+    # transformers only supports assisted decoding at batch size 1, so larger batches ignore 'speculative'.
+    speculative = batch_inputs[0].get('speculative') if len(batch_inputs) == 1 else None
+    # A seed applies only when every row shares it; the batching engine runs seeded jobs alone so
+    # unrelated rows cannot perturb the sampled output.
+    seeds = {inputs.get('seed') for inputs in batch_inputs}
+    seed = seeds.pop() if len(seeds) == 1 else None
+    stats = {"stage": stage, "batch_size": len(batch_inputs), "error": None, "seed": seed}
+    profiler = None
+    started = time.perf_counter()
+    rss_before_mb = _rss_mb() if model.device.type != "cuda" else None
+    try:
+        if model.device.type == "cuda":
+            torch.cuda.reset_peak_memory_stats(model.device)
+        # The engine runs profiled jobs alone (batching._Job.solo); the Chrome trace goes in stats["profile_trace"].
+        if any(inputs.get('profile') for inputs in batch_inputs):
+            profiler = torch.profiler.profile(record_shapes=True, profile_memory=True)
+            profiler.__enter__()
+
+        # Rows without a 'vision' VisionHandle have their images encoded here, in one vision-tower pass.
+        handles = [inputs.get('vision') for inputs in batch_inputs]
+        missing = [i for i, inputs in enumerate(batch_inputs) if handles[i] is None and _get_message_image(inputs['messages']) is not None]
+        stats["vision_encode_s"] = 0.0
+        if missing:
+            encoded = encode_images(model, processor, [_get_message_image(batch_inputs[i]['messages']) for i in missing])
+            for i, handle in zip(missing, encoded):
+                handles[i] = handle
+            stats["vision_encode_s"] = sum(handle.preprocess_seconds + handle.encode_seconds for handle in encoded)
+
+        preprocess_started = time.perf_counter()
+        token_lists = _tokenize_prompts(processor, batch_inputs, handles)
+        present = [handle for handle in handles if handle is not None]
+        image_grid_thw = torch.cat([handle.image_grid_thw for handle in present], dim=0) if present else None
+        stats["preprocess_s"] = time.perf_counter() - preprocess_started
+        stats["input_tokens"] = sum(len(ids) for ids in token_lists)
+        stats["visual_tokens"] = sum(int(handle.image_embeds.shape[0]) for handle in present)
+
+        first_token_timer = FirstTokenTimer()
+        # A 'stop' rule from create_stop_rule ends its row at the first sentence boundary or stop string,
+        # and the decoded text is trimmed there below.
+        stop_rules = [StopRule.from_dict(inputs['stop']) if inputs.get('stop') else None for inputs in batch_inputs]
+        generate_kwargs = _speculative_kwargs(model, speculative) if speculative else {}
+        verification = _VerificationCounter()
+        with torch.inference_mode():
+            prefill_started = time.perf_counter()
+            input_ids, attention_mask, prefix_ids = _build_batch(model, processor, token_lists)
+            inputs_embeds = _embed_with_vision(model, input_ids, handles)
+            past_key_values = _prefill(model, input_ids, attention_mask, inputs_embeds, image_grid_thw, prefix_ids)
+            input_token_len = input_ids.shape[1]
+            hook = model.register_forward_pre_hook(verification, with_kwargs=True)
+            try:
+                with _seeded_rng(seed):
+                    generated_ids = model.generate(
+                        input_ids=input_ids, attention_mask=attention_mask, past_key_values=past_key_values,
+                        max_new_tokens=max(max_new_tokens), temperature=0.6, do_sample=True,
+                        top_p=0.9, repetition_penalty=1.15, pad_token_id=processor.tokenizer.eos_token_id,
+                        stopping_criteria=StoppingCriteriaList([
+                            first_token_timer,
+                            PerRowMaxNewTokens(input_token_len, max_new_tokens),
+                            CancelledRows([inputs.get('cancel_event') for inputs in batch_inputs]),
+                            StopOnRules(processor.tokenizer, input_token_len, stop_rules)
+                        ]),
+                        streamer=streamer, **generate_kwargs
+                    )
+            finally:
+                hook.remove()
+            finished = time.perf_counter()
+        for handle in present:
+            handle.uses += 1
+        generated_ids_trimmed = [generated_ids[i, input_token_len:input_token_len + limit] for i, limit in enumerate(max_new_tokens)]
         output_text = processor.batch_decode(generated_ids_trimmed, skip_special_tokens=True)
-        return [text.strip() for text in output_text], 0, True
+        output_text = [rule.truncate(text) if rule is not None else text for rule, text in zip(stop_rules, output_text)]
+
+        first_token_at = first_token_timer.first_token_at or finished
+        stats["prefix_tokens_cached"] = len(prefix_ids)
+        stats["prefill_s"] = first_token_at - prefill_started
+        stats["decode_s"] = finished - first_token_at
+        stats["generated_tokens"] = [_count_generated(row, processor.tokenizer.eos_token_id) for row in generated_ids_trimmed]
+        decoded_after_first = sum(stats["generated_tokens"]) - len(batch_inputs)
+        stats["tokens_per_s"] = decoded_after_first / stats["decode_s"] if stats["decode_s"] > 0 and decoded_after_first > 0 else 0.0
+        stats["decode_steps"] = verification.steps
+        if speculative:
+            # Every verification pass yields one token from the target model plus the draft tokens it accepted.
+            accepted = min(verification.draft_tokens, max(0, stats["generated_tokens"][0] - verification.steps))
+            stats["speculative"] = {
+                "mode": speculative["mode"], "draft_tokens": verification.draft_tokens, "accepted_tokens": accepted,
+                "acceptance_rate": round(accepted / verification.draft_tokens, 4) if verification.draft_tokens else 0.0,
+                "tokens_per_step": round(stats["generated_tokens"][0] / verification.steps, 3) if verification.steps else 0.0,
+            }
+        return [text.strip() for text in output_text], stats, True
     except Exception as e:
-        return None, 0, False
\ No newline at end of file
+        stats["error"] = classify_error(e)
+        stats["error_detail"] = str(e)
+        if streamer is not None:
+            streamer.end()
+        return None, stats, False
+    finally:
+        if profiler is not None:
+            profiler.__exit__(None, None, None)
+            stats["profile_trace"] = _chrome_trace(profiler)
+        stats["total_s"] = time.perf_counter() - started
+        stats.update(_memory_stats(model.device, rss_before_mb))
+        record_inference(stats)
+
+def run_inference(model, processor, inputs, max_new_tokens=120, stage="inference"):
+    """
+    Runs one generation. If inputs carries a 'vision' VisionHandle from encode_image, its cached
+    visual embeddings are spliced into the prompt instead of re-encoding the image. The static
+    chat-template prefix is served from the per-model prefix cache, so prefill only covers the
+    tokens that change per request. Returns (outputs, stats, success) as run_inference_batch does.
+    """
+    return run_inference_batch(model, processor, [inputs], max_new_tokens=max_new_tokens, stage=stage)
@@ -0,0 +1,89 @@
+import threading
+import weakref
+from collections import OrderedDict
+import torch
+
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+
+def _cache_nbytes(legacy_cache):
+    return sum(tensor.numel() * tensor.element_size() for layer in legacy_cache for tensor in layer)
+
+class PrefixCache:
+    """
+    LRU store of prefilled past_key_values keyed on the exact token ids of a fixed chat-template prefix.
+    Entries are kept in the legacy (key, value) tuple layout and copied out per request, so the stored
+    tensors are never mutated by generation. Entries are evicted least-recently-used once max_bytes is
+    exceeded, which bounds memory if the prompt templates change at runtime.
+    """
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.bytes_used = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, prefix_ids):
+        key = tuple(prefix_ids)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, prefix_ids, legacy_cache):
+        key = tuple(prefix_ids)
+        nbytes = _cache_nbytes(legacy_cache)
+        if nbytes > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self.bytes_used -= _cache_nbytes(self._entries.pop(key))
+            self._entries[key] = legacy_cache
+            self.bytes_used += nbytes
+            while self.bytes_used > self.max_bytes and self._entries:
+                _, evicted = self._entries.popitem(last=False)
+                self.bytes_used -= _cache_nbytes(evicted)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.bytes_used = 0
+
+    def stats(self):
+        return {"entries": len(self._entries), "bytes_used": self.bytes_used, "max_bytes": self.max_bytes, "hits": self.hits, "misses": self.misses}
+
+_caches = weakref.WeakKeyDictionary()
+
+def get_prefix_cache(model, max_bytes=DEFAULT_MAX_BYTES):
+    """Returns the prefix cache bound to this model instance, creating it on first use."""
+    cache = _caches.get(model)
+    if cache is None:
+        cache = _caches[model] = PrefixCache(max_bytes=max_bytes)
+    return cache
+
+def prefill_prefix(language_model, prefix_ids, device):
+    """Runs the fixed text-only prefix through the language model once and returns its past_key_values as legacy tuples."""
+    from transformers import DynamicCache
+    input_ids = torch.tensor([prefix_ids], device=device)
+    with torch.inference_mode():
+        outputs = language_model(
+            input_ids=input_ids, attention_mask=torch.ones_like(input_ids),
+            position_ids=torch.arange(len(prefix_ids), device=device).view(1, 1, -1).expand(3, 1, -1),
+            past_key_values=DynamicCache(), use_cache=True
+        )
+    return tuple((key.clone(), value.clone()) for key, value in outputs.past_key_values.to_legacy_cache())
+
+def expand_prefix(legacy_cache, batch_size):
+    """Copies a stored prefix into a fresh DynamicCache with one row per batch entry."""
+    from transformers import DynamicCache
+    return DynamicCache.from_legacy_cache(tuple(
+        (key.expand(batch_size, -1, -1, -1).clone(), value.expand(batch_size, -1, -1, -1).clone())
+        for key, value in legacy_cache
+    ))
@@ -6,9 +6,35 @@ def create_analysis_prompt(image_input):
     messages = [{"role": "system", "content": system_prompt}, {"role": "user", "content": [{"type": "image", "image": image_input}, {"type": "text", "text": user_prompt}]}]
     return "Analyze the provided image for permanent features.", messages
 
-def create_placement_prompt(room_type, style, image_input, room_analysis, furniture_config, style_materials):
+def placement_checklist(room_type, furniture_config):
+    """The essential items the placement sentence must mention; empty for unknown room types."""
+    return list(furniture_config.get(room_type, {}).get("essential", []))
+
+def create_stop_rule(stopping_config, stage, checklist=()):
+    """
+    Early-stopping rule for a stage's single-sentence answer, as the dict run_inference accepts under
+    'stop'. Returns None when the stage has no STOPPING config or it is disabled.
+    """
+    stage_config = stopping_config.get(stage)
+    if not stage_config or not stage_config.get("enabled", True):
+        return None
+    return {
+        "sentence": stage_config.get("sentence", True),
+        "stop_strings": stage_config.get("stop_strings", []),
+        "checklist": list(checklist) if stage_config.get("checklist", False) else [],
+    }
+
+def placement_design_rules(room_type):
+    """The universal rules from design_rules.RULES followed by the room type's own (or the default) rules."""
+    return RULES["universal_absolute"] + RULES.get(room_type, RULES["default"])
+
+def design_rules_enabled(config):
+    """True when config.json asks for design_rules.RULES to be injected into placement prompts."""
+    return config.get("PROMPTS", {}).get("design_rules", False)
+
+def create_placement_prompt(room_type, style, image_input, room_analysis, furniture_config, style_materials, design_rules=()):
     if room_type in furniture_config:
-        essential_furniture = ", ".join(furniture_config[room_type]["essential"])
+        essential_furniture = ", ".join(placement_checklist(room_type, furniture_config))
     else:
         essential_furniture = f"essential furniture for a '{room_type}'"
 
@@ -43,8 +69,51 @@ def create_placement_prompt(room_type, style, image_input, room_analysis, furnit
         f"**- Critical Logic:** First, determine if the door and focal point conflict. If so, use the perpendicular placement strategy. The path from the door MUST be clear.\n"
         f"**- Placement Checklist:** Your single sentence MUST include placement instructions for every item on this list: **{essential_furniture}**. Do not omit any.\n"
         f"**- Style:** {style} (materials: {materials}; colors: {colors}).\n\n"
-        "Generate the complete and spatially correct command string now."
+        + ("**- Design Rules:**\n" + "".join(f"-   {rule}\n" for rule in design_rules) + "\n" if design_rules else "")
+        + "Generate the complete and spatially correct command string now."
     )
 
     messages = [{"role": "system", "content": system_prompt}, {"role": "user", "content": [{"type": "image", "image": image_input}, {"type": "text", "text": user_prompt}]}]
-    return "Generate a rule-aware and non-hallucinatory furniture placement sentence.", messages
\ No newline at end of file
+    return "Generate a rule-aware and non-hallucinatory furniture placement sentence.", messages
+
+def apply_important_prompt(messages, important_prompt):
+    """Appends the user's note to the text of the first user turn."""
+    if not important_prompt:
+        return messages
+    for message in messages:
+        if message['role'] == 'user':
+            for content_part in message['content']:
+                if content_part['type'] == 'text':
+                    content_part['text'] += f"\n\n**Very Important Note:** {important_prompt}"
+                    break
+            break
+    return messages
+
+def max_variants(config):
+    """Upper bound on variants per fan-out request. A fan-out runs as one generate() call, outside BATCHING.max_batch_size."""
+    return config.get("BATCHING", {}).get("max_variants", 8)
+
+def create_variant_placement_prompts(variants, image_input, room_analysis, furniture_config, style_materials, with_design_rules=False):
+    """
+    Builds one placement prompt per variant dict (room_type, style, important_prompt and an optional id)
+    sharing a single room analysis. Returns (key, messages) pairs; keys default to "room_type/style"
+    and are suffixed with the position when two variants would collide.
+    """
+    prompts, seen = [], set()
+    for index, variant in enumerate(variants):
+        room_type = variant.get("room_type", "living room")
+        style = variant.get("style", "industrial")
+        key = variant.get("id") or f"{room_type}/{style}"
+        if key in seen:
+            key = f"{key}#{index}"
+        seen.add(key)
+        design_rules = placement_design_rules(room_type) if with_design_rules else ()
+        _, messages = create_placement_prompt(room_type, style, image_input, room_analysis, furniture_config, style_materials, design_rules)
+        prompts.append((key, apply_important_prompt(messages, variant.get("important_prompt", ""))))
+    return prompts
+
+def create_warmup_prompts():
+    """Prompts whose static chat-template prefixes should be prefilled once per model load."""
+    _, analysis_messages = create_analysis_prompt(None)
+    _, placement_messages = create_placement_prompt("", "", None, "", {}, {})
+    return [analysis_messages, placement_messages]
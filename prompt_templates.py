@@ -0,0 +1,236 @@
+import os
+import re
+import json
+import time
+import hashlib
+import weakref
+import threading
+from prompt_engineering import create_analysis_prompt, create_placement_prompt, apply_important_prompt, placement_design_rules, design_rules_enabled
+
+# A newline run followed by a non-space character always ends a pre-token in Qwen2's byte-level BPE
+# (no pre-token pattern continues past it), so text split there tokenizes to the same ids piecewise.
+_LINE_BOUNDARY = re.compile(r"(?<=\n)(?=\S)")
+_SLOT = re.compile(r"<<slot(\d+)>>")
+# Stand-ins for the per-request text while compiling; chunks containing them are not kept.
+_PROBE_ANALYSIS = "The room has white walls, a wooden floor, a window on the back wall and a door on the left."
+_PROBE_NOTE = "Keep the window clear."
+
+def _message_texts(messages):
+    for message in messages:
+        if isinstance(message['content'], str):
+            yield message['content']
+        else:
+            for part in message['content']:
+                if part['type'] == 'text':
+                    yield part['text']
+
+def _with_texts(messages, texts):
+    texts = iter(texts)
+    copied = []
+    for message in messages:
+        if isinstance(message['content'], str):
+            copied.append({**message, 'content': next(texts)})
+        else:
+            copied.append({**message, 'content': [{**part, 'text': next(texts)} if part['type'] == 'text' else part for part in message['content']]})
+    return copied
+
+def _known_prompts(config):
+    """
+    The analysis prompt and every placement prompt config.json can produce (each room type and style,
+    with and without design rules and an important note), with probe text in the per-request slots.
+    """
+    furniture_config, style_materials = config.get("FURNITURE_CONFIG", {}), config.get("STYLE_MATERIALS", {})
+    with_rules = (False, True) if design_rules_enabled(config) else (False,)
+    placement = []
+    for room_type in furniture_config:
+        for style in style_materials:
+            for rules in with_rules:
+                design_rules = placement_design_rules(room_type) if rules else ()
+                for note in ("", _PROBE_NOTE):
+                    _, messages = create_placement_prompt(room_type, style, None, _PROBE_ANALYSIS, furniture_config, style_materials, design_rules)
+                    placement.append(apply_important_prompt(messages, note))
+    return [create_analysis_prompt(None)[1]], placement
+
+def _shape(messages):
+    return tuple((message['role'], 'str' if isinstance(message['content'], str) else tuple(part['type'] for part in message['content'])) for message in messages)
+
+class PromptCompiler:
+    """
+    Turns chat messages into prompt token ids without rendering the Jinja chat template or running
+    BPE over text it has seen before. The template is rendered once per message shape with
+    placeholder slots, leaving literal pieces that the message texts are spliced between. The
+    rendered prompt is cut at special tokens and at line boundaries; chunks compiled from config.json
+    (system prompts, checklist, style and design-rule lines for every known room type and style)
+    are looked up, and only the rest (the room analysis and the user's note) is tokenized.
+
+    The ids match tokenizing the full rendered text; compile() checks this for every known prompt and
+    leaves the compiler disabled, so run_inference falls back to full tokenization, if any differ.
+    """
+    def __init__(self, processor):
+        self.processor = processor
+        self.tokenizer = processor.tokenizer
+        self.hits = 0
+        self.misses = 0
+        self.compiled_at = None
+        # (segments, enabled), only ever replaced as a whole so readers never see a mix of two compiles.
+        self._state = ({}, False)
+        self._skeletons = {}
+        self._special_tokens = set(self.tokenizer.get_added_vocab())
+        self._special = re.compile("(" + "|".join(re.escape(token) for token in sorted(self._special_tokens, key=len, reverse=True)) + ")")
+
+    @property
+    def enabled(self):
+        return self._state[1]
+
+    def disable(self):
+        self._state = (self._state[0], False)
+
+    def _skeleton(self, messages):
+        """Literal template pieces around each message text, or None when the template does not splice texts verbatim."""
+        shape = _shape(messages)
+        if shape not in self._skeletons:
+            slotted = _with_texts(messages, (f"<<slot{i}>>" for i in range(len(list(_message_texts(messages))))))
+            rendered = self.processor.apply_chat_template(slotted, tokenize=False, add_generation_prompt=True)
+            parts = _SLOT.split(rendered)
+            in_order = [int(index) for index in parts[1::2]] == list(range(len(parts) // 2))
+            self._skeletons[shape] = parts[0::2] if in_order else None
+        return self._skeletons[shape]
+
+    def render(self, messages):
+        """The chat-template text for messages, as apply_chat_template(..., add_generation_prompt=True) renders it."""
+        skeleton = self._skeleton(messages)
+        if skeleton is None:
+            return self.processor.apply_chat_template(messages, tokenize=False, add_generation_prompt=True)
+        pieces = [skeleton[0]]
+        for text, literal in zip(_message_texts(messages), skeleton[1:]):
+            pieces.append(text)
+            pieces.append(literal)
+        return "".join(pieces)
+
+    def _chunks(self, text):
+        for piece in self._special.split(text):
+            if piece in self._special_tokens:
+                yield piece
+            elif piece:
+                yield from _LINE_BOUNDARY.split(piece)
+
+    def _encode(self, messages, segments):
+        chunks = list(self._chunks(self.render(messages)))
+        found = [segments.get(chunk) for chunk in chunks]
+        missing = [chunk for chunk, ids in zip(chunks, found) if ids is None]
+        tokenized = iter(self.tokenizer(missing, add_special_tokens=False)["input_ids"] if missing else [])
+        token_ids = []
+        for ids in found:
+            token_ids.extend(ids if ids is not None else next(tokenized))
+        return token_ids, len(chunks), len(missing)
+
+    def encode(self, messages):
+        """
+        Token ids of the rendered prompt, with a single <|image_pad|> per image as the text path has
+        before expansion, or None if the compiler is disabled.
+        """
+        segments, enabled = self._state
+        if not enabled:
+            return None
+        token_ids, num_chunks, num_missing = self._encode(messages, segments)
+        self.hits += num_chunks - num_missing
+        self.misses += num_missing
+        return token_ids
+
+    def compile(self, config):
+        """
+        Rebuilds the chunk table from config.json and verifies every known prompt against full
+        tokenization. The new table and its enabled flag replace the old state in a single assignment,
+        so it can run while requests are being served. Returns the compile stats.
+        """
+        started = time.perf_counter()
+        analysis, placement = _known_prompts(config)
+        prompts = analysis + placement
+        texts = [self.render(messages) for messages in prompts]
+        chunks = sorted({chunk for text in texts for chunk in self._chunks(text) if _PROBE_ANALYSIS not in chunk and _PROBE_NOTE not in chunk})
+        segments = dict(zip(chunks, self.tokenizer(chunks, add_special_tokens=False)["input_ids"])) if chunks else {}
+        expected = self.tokenizer([self.processor.apply_chat_template(messages, tokenize=False, add_generation_prompt=True) for messages in prompts])["input_ids"]
+        mismatched = sum(self._encode(messages, segments)[0] != ids for messages, ids in zip(prompts, expected))
+        self._state = (segments, mismatched == 0)
+        self.compiled_at = time.time()
+        if mismatched:
+            print(f"Prompt templates disabled: {mismatched} of {len(prompts)} compiled prompts differ from full tokenization.")
+        return {"prompts": len(prompts), "segments": len(segments), "mismatched": mismatched, "enabled": self.enabled, "compile_s": round(time.perf_counter() - started, 3)}
+
+    def stats(self):
+        segments, enabled = self._state
+        lookups = self.hits + self.misses
+        return {
+            "enabled": enabled, "segments": len(segments), "hits": self.hits, "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0, "compiled_at": self.compiled_at
+        }
+
+_compilers = weakref.WeakKeyDictionary()
+
+def get_prompt_compiler(processor):
+    """Returns the prompt compiler bound to this processor instance, creating it (disabled) on first use."""
+    compiler = _compilers.get(processor)
+    if compiler is None:
+        compiler = _compilers[processor] = PromptCompiler(processor)
+    return compiler
+
+def prompt_versions(processor, config):
+    """
+    Digests of the rendered analysis and placement templates, chat template included. They key the
+    analysis and response caches, so any change to the prompt text invalidates entries by itself.
+    """
+    compiler = get_prompt_compiler(processor)
+    versions = {}
+    for stage, prompts in zip(("analysis", "placement"), _known_prompts(config)):
+        digest = hashlib.sha256()
+        for messages in prompts:
+            digest.update(compiler.render(messages).encode())
+            digest.update(b"\0")
+        versions[stage] = digest.hexdigest()[:12]
+    return versions
+
+def compile_prompt_templates(processor, config):
+    """Compiles the processor's prompt templates from config unless PROMPTS.precompile is false."""
+    compiler = get_prompt_compiler(processor)
+    if not config.get("PROMPTS", {}).get("precompile", True):
+        compiler.disable()
+        return compiler.stats()
+    return compiler.compile(config)
+
+class ConfigWatcher:
+    """
+    Re-reads a JSON config file when its modification time changes, checking at most every
+    interval_s seconds. A file that does not parse (for instance, half-written) is ignored and
+    re-read on a later poll. An interval of 0 disables reloading.
+    """
+    def __init__(self, path, interval_s=5.0):
+        self.path = path
+        self.interval_s = interval_s
+        self.reloads = 0
+        self._mtime = os.stat(path).st_mtime_ns
+        self._checked = time.monotonic()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, config, path="config.json"):
+        return cls(path, interval_s=config.get("PROMPTS", {}).get("reload_interval_s", 5.0))
+
+    def poll(self):
+        """Returns the new config if the file changed since the last successful read, otherwise None."""
+        with self._lock:
+            now = time.monotonic()
+            if not self.interval_s or now - self._checked < self.interval_s:
+                return None
+            self._checked = now
+            try:
+                mtime = os.stat(self.path).st_mtime_ns
+                if mtime == self._mtime:
+                    return None
+                with open(self.path, 'r') as f:
+                    config = json.load(f)
+            except (OSError, ValueError) as e:
+                print(f"Config reload skipped: {e}")
+                return None
+            self._mtime = mtime
+            self.reloads += 1
+            return config
@@ -0,0 +1,115 @@
+import json
+import time
+import asyncio
+import hashlib
+import threading
+from collections import OrderedDict
+
+# Config sections whose contents change what a request generates; any edit to them changes the version.
+VERSIONED_CONFIG_SECTIONS = ("FURNITURE_CONFIG", "STYLE_MATERIALS", "PROMPTS", "STOPPING", "SPECULATIVE", "IMAGE_PREPROCESSING", "MODEL")
+
+def _normalize_text(value):
+    return " ".join(str(value or "").split())
+
+def normalize_params(**params):
+    """Collapses whitespace, and case for room_type and style, so trivially different requests share a key."""
+    normalized = {}
+    for key, value in params.items():
+        if isinstance(value, str):
+            value = _normalize_text(value)
+            if key in ("room_type", "style"):
+                value = value.lower()
+        elif isinstance(value, list):
+            value = [normalize_params(**item) if isinstance(item, dict) else item for item in value]
+        normalized[key] = value
+    return normalized
+
+def response_version(config, model_name, prompt_versions):
+    """
+    Short digest of everything besides the request that shapes a response: the model, the prompt
+    versions from prompt_templates.prompt_versions and the generation-relevant sections of config.json.
+    """
+    material = {"model": model_name, "prompts": prompt_versions, "config": {section: config.get(section) for section in VERSIONED_CONFIG_SECTIONS}}
+    return hashlib.sha256(json.dumps(material, sort_keys=True).encode()).hexdigest()[:16]
+
+def response_key(kind, image_hash, params, version):
+    return hashlib.sha256(json.dumps([kind, image_hash, params, version], sort_keys=True).encode()).hexdigest()
+
+class ResponseCache:
+    """Completed responses by response_key, with per-entry TTL and LRU eviction beyond max_entries."""
+    def __init__(self, ttl_seconds=3600, max_entries=4096):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, config):
+        """Returns None when RESPONSE_CACHE is missing or disabled."""
+        cache_config = config.get("RESPONSE_CACHE", {})
+        if not cache_config.get("enabled", False):
+            return None
+        return cls(ttl_seconds=cache_config.get("ttl_s", 3600), max_entries=cache_config.get("max_entries", 4096))
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] <= time.monotonic():
+                del self._entries[key]
+                self.expired += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, response):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl_seconds, response)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries), "max_entries": self.max_entries, "ttl_s": self.ttl_seconds, "hits": self.hits,
+            "misses": self.misses, "expired": self.expired, "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0
+        }
+
+class RequestCoalescer:
+    """
+    Lets concurrent identical requests share one in-flight computation. The first caller for a key
+    runs it; callers arriving before it finishes wait for the same result (or exception) instead of
+    starting their own. Nothing is kept once the computation completes; that is ResponseCache's job.
+    """
+    def __init__(self):
+        self.coalesced = 0
+        self._lock = threading.Lock()
+        self._inflight = {}
+
+    async def run(self, key, make_coroutine):
+        """make_coroutine() is only called by the first caller for the key. Returns (result, coalesced)."""
+        leader = False
+        with self._lock:
+            task = self._inflight.get(key)
+            if task is None:
+                task = self._inflight[key] = asyncio.ensure_future(make_coroutine())
+                task.add_done_callback(lambda _: self._forget(key))
+                leader = True
+            else:
+                self.coalesced += 1
+        # shield: one caller disconnecting must not cancel the work the others are waiting on.
+        return await asyncio.shield(task), not leader
+
+    def _forget(self, key):
+        with self._lock:
+            self._inflight.pop(key, None)
+
+    def stats(self):
+        return {"in_flight": len(self._inflight), "coalesced": self.coalesced}
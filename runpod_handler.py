@@ -1,68 +1,153 @@
-import runpod
+import os
 import json
-from model_utils import setup_environment, load_model_adaptive, load_processor, run_inference, validate_and_process_image_input
-from prompt_engineering import create_analysis_prompt, create_placement_prompt
+import time
+import queue
+import asyncio
+import threading
+import torch
+import runpod
+from model_utils import setup_environment, load_model_and_processor, make_streamer, configure_image_budget, prepare_image, validate_and_process_image_input
+from batching import QueueFullError, DeadlineExceededError
+from worker_pool import serving_replicas
+from metrics import record_error
+from prompt_engineering import max_variants
+from design_pipeline import DesignPipeline, PipelineError, request_params
 
-model, processor, config = None, None, None
+pipeline = None
+pipeline_loop = None
 
 def load_essentials():
-    global model, processor, config
+    """Loads the model and pipeline on the first job; later calls only apply config.json edits between jobs."""
+    global pipeline, pipeline_loop
     
-    if model is None or processor is None:
-        setup_environment()
-        model, _, _ = load_model_adaptive()
-        processor = load_processor()
-
-    if config is None:
+    if pipeline is None:
         try:
             with open("config.json", 'r') as f:
                 config = json.load(f)
         except FileNotFoundError:
             raise RuntimeError("FATAL: config.json not found.")
+        setup_environment()
+        if serving_replicas(config) > 1: torch.set_num_threads(1)
+        model, processor = load_model_and_processor(config)
+        configure_image_budget(processor, config.get("IMAGE_PREPROCESSING", {}))
+        pipeline = DesignPipeline(model, processor, config)
+        # Concurrent jobs share one loop, so identical jobs coalesce onto the same in-flight computation.
+        pipeline_loop = asyncio.new_event_loop()
+        threading.Thread(target=pipeline_loop.run_forever, name="pipeline-loop", daemon=True).start()
+    pipeline.reload()
 
-def handler(job):
-    job_input = job.get('input', {})
-    load_essentials()
+def run_pipeline(coroutine):
+    """Runs a DesignPipeline coroutine on the pipeline loop and blocks until it finishes."""
+    return asyncio.run_coroutine_threadsafe(coroutine, pipeline_loop).result()
 
+def load_room_image(job_input):
+    """Validates the image and resizes it to its pixel budget. Returns (image, error)."""
     image_url = job_input.get("image_url")
     image_base64 = job_input.get("image_base64")
     
     try:
         image_input = validate_and_process_image_input(image_url=image_url, image_base64=image_base64)
     except ValueError as e:
-        return {"error": f"Image Input Error: {e}"}
+        return None, {"error": f"Image Input Error: {e}"}
+    return prepare_image(pipeline.processor, image_input, job_input.get("max_pixels")), None
 
-    room_type = job_input.get("room_type", "living room")
-    style = job_input.get("style", "industrial")
-    max_tokens = job_input.get("max_tokens", 180)
-    important_prompt = job_input.get("important_prompt", "")
+def request_deadline(job_input):
+    """The job's deadline on time.monotonic(): its timeout_seconds, or SERVING.request_timeout_s as in the API."""
+    timeout = job_input.get("timeout_seconds") or pipeline.config.get("SERVING", {}).get("request_timeout_s", 120)
+    return time.monotonic() + timeout
 
-    furniture_config = config.get("FURNITURE_CONFIG", {})
-    style_materials = config.get("STYLE_MATERIALS", {})
+def error_response(error):
+    response = {"error": str(error)}
+    if getattr(error, "metrics", None):
+        response["metrics"] = error.metrics
+    return response
 
-    _, analysis_messages = create_analysis_prompt(image_input)
-    analysis_output, _, success = run_inference(model, processor, {'messages': analysis_messages}, max_new_tokens=100)
-    if not success or not analysis_output:
-        return {"error": "Failed to analyze the room image."}
-    room_analysis = analysis_output[0]
+def handler(job):
+    """
+    Fan-out jobs carry "variants": [{"room_type", "style", "important_prompt", "id"?, "max_tokens"?}]; the room
+    is analyzed once and all variants are generated in one batched call. Identical jobs running at the same
+    time share one computation; completed ones may come from the response cache.
+    """
+    job_input = job.get('input', {})
+    load_essentials()
 
-    _, placement_messages = create_placement_prompt(room_type, style, image_input, room_analysis, furniture_config, style_materials)
+    if len(job_input.get("variants") or []) > max_variants(pipeline.config):
+        return {"error": f"At most {max_variants(pipeline.config)} variants are allowed per job."}
 
-    if important_prompt:
-        for message in placement_messages:
-            if message['role'] == 'user':
-                for content_part in message['content']:
-                    if content_part['type'] == 'text':
-                        content_part['text'] += f"\n\n**Very Important Note:** {important_prompt}"
-                        break
-                break
+    image_input, error = load_room_image(job_input)
+    if error:
+        return error
 
-    final_output, _, success = run_inference(model, processor, {'messages': placement_messages}, max_new_tokens=max_tokens)
-    
-    if success and final_output:
-        return {"suggestion": final_output[0]}
-    else:
-        return {"error": "Failed to generate a final placement suggestion."}
+    deadline = request_deadline(job_input)
+    params = request_params(job_input)
+    try:
+        if params.get("variants"):
+            key = pipeline.response_key("batch", image_input, params)
+            return run_pipeline(pipeline.cached_response("variants_handler", params, key, lambda: pipeline.design_batch(image_input, params, deadline), deadline))
+        key = pipeline.response_key("design", image_input, params)
+        design = run_pipeline(pipeline.cached_response("handler", params, key, lambda: pipeline.design(image_input, params, deadline), deadline))
+    except (PipelineError, QueueFullError, DeadlineExceededError) as e:
+        return error_response(e)
+    return {"suggestion": design["suggestion"], "metrics": design["metrics"]}
+
+def stream_handler(job):
+    """Generator variant of handler: yields the room analysis, then placement text chunks as they are decoded."""
+    job_input = job.get('input', {})
+    load_essentials()
+
+    deadline = request_deadline(job_input)
+    image_input, error = load_room_image(job_input)
+    if error:
+        yield error
+        return
+    params = request_params(job_input)
+    key = pipeline.response_key("design", image_input, params)
+    design = pipeline.cached_lookup("stream_handler", params, key)
+    if design is not None:
+        yield {"stage": "analysis", "room_analysis": design["room_analysis"]}
+        yield {"token": design["suggestion"]}
+        yield {"suggestion": design["suggestion"], "metrics": design["metrics"]}
+        return
+
+    try:
+        vision, room_analysis, placement_messages, analysis_metrics = run_pipeline(pipeline.prepare_placement(image_input, params, deadline))
+    except (PipelineError, QueueFullError, DeadlineExceededError) as e:
+        yield error_response(e)
+        return
+    yield {"stage": "analysis", "room_analysis": room_analysis}
+
+    inputs = pipeline.placement_inputs(params, vision, placement_messages)
+    inputs['streamer'] = streamer = make_streamer(pipeline.processor, timeout=pipeline.config.get("SERVING", {}).get("request_timeout_s", 120), stop=inputs['stop'])
+    inputs['cancel_event'] = cancel_event = threading.Event()
+    try:
+        future = pipeline.engine.submit("placement", inputs, max_new_tokens=params["max_tokens"], deadline=deadline)
+    except QueueFullError as e:
+        record_error("placement", "queue_full")
+        yield error_response(e)
+        return
+    try:
+        for text in streamer:
+            if text:
+                yield {"token": text}
+        final_output, stats, success = future.result()
+        if success and final_output:
+            design = {"room_analysis": room_analysis, "suggestion": final_output[0], "metrics": {"analysis": analysis_metrics, "placement": stats}}
+            pipeline.cache_response("stream_handler", params, key, design)
+            yield {"suggestion": design["suggestion"], "metrics": design["metrics"]}
+        else:
+            yield {"error": "Failed to generate a final placement suggestion."}
+    except QueueFullError as e:
+        record_error("placement", "queue_full")
+        yield error_response(e)
+    except (queue.Empty, DeadlineExceededError):
+        record_error("placement", "deadline")
+        yield {"error": "Request deadline exceeded before inference completed."}
+    finally:
+        cancel_event.set()
+        future.cancel()
 
 if __name__ == "__main__":
-    runpod.serverless.start({"handler": handler})
\ No newline at end of file
+    if os.environ.get("RUNPOD_STREAMING", "0") == "1":
+        runpod.serverless.start({"handler": stream_handler, "return_aggregate_stream": True})
+    else:
+        runpod.serverless.start({"handler": handler})
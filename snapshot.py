@@ -0,0 +1,93 @@
+import os
+import json
+import time
+import argparse
+import torch
+
+WEIGHTS_FILE = "model.safetensors"
+MANIFEST_FILE = "snapshot.json"
+SNAPSHOT_PROFILES = ("auto", "fp32", "bf16")
+TIED_KEYS = ("lm_head.weight",)
+
+def write_snapshot(model, processor, snapshot_dir, model_name, profile):
+    """
+    Writes a load-ready artifact: the weights already in their final dtype as one safetensors file,
+    the model config, the processor/tokenizer files and a manifest with the resolved device map.
+    Quantized profiles are not supported because their modules are not plain tensors.
+    """
+    from safetensors.torch import save_model
+    if profile not in SNAPSHOT_PROFILES:
+        raise ValueError(f"Snapshots support the {', '.join(SNAPSHOT_PROFILES)} profiles, not '{profile}'.")
+    os.makedirs(snapshot_dir, exist_ok=True)
+    save_model(model, os.path.join(snapshot_dir, WEIGHTS_FILE))
+    model.config.save_pretrained(snapshot_dir)
+    if getattr(model, "generation_config", None) is not None:
+        model.generation_config.save_pretrained(snapshot_dir)
+    processor.save_pretrained(snapshot_dir)
+    manifest = {
+        "model_name": model_name,
+        "profile": profile,
+        "dtype": str(model.dtype).replace("torch.", ""),
+        "device_map": getattr(model, "hf_device_map", None) or {"": str(model.device)},
+        "created_at": time.time(),
+    }
+    with open(os.path.join(snapshot_dir, MANIFEST_FILE), 'w') as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+def has_snapshot(snapshot_dir):
+    return bool(snapshot_dir) and os.path.exists(os.path.join(snapshot_dir, MANIFEST_FILE))
+
+def load_snapshot(snapshot_dir):
+    """
+    Builds the model skeleton on the meta device and assigns the memory-mapped safetensors tensors
+    directly as its parameters, so CPU weights are paged in from the file instead of being copied.
+    On CUDA the recorded device map is replayed with accelerate's dispatch_model.
+    """
+    from safetensors import safe_open
+    from transformers import AutoConfig, AutoProcessor, GenerationConfig, Qwen2VLForConditionalGeneration
+    from accelerate import init_empty_weights, dispatch_model
+
+    with open(os.path.join(snapshot_dir, MANIFEST_FILE), 'r') as f:
+        manifest = json.load(f)
+    dtype = getattr(torch, manifest["dtype"])
+    config = AutoConfig.from_pretrained(snapshot_dir)
+    with init_empty_weights():
+        model = Qwen2VLForConditionalGeneration._from_config(config, torch_dtype=dtype)
+
+    with safe_open(os.path.join(snapshot_dir, WEIGHTS_FILE), framework="pt", device="cpu") as f:
+        state_dict = {name: f.get_tensor(name) for name in f.keys()}
+    result = model.load_state_dict(state_dict, strict=False, assign=True)
+    # safetensors stores shared tensors once, so the tied lm_head is the only weight allowed to be absent.
+    missing = [name for name in result.missing_keys if name not in TIED_KEYS]
+    if missing or result.unexpected_keys:
+        raise RuntimeError(f"Snapshot '{snapshot_dir}' does not match the model: missing {missing}, unexpected {result.unexpected_keys}.")
+    model.tie_weights()
+    model.eval()
+    if os.path.exists(os.path.join(snapshot_dir, "generation_config.json")):
+        model.generation_config = GenerationConfig.from_pretrained(snapshot_dir)
+
+    device_map = manifest["device_map"]
+    if torch.cuda.is_available() and any(str(target) not in ("cpu", "disk") for target in device_map.values()):
+        model = dispatch_model(model, device_map=device_map)
+        device = "cuda"
+    else:
+        device = "cpu"
+    processor = AutoProcessor.from_pretrained(snapshot_dir)
+    return model, processor, device, manifest
+
+def main(args):
+    from model_utils import setup_environment, load_model_adaptive, load_processor, resolve_load_profile, DEFAULT_MODEL_NAME
+    setup_environment()
+    profile = resolve_load_profile(args.load_profile)
+    model, _, _ = load_model_adaptive(args.model_name or DEFAULT_MODEL_NAME, profile=profile)
+    processor = load_processor(args.model_name or DEFAULT_MODEL_NAME)
+    manifest = write_snapshot(model, processor, args.output, args.model_name or DEFAULT_MODEL_NAME, profile)
+    print(f"Snapshot written to '{args.output}': {json.dumps(manifest)}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Write a load-ready model snapshot for fast cold starts.", formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument("--output", type=str, required=True, help="Directory to write the snapshot to.")
+    parser.add_argument("--load_profile", type=str, default=None, choices=SNAPSHOT_PROFILES)
+    parser.add_argument("--model_name", type=str, default=None)
+    main(parser.parse_args())
@@ -0,0 +1,157 @@
+import re
+import time
+import torch
+from transformers import StoppingCriteria, TextIteratorStreamer
+
+class PerRowMaxNewTokens(StoppingCriteria):
+    """Finishes each batch row once it has produced its own max_new_tokens."""
+    def __init__(self, prompt_len, limits):
+        self.prompt_len = prompt_len
+        self.limits = limits
+
+    def __call__(self, input_ids, scores, **kwargs):
+        generated = input_ids.shape[1] - self.prompt_len
+        return torch.tensor([generated >= limit for limit in self.limits], device=input_ids.device)
+
+class CancelledRows(StoppingCriteria):
+    """Finishes a row as soon as its 'cancel_event' is set, e.g. when a streaming client disconnects."""
+    def __init__(self, events):
+        self.events = events
+
+    def __call__(self, input_ids, scores, **kwargs):
+        return torch.tensor([event is not None and event.is_set() for event in self.events], device=input_ids.device)
+
+class FirstTokenTimer(StoppingCriteria):
+    """Never stops anything; records when the first new token exists, which separates prefill from decode time."""
+    def __init__(self):
+        self.first_token_at = None
+
+    def __call__(self, input_ids, scores, **kwargs):
+        if self.first_token_at is None:
+            self.first_token_at = time.perf_counter()
+        return torch.zeros(input_ids.shape[0], dtype=torch.bool, device=input_ids.device)
+
+# Words that end in a period without ending the sentence ("approx. 3 ft. from the door").
+ABBREVIATIONS = {"e.g", "i.e", "approx", "ft", "cm", "mm", "vs", "etc", "st", "dr", "mr", "mrs", "ms"}
+# Dotted initials such as "p.m." or "U.S."; a single capital ("wall B.") still ends the sentence.
+_DOTTED_INITIALS = re.compile(r'\b(?:[A-Za-z]\.){2,}$')
+_SENTENCE_END = re.compile(r'[.!?]["\')\]]*(?=\s)')
+
+def _item_pattern(item):
+    stem = item.lower().strip()
+    stem = stem[:-1] if stem.endswith("s") and not stem.endswith("ss") else stem
+    return re.compile(r'\b' + re.escape(stem) + r'(e?s)?\b', re.IGNORECASE)
+
+class StopRule:
+    """
+    When a row should end before max_new_tokens: at the first of its stop_strings, or at the first
+    sentence boundary if sentence is set. A non-empty checklist delays the sentence stop until every
+    item has been mentioned, so an early, incomplete sentence does not cut the answer short.
+    """
+    def __init__(self, sentence=False, stop_strings=(), checklist=()):
+        self.sentence = sentence
+        self.stop_strings = [stop for stop in stop_strings if stop]
+        self.checklist = [_item_pattern(item) for item in checklist]
+
+    @classmethod
+    def from_dict(cls, rule):
+        return cls(rule.get("sentence", False), rule.get("stop_strings", ()), rule.get("checklist", ()))
+
+    def cut_point(self, text):
+        """Index at which text should be cut, or None while generation should continue."""
+        cuts = [text.find(stop) for stop in self.stop_strings if stop in text]
+        if self.sentence:
+            for match in _SENTENCE_END.finditer(text):
+                word = text[:match.start()].rsplit(None, 1)[-1].lower() if text[:match.start()].strip() else ""
+                if word in ABBREVIATIONS or _DOTTED_INITIALS.search(text, 0, match.start() + 1):
+                    continue
+                if all(pattern.search(text, 0, match.end()) for pattern in self.checklist):
+                    cuts.append(match.end())
+                    break
+        return min(cuts) if cuts else None
+
+    def truncate(self, text):
+        cut = self.cut_point(text)
+        return text if cut is None else text[:cut]
+
+class StopOnRules(StoppingCriteria):
+    """
+    Applies each row's StopRule (None for rows without one) to its decoded continuation. Each step
+    decodes only a row's new tokens, plus the few before them that a tokenizer needs to place spaces
+    and finish multi-byte characters, and appends them to the row's running text. Rows that already
+    stopped are not decoded again.
+    """
+    def __init__(self, tokenizer, prompt_len, rules):
+        self.tokenizer = tokenizer
+        self.prompt_len = prompt_len
+        self.rules = rules
+        self.done = [rule is None for rule in rules]
+        self.stopped = [False] * len(rules)
+        self.texts = [""] * len(rules)
+        # Per row: where the decode window starts, and how far the running text has consumed.
+        self.offsets = [(prompt_len, prompt_len)] * len(rules)
+
+    def _decode_new(self, row, input_ids):
+        prefix_offset, read_offset = self.offsets[row]
+        prefix = self.tokenizer.decode(input_ids[row, prefix_offset:read_offset], skip_special_tokens=True)
+        text = self.tokenizer.decode(input_ids[row, prefix_offset:], skip_special_tokens=True)
+        # A trailing U+FFFD is an incomplete character; wait for the tokens that finish it.
+        if len(text) > len(prefix) and not text.endswith("\ufffd"):
+            self.texts[row] += text[len(prefix):]
+            self.offsets[row] = (read_offset, input_ids.shape[1])
+        return self.texts[row]
+
+    def __call__(self, input_ids, scores, **kwargs):
+        for row, rule in enumerate(self.rules):
+            if self.done[row]:
+                continue
+            if rule.cut_point(self._decode_new(row, input_ids)) is not None:
+                self.done[row] = self.stopped[row] = True
+        return torch.tensor(self.stopped, device=input_ids.device)
+
+class StreamCutter:
+    """
+    Releases streamed text only up to a StopRule's cut point. A tail that could still turn into a stop
+    string is held back until later text decides it, so nothing past the cut is ever released.
+    """
+    def __init__(self, rule):
+        self.rule = rule
+        self.text = ""
+        self.sent = 0
+        self.stopped = False
+
+    def feed(self, chunk):
+        if self.stopped:
+            return ""
+        self.text += chunk
+        cut = self.rule.cut_point(self.text)
+        if cut is not None:
+            self.stopped = True
+            return self._release(cut)
+        return self._release(len(self.text) - self._pending_stop())
+
+    def flush(self):
+        return "" if self.stopped else self._release(len(self.text))
+
+    def _pending_stop(self):
+        for size in range(min(len(self.text), max((len(stop) - 1 for stop in self.rule.stop_strings), default=0)), 0, -1):
+            if any(stop.startswith(self.text[-size:]) for stop in self.rule.stop_strings):
+                return size
+        return 0
+
+    def _release(self, end):
+        piece = self.text[self.sent:end] if end > self.sent else ""
+        self.sent = max(self.sent, end)
+        return piece
+
+class StopRuleStreamer(TextIteratorStreamer):
+    """TextIteratorStreamer that yields text only up to the row's StopRule cut point, matching the trimmed final output."""
+    def __init__(self, tokenizer, rule, **kwargs):
+        super().__init__(tokenizer, **kwargs)
+        self.cutter = StreamCutter(rule)
+
+    def on_finalized_text(self, text, stream_end=False):
+        piece = self.cutter.feed(text)
+        if stream_end:
+            piece += self.cutter.flush()
+        super().on_finalized_text(piece, stream_end=stream_end)
@@ -0,0 +1,49 @@
+import time
+import threading
+from types import SimpleNamespace
+import pytest
+from PIL import Image
+from fastapi.testclient import TestClient
+import api
+import batching
+import design_pipeline
+from batching import BatchingEngine
+
+@pytest.fixture
+def full_engine(monkeypatch):
+    """A BatchingEngine whose worker is stuck in a vision encode and whose one queue slot is taken."""
+    release = threading.Event()
+    def blocked_encode(model, processor, images):
+        release.wait()
+        return [None] * len(images)
+    monkeypatch.setattr(batching, "encode_images", blocked_encode)
+    engine = BatchingEngine(None, None, max_batch_size=1, batch_window_ms=0, max_queue_size=1)
+    engine.submit_encode("running")
+    while engine.queue_depth() or not engine.busy:
+        time.sleep(0.01)
+    engine.submit_encode("queued")
+    yield engine
+    release.set()
+    engine.shutdown()
+
+@pytest.fixture
+def client(monkeypatch, full_engine):
+    monkeypatch.setattr(design_pipeline, "compile_prompt_templates", lambda processor, config: {})
+    monkeypatch.setattr(design_pipeline, "prompt_versions", lambda processor, config: {"analysis": "test", "placement": "test"})
+    monkeypatch.setattr(design_pipeline, "create_engine", lambda model, processor, config: full_engine)
+    monkeypatch.setattr(design_pipeline, "ConfigWatcher", SimpleNamespace(from_config=lambda config: SimpleNamespace(interval_s=0, poll=lambda: None)))
+    monkeypatch.setattr(api, "pipeline", design_pipeline.DesignPipeline(None, None, {}))
+    async def room_image(request):
+        return Image.new("RGB", (64, 64), "white")
+    monkeypatch.setattr(api, "fetch_room_image", room_image)
+    return TestClient(api.app)
+
+def test_generate_returns_503_when_the_engine_queue_is_full(client, full_engine):
+    response = client.post("/generate", json={"room_type": "bedroom", "style": "modern"})
+    assert response.status_code == 503
+    assert int(response.headers["Retry-After"]) >= 1
+    assert full_engine.queue_depth() == 1
+
+def test_batch_returns_503_when_the_engine_queue_is_full(client):
+    response = client.post("/generate/batch", json={"variants": [{"room_type": "bedroom", "style": "modern"}]})
+    assert response.status_code == 503
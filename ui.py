@@ -12,14 +12,31 @@ except FileNotFoundError:
     room_types = ["living room", "bedroom", "kitchen", "bathroom"]
     styles = ["scandinavian", "japandi", "modern", "minimalist", "industrial"]
 
-API_URL = "http://127.0.0.1:8000/generate"
+STREAM_API_URL = "http://127.0.0.1:8000/generate/stream"
 
-def get_ai_suggestion(room_type, style, image_url, max_tokens, important_prompt):
+def iter_sse_events(response):
+    """Yields (event, data) pairs from a Server-Sent Events response."""
+    event, data_lines = "message", []
+    for line in response.iter_lines(decode_unicode=True):
+        if line is None:
+            continue
+        if line == "":
+            if data_lines:
+                yield event, json.loads("\n".join(data_lines))
+            event, data_lines = "message", []
+        elif line.startswith("event:"):
+            event = line[len("event:"):].strip()
+        elif line.startswith("data:"):
+            data_lines.append(line[len("data:"):].strip())
+
+def stream_ai_suggestion(room_type, style, image_url, max_tokens, important_prompt):
     """
-    Sends a POST request to the local FastAPI server and returns the AI suggestion.
+    Streams the suggestion from /generate/stream, yielding the text shown so far after each event.
+    Gradio cancels the generator when the user stops it, which closes the connection and stops generation.
     """
     if not image_url:
-        return "Error: Please provide an image URL."
+        yield "Error: Please provide an image URL."
+        return
     
     payload = {
         "room_type": room_type,
@@ -30,22 +47,31 @@ def get_ai_suggestion(room_type, style, image_url, max_tokens, important_prompt)
     }
     
     try:
-        response = requests.post(API_URL, json=payload, timeout=300) 
-        response.raise_for_status() 
-        
-        result = response.json()
-        return result.get("suggestion", "Error: No 'suggestion' key found in API response.")
+        with requests.post(STREAM_API_URL, json=payload, stream=True, timeout=(10, 300)) as response:
+            response.raise_for_status()
+            yield "Analyzing room..."
+            suggestion = ""
+            for event, data in iter_sse_events(response):
+                if event == "stage":
+                    yield "Room analyzed. Generating placement..."
+                elif event == "token":
+                    suggestion += data.get("text", "")
+                    yield suggestion
+                elif event == "done":
+                    yield data.get("suggestion", suggestion)
+                elif event == "error":
+                    yield f"Error: {data.get('detail', 'Unknown error')}"
 
     except requests.exceptions.HTTPError as http_err:
         try:
             detail = http_err.response.json().get("detail", str(http_err))
         except json.JSONDecodeError:
             detail = http_err.response.text
-        return f"HTTP Error: {detail}"
+        yield f"HTTP Error: {detail}"
     except requests.exceptions.RequestException as req_err:
-        return f"API Connection Error: {req_err}\n\nIs the local API server running? In your terminal, run:\nuvicorn api:app --reload"
+        yield f"API Connection Error: {req_err}\n\nIs the local API server running? In your terminal, run:\nuvicorn api:app --reload"
     except Exception as e:
-        return f"An unexpected error occurred: {e}"
+        yield f"An unexpected error occurred: {e}"
 
 with gr.Blocks(theme=gr.themes.Soft(primary_hue=gr.themes.colors.blue, secondary_hue=gr.themes.colors.cyan)) as demo:
     gr.Markdown(
@@ -86,7 +112,7 @@ with gr.Blocks(theme=gr.themes.Soft(primary_hue=gr.themes.colors.blue, secondary
     image_url_textbox.change(lambda x: x, inputs=image_url_textbox, outputs=image_preview)
     
     submit_button.click(
-        fn=get_ai_suggestion,
+        fn=stream_ai_suggestion,
         inputs=[room_type_dropdown, style_dropdown, image_url_textbox, max_tokens_slider, important_prompt_textbox],
         outputs=output_textbox
     )
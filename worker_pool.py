@@ -0,0 +1,327 @@
+import os
+import time
+import pickle
+import weakref
+import itertools
+import threading
+import multiprocessing
+from concurrent.futures import Future
+import torch
+import metrics
+from batching import BatchingEngine, QueueFullError, ENCODE_STAGE
+from model_utils import warm_prefix_cache, make_streamer
+from prompt_engineering import create_warmup_prompts
+from prompt_templates import compile_prompt_templates
+
+def serving_replicas(config):
+    """Replica count from VLM_REPLICAS or SERVING.replicas in config.json; 1 means a single in-process engine."""
+    return int(os.environ.get("VLM_REPLICAS") or config.get("SERVING", {}).get("replicas", 1))
+
+def partition_cores(replicas, threads_per_replica=None, cores=None):
+    """Splits the usable cores into one disjoint, contiguous set per replica."""
+    cores = sorted(cores if cores is not None else os.sched_getaffinity(0))
+    threads_per_replica = threads_per_replica or max(1, len(cores) // replicas)
+    if replicas * threads_per_replica > len(cores):
+        raise ValueError(f"{replicas} replicas x {threads_per_replica} threads needs more than the {len(cores)} available cores.")
+    return [cores[index * threads_per_replica:(index + 1) * threads_per_replica] for index in range(replicas)]
+
+class _ForwardingRegistry:
+    """Stands in for metrics.REGISTRY inside a replica and replays every update into the parent's registry."""
+    def __init__(self, results):
+        self._results = results
+
+    def inc(self, *args, **kwargs):
+        self._results.put(("metric", "inc", args, kwargs))
+
+    def observe(self, *args, **kwargs):
+        self._results.put(("metric", "observe", args, kwargs))
+
+    def gauge(self, *args, **kwargs):
+        pass
+
+class RemoteVision:
+    """
+    Parent-side stand-in for a VisionHandle kept inside a replica: its id and the timings callers
+    report. Jobs that carry one go to that replica, which swaps its own handle back in, so neither the
+    image nor its embeddings cross the process boundary. The replica drops the handle once the
+    stand-in is garbage collected.
+    """
+    def __init__(self, replica, handle_id, preprocess_seconds, encode_seconds):
+        self.replica = replica
+        self.handle_id = handle_id
+        self.preprocess_seconds = preprocess_seconds
+        self.encode_seconds = encode_seconds
+
+def _rows(payload):
+    return payload if isinstance(payload, list) else [payload] if isinstance(payload, dict) else []
+
+def _without_images(messages):
+    return [
+        {**message, 'content': [{**part, 'image': None} if part['type'] == 'image' else part for part in message['content']]}
+        if isinstance(message['content'], list) else message
+        for message in messages
+    ]
+
+def _outbound(payload):
+    """A job's inputs as sent to a replica: rows whose image the replica already holds leave the image behind."""
+    def strip(inputs):
+        inputs = {key: value for key, value in inputs.items() if key not in ('streamer', 'cancel_event')}
+        if isinstance(inputs.get('vision'), RemoteVision):
+            inputs['messages'] = _without_images(inputs['messages'])
+        return inputs
+    if isinstance(payload, list):
+        return [strip(inputs) for inputs in payload]
+    return strip(payload) if isinstance(payload, dict) else payload
+
+def _picklable(error):
+    try:
+        pickle.dumps(error)
+        return error
+    except Exception:
+        return RuntimeError(f"{type(error).__name__}: {error}")
+
+def _replica_main(index, cores, model, processor, config, requests, results):
+    """Entry point of a forked replica: pins itself, warms its prefix cache and serves jobs through a local engine."""
+    os.sched_setaffinity(0, cores)
+    torch.set_num_threads(len(cores))
+    metrics.REGISTRY = _ForwardingRegistry(results)
+    warm_prefix_cache(model, processor, create_warmup_prompts())
+    engine = BatchingEngine.from_config(model, processor, config)
+    timeout = config.get("SERVING", {}).get("request_timeout_s", 120)
+    pending = {}
+    handles = {}
+
+    def forward_tokens(job_id, streamer):
+        for text in streamer:
+            if text:
+                results.put(("token", index, job_id, text))
+
+    def resolve(job_id, future, forwarder=None):
+        # The token relay must drain first so the parent sees every chunk before the result.
+        pending.pop(job_id, None)
+        if forwarder is not None:
+            forwarder.join(timeout=timeout)
+        if future.cancelled():
+            results.put(("result", index, job_id, False, None))
+            return
+        error = future.exception()
+        if error is not None:
+            results.put(("result", index, job_id, False, _picklable(error)))
+            return
+        value = future.result()
+        if hasattr(value, "image_embeds"):
+            handles[job_id] = value
+            value = RemoteVision(index, job_id, value.preprocess_seconds, value.encode_seconds)
+        results.put(("result", index, job_id, True, value))
+
+    print(f"Replica {index} ready on cores {cores}.")
+    while True:
+        message = requests.get()
+        if message is None:
+            break
+        if message[0] == "cancel":
+            local = pending.get(message[1])
+            if local is not None:
+                local[1].set()
+                local[0].cancel()
+            continue
+        if message[0] == "release":
+            handles.pop(message[1], None)
+            continue
+        if message[0] == "reload":
+            try:
+                print(f"Replica {index} prompt templates compiled: {compile_prompt_templates(processor, message[1])}")
+            except Exception as e:
+                print(f"Replica {index} kept its previous prompt templates: {e}")
+            continue
+        _, job_id, kind, stage, payload, max_new_tokens, deadline = message
+        remote = [inputs for inputs in _rows(payload) if isinstance(inputs.get('vision'), RemoteVision)]
+        if any(inputs['vision'].handle_id not in handles for inputs in remote):
+            results.put(("result", index, job_id, False, RuntimeError(f"Replica {index} no longer holds the job's vision handle.")))
+            continue
+        for inputs in remote:
+            inputs['vision'] = handles[inputs['vision'].handle_id]
+        cancel_event = threading.Event()
+        forwarder = None
+        try:
+            if kind == "encode":
+                future = engine.submit_encode(payload, deadline=deadline)
+            elif kind == "group":
+                future = engine.submit_group(stage, payload, max_new_tokens, deadline=deadline)
+            else:
+                if payload.pop('stream', False):
+                    payload['streamer'] = make_streamer(processor, timeout=timeout, stop=payload.get('stop'))
+                    forwarder = threading.Thread(target=forward_tokens, args=(job_id, payload['streamer']), daemon=True)
+                    forwarder.start()
+                payload['cancel_event'] = cancel_event
+                future = engine.submit(stage, payload, max_new_tokens, deadline=deadline)
+        except Exception as e:
+            results.put(("result", index, job_id, False, _picklable(e)))
+            continue
+        pending[job_id] = (future, cancel_event)
+        future.add_done_callback(lambda future, job_id=job_id, forwarder=forwarder: resolve(job_id, future, forwarder))
+    engine.shutdown()
+
+class ReplicaPool:
+    """
+    Serves the model from K forked replica processes, each pinned to its own cores with its own
+    torch thread count and its own BatchingEngine. The parent loads the weights once before forking,
+    so replicas share them copy-on-write (or through the page cache when loaded from a snapshot)
+    instead of holding K copies. The parent must not run the model itself before forking, since
+    OpenMP thread pools do not survive fork.
+
+    It exposes the same submit API as BatchingEngine, so callers do not change. Encoding returns a
+    RemoteVision; jobs that carry it run on the replica holding the handle, and other jobs go to the
+    replica with the fewest outstanding jobs. Each replica takes at most BATCHING.max_queue_size
+    outstanding jobs; submit raises QueueFullError when the chosen replica is at that limit. Streamed
+    text and metrics are relayed from the replicas to the parent.
+    """
+    def __init__(self, model, processor, config, replicas=2, threads_per_replica=None):
+        if "fork" not in multiprocessing.get_all_start_methods():
+            raise RuntimeError("ReplicaPool needs the 'fork' start method to share weights between replicas.")
+        context = multiprocessing.get_context("fork")
+        self.core_sets = partition_cores(replicas, threads_per_replica)
+        self.replica_queue_size = config.get("BATCHING", {}).get("max_queue_size", 32)
+        self.max_queue_size = self.replica_queue_size * replicas
+        self._batch_seconds = 1.0
+        self._ids = itertools.count()
+        self._lock = threading.Lock()
+        self._jobs = {}
+        self._outstanding = [0] * replicas
+        self._closed = False
+        self._results = context.Queue()
+        self._requests = [context.Queue() for _ in range(replicas)]
+        self._processes = [
+            context.Process(target=_replica_main, args=(index, cores, model, processor, config, self._requests[index], self._results), name=f"replica-{index}", daemon=True)
+            for index, cores in enumerate(self.core_sets)
+        ]
+        for process in self._processes:
+            process.start()
+        self._reader = threading.Thread(target=self._read_results, name="replica-results", daemon=True)
+        self._reader.start()
+
+    @classmethod
+    def from_config(cls, model, processor, config):
+        serving_config = config.get("SERVING", {})
+        return cls(model, processor, config, replicas=serving_replicas(config), threads_per_replica=serving_config.get("threads_per_replica"))
+
+    @property
+    def busy(self):
+        return any(self._outstanding)
+
+    def queue_depth(self):
+        with self._lock:
+            return sum(self._outstanding)
+
+    def estimated_wait(self):
+        return self._estimated_wait(self.queue_depth() / len(self._processes))
+
+    def _estimated_wait(self, replica_depth):
+        return max(1, int(round(replica_depth * self._batch_seconds)))
+
+    def _pick(self, payload):
+        for inputs in _rows(payload):
+            if isinstance(inputs.get('vision'), RemoteVision):
+                return inputs['vision'].replica
+        return min(range(len(self._processes)), key=lambda index: self._outstanding[index])
+
+    def _submit(self, kind, stage, payload, max_new_tokens, deadline):
+        future = Future()
+        streamer = payload.get('streamer') if isinstance(payload, dict) else None
+        payload = _outbound(payload)
+        if streamer is not None:
+            payload['stream'] = True
+        with self._lock:
+            # A job pinned to a full replica is rejected here even while the others have room.
+            index = self._pick(payload)
+            if self._outstanding[index] >= self.replica_queue_size:
+                raise QueueFullError(self._estimated_wait(self._outstanding[index]))
+            job_id = next(self._ids)
+            self._outstanding[index] += 1
+            self._jobs[job_id] = (future, index, streamer, time.monotonic())
+        future.add_done_callback(lambda future: future.cancelled() and self._cancel(job_id))
+        self._requests[index].put(("submit", job_id, kind, stage, payload, max_new_tokens, deadline))
+        return future
+
+    def _release(self, index, handle_id):
+        if not self._closed:
+            self._requests[index].put(("release", handle_id))
+
+    def reload_config(self, config):
+        """Has every replica recompile its prompt templates, as the parent does when config.json changes."""
+        for requests in self._requests:
+            requests.put(("reload", config))
+
+    def _cancel(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is not None:
+            self._requests[job[1]].put(("cancel", job_id))
+
+    def _read_results(self):
+        while True:
+            message = self._results.get()
+            if message is None:
+                break
+            if message[0] == "metric":
+                _, method, args, kwargs = message
+                getattr(metrics.REGISTRY, method)(*args, **kwargs)
+            elif message[0] == "token":
+                _, _, job_id, text = message
+                job = self._jobs.get(job_id)
+                if job is not None and job[2] is not None:
+                    job[2].on_finalized_text(text)
+            else:
+                _, index, job_id, ok, value = message
+                with self._lock:
+                    job = self._jobs.pop(job_id, None)
+                    self._outstanding[index] -= 1
+                if ok and isinstance(value, RemoteVision):
+                    # Registered before any early exit so a handle nobody receives is released right away.
+                    weakref.finalize(value, self._release, index, value.handle_id)
+                if job is None:
+                    continue
+                future, _, streamer, submitted_at = job
+                self._batch_seconds = 0.8 * self._batch_seconds + 0.2 * (time.monotonic() - submitted_at)
+                if streamer is not None:
+                    streamer.end()
+                if future.cancelled():
+                    continue
+                if ok:
+                    future.set_result(value)
+                else:
+                    future.set_exception(value)
+
+    def submit_encode(self, image, deadline=None):
+        return self._submit("encode", ENCODE_STAGE, image, None, deadline)
+
+    def submit(self, stage, inputs, max_new_tokens=120, deadline=None):
+        return self._submit("stage", stage, inputs, max_new_tokens, deadline)
+
+    def submit_group(self, stage, batch_inputs, max_new_tokens, deadline=None):
+        return self._submit("group", stage, batch_inputs, max_new_tokens, deadline)
+
+    def encode(self, image):
+        return self.submit_encode(image).result()
+
+    def infer(self, stage, inputs, max_new_tokens=120):
+        return self.submit(stage, inputs, max_new_tokens).result()
+
+    def shutdown(self):
+        self._closed = True
+        for requests in self._requests:
+            requests.put(None)
+        for process in self._processes:
+            process.join(timeout=30)
+        self._results.put(None)
+        self._reader.join()
+
+def create_engine(model, processor, config):
+    """
+    The serving engine for the configured replica count: a ReplicaPool when it is above 1, otherwise a
+    BatchingEngine in this process. The prefix cache is warmed wherever the model will run.
+    """
+    if serving_replicas(config) > 1:
+        return ReplicaPool.from_config(model, processor, config)
+    print(f"Prefix cache warmed: {warm_prefix_cache(model, processor, create_warmup_prompts())}")
+    return BatchingEngine.from_config(model, processor, config)